@@ -11,14 +11,21 @@ if ".." not in sys.path:
     sys.path.append("..")
 
 from src.data_store import DataStore
+from src.versioned_store import VersionedStore
 
 _TEST_JSON = "test_runs/kql_query_db-2022-09-24-02-51-49.json"
-ds = DataStore(json_path=_TEST_JSON)
+# use the memory-mapped binary store, if one has been created
+_TEST_STORE = Path(_TEST_JSON).with_suffix(".kqlstore")
+# readers pin a snapshot - a refreshed store can be published while they read
+if _TEST_STORE.is_file():
+    store = VersionedStore(DataStore.open(_TEST_STORE))
+else:
+    store = VersionedStore(DataStore(json_path=_TEST_JSON))
 
 
 @st.cache(suppress_st_warning=True)
 def load_data(nrows):
-    data = ds.to_df().head(nrows)
+    data = store.snapshot().to_df().head(nrows)
     return data
 
 
@@ -60,8 +67,30 @@ def aggrid_interactive_table(df: pd.DataFrame):
     return selection
 
 
+# query fields shown in the results table and the number of rows per page
+_RESULT_COLUMNS = ["query_name", "source_path", "repo_name", "query", "attributes"]
+_PAGE_SIZE = 100
+
+# attribute: (sidebar header, label, default selection)
+_FILTERS = {
+    "tables": ("Filter by Table Names", "Select Tables to View", ["CommonSecurityLog"]),
+    "operators": (
+        "Filter by KQL Operators",
+        "Select KQL operators to filter by",
+        ["mv-expand"],
+    ),
+    "functioncalls": (
+        "Filter by KQL Function Calls",
+        "Select KQL function calls to filter by",
+        ["series_decompose_anomalies"],
+    ),
+}
+
+
 def main() -> None:
     st.title(":mag_right: Interactive KQL Query Store")
+    # use the same version of the store for the whole page
+    ds = store.snapshot()
 
     data_load_state = st.text("Loading data...")
     data = load_data(5000)
@@ -87,37 +116,47 @@ def main() -> None:
                 mime="json",
             )
 
-    st.sidebar.subheader("Filter by Table Names")
-    tables = ds.get_filter_lists()["tables"]
-    table_selections = st.sidebar.multiselect(
-        "Select Tables to View", options=tables, default="CommonSecurityLog"
-    )
-
-    st.sidebar.subheader("Filter by KQL Operators")
-
-    operators = ds.get_filter_lists()["operators"]
-    operator_selections = st.sidebar.multiselect(
-        "Select KQL operators to filter by", options=operators, default="mv-expand"
-    )
-
-    st.sidebar.subheader("Filter by KQL Function Calls")
-
-    func_calls = ds.get_filter_lists()["functioncalls"]
-    func_calls_selections = st.sidebar.multiselect(
-        "Select KQL function calls to filter by",
-        options=func_calls,
-        default="series_decompose_anomalies",
-    )
+    # the counts for each filter are for the queries matching the other
+    # filters, so only options that return results are shown
+    criteria = {
+        attrib: {"any": st.session_state.get(attrib, default)}
+        for attrib, (_, _, default) in _FILTERS.items()
+    }
+    facets = ds.get_facets(list(_FILTERS), disjunctive=True, **criteria)
+    for attrib, (header, label, default) in _FILTERS.items():
+        st.sidebar.subheader(header)
+        counts = facets.get(attrib, {})
+        # current and default selections must be in the options
+        selected = dict.fromkeys([*criteria[attrib]["any"], *default])
+        st.sidebar.multiselect(
+            label,
+            options=list(counts) + [value for value in selected if value not in counts],
+            default=default,
+            format_func=lambda value, counts=counts: f"{value} ({counts.get(value, 0)})",
+            key=attrib,
+        )
 
     result = ds.find_queries(
         # query_name={"contains": "time series"},
-        tables=table_selections,  # the list values are OR'd - so will return UNION
-        operators=operator_selections,  # the list values are OR'd - so will return UNION
-        functioncalls=func_calls_selections,
+        **criteria,  # the list values are OR'd - so will return UNION
     )
 
     st.subheader("Filtered Results matching criteria")
-    selection = aggrid_interactive_table(df=result)
+    # only the rows and columns of the selected page are read from the store
+    page_count = max((result.total + _PAGE_SIZE - 1) // _PAGE_SIZE, 1)
+    page = st.number_input(
+        f"Page (of {page_count}, {result.total} queries)",
+        min_value=1,
+        max_value=page_count,
+        value=1,
+    )
+    page_df = (
+        result.order_by("query_name")
+        .select(*_RESULT_COLUMNS)
+        .page(int(page) - 1, _PAGE_SIZE)
+        .to_df()
+    )
+    selection = aggrid_interactive_table(df=page_df)
 
     if selection:
         st.write("You selected:")
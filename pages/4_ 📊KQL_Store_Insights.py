@@ -1,6 +1,7 @@
 import streamlit as st
 import pandas as pd
 import sys
+from pathlib import Path
 
 import altair as alt
 
@@ -10,7 +11,12 @@ if ".." not in sys.path:
 from src.data_store import DataStore
 
 _TEST_JSON = "test_runs/kql_query_db-2022-09-24-02-51-49.json"
-ds = DataStore(json_path=_TEST_JSON)
+# use the memory-mapped binary store, if one has been created
+_TEST_STORE = Path(_TEST_JSON).with_suffix(".kqlstore")
+if _TEST_STORE.is_file():
+    ds = DataStore.open(_TEST_STORE)
+else:
+    ds = DataStore(json_path=_TEST_JSON)
 
 
 @st.cache(suppress_st_warning=True)
@@ -0,0 +1,168 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+Binary, memory-mappable file format for named arrays.
+
+File layout
+-----------
+- 8 byte magic (``KQLSTORE``)
+- uint64 (little-endian) length of the header
+- UTF-8 JSON header - format version, user metadata and, for each
+  array, its dtype, shape and byte offset in the file
+- array data, each array aligned to 64 bytes
+
+Arrays are read with `np.frombuffer` over a read-only `mmap` of the
+file so opening the file does not read (or copy) the array data.
+Pages are loaded on demand and are shared between processes that
+map the same file.
+
+"""
+import json
+import mmap
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Tuple, Union
+
+import numpy as np
+
+__author__ = "Ian Hellen"
+
+_MAGIC = b"KQLSTORE"
+_VERSION = 1
+_ALIGN = 64
+
+
+class StoreFormatError(ValueError):
+    """The file is not a valid binary store file."""
+
+
+def _align(offset: int) -> int:
+    """Return `offset` rounded up to the array alignment."""
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_arrays(
+    file_path: Union[str, Path],
+    arrays: Dict[str, np.ndarray],
+    metadata: Dict[str, Any],
+):
+    """
+    Write named arrays to a binary store file.
+
+    Parameters
+    ----------
+    file_path : Union[str, Path]
+        The path of the file to write.
+    arrays : Dict[str, np.ndarray]
+        Mapping of name to (numeric or bool) array.
+    metadata : Dict[str, Any]
+        JSON-serializable metadata saved in the file header.
+
+    Notes
+    -----
+    The file is written to a temporary file in the same folder that
+    then replaces `file_path`. Processes that have the previous file
+    open (memory-mapped) keep reading the previous version.
+
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype.hasobject:
+            raise TypeError(f"Array {name} has an object dtype.")
+    # the array offsets are relative to the (aligned) end of the header
+    array_info = {}
+    offset = 0
+    for name, array in arrays.items():
+        array_info[name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset = _align(offset + array.nbytes)
+    header = json.dumps(
+        {"version": _VERSION, "metadata": metadata, "arrays": array_info}
+    ).encode("utf-8")
+    data_start = _align(len(_MAGIC) + 8 + len(header))
+
+    file_path = Path(file_path)
+    temp_fd, temp_path = tempfile.mkstemp(
+        prefix=f".{file_path.name}.", suffix=".tmp", dir=file_path.parent
+    )
+    try:
+        with os.fdopen(temp_fd, "wb") as out_file:
+            out_file.write(_MAGIC)
+            out_file.write(np.uint64(len(header)).astype("<u8").tobytes())
+            out_file.write(header)
+            for name, array in arrays.items():
+                out_file.seek(data_start + array_info[name]["offset"])
+                out_file.write(array.tobytes())
+            # make sure the file includes the padding of the last array
+            out_file.truncate(data_start + offset)
+            out_file.flush()
+            os.fsync(out_file.fileno())
+        # keep the permissions of the file being replaced (mkstemp uses 0600)
+        os.chmod(
+            temp_path, file_path.stat().st_mode & 0o777 if file_path.exists() else 0o644
+        )
+        os.replace(temp_path, file_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+def open_arrays(
+    file_path: Union[str, Path]
+) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """
+    Open a binary store file.
+
+    Parameters
+    ----------
+    file_path : Union[str, Path]
+        The path of the file to open.
+
+    Returns
+    -------
+    Tuple[Dict[str, np.ndarray], Dict[str, Any]]
+        Mapping of name to read-only array (backed by a memory map
+        of the file) and the metadata saved with the arrays.
+
+    Raises
+    ------
+    StoreFormatError
+        If the file is not a binary store file or is a different
+        version.
+
+    """
+    with open(file_path, "rb") as in_file:
+        if in_file.read(len(_MAGIC)) != _MAGIC:
+            raise StoreFormatError(f"{file_path} is not a binary store file.")
+        # the mapping remains valid after the file is closed
+        buffer = mmap.mmap(in_file.fileno(), 0, access=mmap.ACCESS_READ)
+    header_len = int(np.frombuffer(buffer, dtype="<u8", count=1, offset=len(_MAGIC))[0])
+    header_start = len(_MAGIC) + 8
+    try:
+        header = json.loads(buffer[header_start : header_start + header_len])
+    except ValueError as err:
+        raise StoreFormatError(f"{file_path} has an invalid header.") from err
+    if header.get("version") != _VERSION:
+        raise StoreFormatError(
+            f"{file_path} has unsupported version {header.get('version')}."
+        )
+    data_start = _align(header_start + header_len)
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        shape = tuple(info["shape"])
+        count = int(np.prod(shape, dtype=np.int64))
+        if not count:
+            arrays[name] = np.empty(shape, dtype=dtype)
+            continue
+        arrays[name] = np.frombuffer(
+            buffer, dtype=dtype, count=count, offset=data_start + info["offset"]
+        ).reshape(shape)
+    return arrays, header["metadata"]
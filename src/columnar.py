@@ -0,0 +1,742 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Columnar storage for DataStore records."""
+import json
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+__author__ = "Ian Hellen"
+
+# pylint: disable=too-few-public-methods
+
+
+def _grow(array: np.ndarray, size: int) -> np.ndarray:
+    """Return (writable) `array` with capacity for at least `size` items."""
+    if size <= len(array) and array.flags.writeable:
+        return array
+    new_array = np.empty(max(size, 2 * len(array), 16), dtype=array.dtype)
+    new_array[: len(array)] = array
+    return new_array
+
+
+def _writable(array: np.ndarray) -> np.ndarray:
+    """Return `array` or a copy of it, if it is read-only (e.g. memory-mapped)."""
+    return array if array.flags.writeable else array.copy()
+
+
+def _share(array: np.ndarray) -> np.ndarray:
+    """
+    Return `array` marked read-only so that it can be shared by column copies.
+
+    Writes to a read-only array copy it first (see `_grow` and
+    `_writable`), so neither the column nor its copy see the
+    changes made by the other.
+
+    """
+    array.flags.writeable = False
+    return array
+
+
+def encode_json_heap(values: Sequence[Any]) -> Dict[str, np.ndarray]:
+    """
+    Return `values` encoded as a JSON heap.
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        "heap" - uint8 array of comma-terminated JSON values and
+        "offsets" - int64 array of the start of each value in the heap
+        (with a trailing end offset).
+
+    """
+    encoded = [json.dumps(value).encode("utf-8") + b"," for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(item) for item in encoded])
+    return {
+        "heap": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "offsets": offsets,
+    }
+
+
+def decode_json_heap(heap: np.ndarray) -> List[Any]:
+    """Return all of the values in a JSON heap."""
+    # the comma-terminated values only need the brackets to be a JSON array
+    return json.loads(b"[" + heap.tobytes()[:-1] + b"]") if len(heap) else []
+
+
+def _object_array(values: Sequence[Any]) -> np.ndarray:
+    """Return a 1-D object array of `values` (lists are not expanded)."""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+class ObjectColumn:
+    """Column of arbitrary Python objects."""
+
+    kind = "object"
+
+    def __init__(self):
+        """Initialize the column."""
+        self._values = np.empty(0, dtype=object)
+        self._size = 0
+        # JSON heap of (not yet decoded) values, if loaded from buffers
+        self._heap: Optional[Dict[str, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self._size
+
+    def __getitem__(self, row: int) -> Any:
+        """Return the value for `row`."""
+        # read the heap once - it may be decoded by another thread
+        heap = self._heap
+        if heap is not None:
+            offsets = heap["offsets"]
+            return json.loads(
+                heap["heap"][offsets[row] : offsets[row + 1] - 1].tobytes()
+            )
+        return self._values[row]
+
+    def append(self, values: Sequence[Any]):
+        """Append values to the column."""
+        self._decode()
+        end = self._size + len(values)
+        self._values = _grow(self._values, end)
+        self._values[self._size : end] = _object_array(values)
+        self._size = end
+
+    def set(self, row: int, value: Any):
+        """Set the value for an existing row."""
+        self._decode()
+        self._values = _writable(self._values)
+        self._values[row] = value
+
+    def values(self) -> np.ndarray:
+        """Return the column values as an object array."""
+        self._decode()
+        return self._values[: self._size]
+
+    def take(self, rows: np.ndarray) -> np.ndarray:
+        """Return the values of `rows`."""
+        if self._heap is not None:
+            return _object_array([self[row] for row in rows])
+        return self.values()[rows]
+
+    def copy(self) -> "ObjectColumn":
+        """Return a copy of the column that shares its (read-only) arrays."""
+        column = type(self)()
+        column._values = _share(self._values)
+        column._size = self._size
+        column._heap = self._heap
+        return column
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """Return the column as a dict of arrays."""
+        if self._heap is not None:
+            return dict(self._heap)
+        return encode_json_heap(self.values())
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "ObjectColumn":
+        """Return a column from `to_buffers` arrays - values are decoded on use."""
+        column = cls()
+        column._heap = buffers
+        column._size = len(buffers["offsets"]) - 1
+        return column
+
+    def _decode(self):
+        """Decode all values of the JSON heap."""
+        heap = self._heap
+        if heap is not None:
+            # the values are set before the heap is cleared for concurrent readers
+            self._values = _object_array(decode_json_heap(heap["heap"]))
+            self._heap = None
+
+
+class IntColumn(ObjectColumn):
+    """Column of integers."""
+
+    kind = "int"
+
+    def __init__(self):
+        """Initialize the column."""
+        super().__init__()
+        self._values = np.empty(0, dtype=np.int64)
+
+    def append(self, values: Sequence[Any]):
+        """Append values to the column."""
+        end = self._size + len(values)
+        self._values = _grow(self._values, end)
+        self._values[self._size : end] = np.array(
+            [value or 0 for value in values], dtype=np.int64
+        )
+        self._size = end
+
+    def __getitem__(self, row: int) -> int:
+        """Return the value for `row`."""
+        return int(self._values[row])
+
+    def set(self, row: int, value: Any):
+        """Set the value for an existing row."""
+        self._values = _writable(self._values)
+        self._values[row] = value or 0
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """Return the column as a dict of arrays."""
+        return {"values": self.values()}
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "IntColumn":
+        """Return a column from `to_buffers` arrays."""
+        column = cls()
+        column._values = buffers["values"]
+        column._size = len(column._values)
+        return column
+
+
+class CategoryColumn:
+    """
+    Dictionary-encoded column of (hashable) values.
+
+    Each distinct value is stored once in `categories` and rows
+    hold an integer code. A code of -1 represents None.
+
+    """
+
+    kind = "category"
+
+    def __init__(self):
+        """Initialize the column."""
+        self._codes = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self.categories: List[Hashable] = []
+        self._lookup: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self._size
+
+    def __getitem__(self, row: int) -> Any:
+        """Return the value for `row`."""
+        code = self._codes[row]
+        return None if code < 0 else self.categories[code]
+
+    def encode(self, value: Hashable) -> int:
+        """Return the code for `value`, adding a new category if needed."""
+        if value is None:
+            return -1
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(value)
+            self._lookup[value] = code
+        return code
+
+    def get_code(self, value: Hashable) -> Optional[int]:
+        """Return the code for `value` or None if it is not a category."""
+        if value is None:
+            return -1
+        return self._lookup.get(value)
+
+    def append(self, values: Sequence[Any]):
+        """Append values to the column."""
+        end = self._size + len(values)
+        self._codes = _grow(self._codes, end)
+        self._codes[self._size : end] = [self.encode(value) for value in values]
+        self._size = end
+
+    def set(self, row: int, value: Any):
+        """Set the value for an existing row."""
+        self._codes = _writable(self._codes)
+        self._codes[row] = self.encode(value)
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """Return the column as a dict of arrays."""
+        return {
+            "codes": self.codes,
+            "categories": encode_json_heap(self.categories)["heap"],
+        }
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "CategoryColumn":
+        """Return a column from `to_buffers` arrays."""
+        column = cls()
+        column._codes = buffers["codes"]
+        column._size = len(column._codes)
+        column.categories = decode_json_heap(buffers["categories"])
+        column._lookup = {value: code for code, value in enumerate(column.categories)}
+        return column
+
+    def copy(self) -> "CategoryColumn":
+        """Return a copy of the column that shares its (read-only) codes."""
+        column = type(self)()
+        column._codes = _share(self._codes)
+        column._size = self._size
+        column.categories = list(self.categories)
+        column._lookup = dict(self._lookup)
+        return column
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Return the row codes."""
+        return self._codes[: self._size]
+
+    def values(self) -> np.ndarray:
+        """Return the decoded column values as an object array."""
+        return self.take(slice(None))
+
+    def take(self, rows) -> np.ndarray:
+        """Return the decoded values of `rows`."""
+        # code -1 indexes the trailing None
+        decode = _object_array(self.categories + [None])
+        return decode[self.codes[rows]]
+
+
+class BlobColumn:
+    """
+    Content-addressed column of (large) values.
+
+    Each distinct value (blob) is stored once, keyed by its content
+    hash, and rows hold an integer code of the key. A code of -1
+    represents None. In a `ColumnStore` the key of each row is read
+    from the `<name>_hash` column.
+
+    """
+
+    kind = "blob"
+
+    def __init__(self):
+        """Initialize the column."""
+        self._codes = np.empty(0, dtype=np.int32)
+        self._size = 0
+        self.keys: List[Hashable] = []
+        self._lookup: Dict[Hashable, int] = {}
+        self._blobs = ObjectColumn()
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self._size
+
+    def __getitem__(self, row: int) -> Any:
+        """Return the value for `row`."""
+        code = self._codes[row]
+        return None if code < 0 else self._blobs[code]
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Return True if there is a blob for `key`."""
+        return key in self._lookup
+
+    @property
+    def num_blobs(self) -> int:
+        """Return the number of distinct values."""
+        return len(self.keys)
+
+    def get_blob(self, key: Hashable) -> Any:
+        """Return the value for `key` (KeyError if there is no blob for `key`)."""
+        return self._blobs[self._lookup[key]]
+
+    def encode(self, value: Any, key: Optional[Hashable] = None) -> int:
+        """Return the code for `key`, adding `value` as a new blob if needed."""
+        if value is None:
+            return -1
+        if key is None:
+            key = value
+        code = self._lookup.get(key)
+        if code is None:
+            code = len(self.keys)
+            self.keys.append(key)
+            self._lookup[key] = code
+            self._blobs.append([value])
+        return code
+
+    def append(
+        self, values: Sequence[Any], keys: Optional[Sequence[Optional[Hashable]]] = None
+    ):
+        """Append values (with their content hash `keys`) to the column."""
+        if keys is None:
+            keys = [None] * len(values)
+        end = self._size + len(values)
+        self._codes = _grow(self._codes, end)
+        self._codes[self._size : end] = [
+            self.encode(value, key) for value, key in zip(values, keys)
+        ]
+        self._size = end
+
+    def set(self, row: int, value: Any, key: Optional[Hashable] = None):
+        """Set the value for an existing row."""
+        self._codes = _writable(self._codes)
+        self._codes[row] = self.encode(value, key)
+
+    def copy(self) -> "BlobColumn":
+        """Return a copy of the column that shares its (read-only) arrays."""
+        column = type(self)()
+        column._codes = _share(self._codes)
+        column._size = self._size
+        column.keys = list(self.keys)
+        column._lookup = dict(self._lookup)
+        column._blobs = self._blobs.copy()
+        return column
+
+    @property
+    def codes(self) -> np.ndarray:
+        """Return the row codes."""
+        return self._codes[: self._size]
+
+    def values(self) -> np.ndarray:
+        """Return the decoded column values as an object array."""
+        return self.take(slice(None))
+
+    def take(self, rows) -> np.ndarray:
+        """Return the decoded values of `rows`."""
+        codes = self.codes[rows]
+        unique_codes, inverse = np.unique(codes, return_inverse=True)
+        decode = _object_array(
+            [None if code < 0 else self._blobs[code] for code in unique_codes]
+        )
+        return decode[inverse.reshape(-1)]
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """Return the column as a dict of arrays."""
+        # only write the blobs that are referenced by a row
+        used, codes = np.unique(self.codes, return_inverse=True)
+        has_none = bool(len(used)) and used[0] < 0
+        if has_none:
+            used = used[1:]
+            codes = codes.reshape(-1) - 1
+        blobs = encode_json_heap([self._blobs[code] for code in used])
+        return {
+            "codes": codes.reshape(-1).astype(np.int32),
+            "keys": encode_json_heap([self.keys[code] for code in used])["heap"],
+            "blobs": blobs["heap"],
+            "blob_offsets": blobs["offsets"],
+        }
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "BlobColumn":
+        """Return a column from `to_buffers` arrays - blobs are decoded on use."""
+        column = cls()
+        column._codes = buffers["codes"]
+        column._size = len(column._codes)
+        column.keys = decode_json_heap(buffers["keys"])
+        column._lookup = {key: code for code, key in enumerate(column.keys)}
+        column._blobs = ObjectColumn.from_buffers(
+            {"heap": buffers["blobs"], "offsets": buffers["blob_offsets"]}
+        )
+        return column
+
+
+class ListColumn:
+    """
+    Column of lists of strings stored as flattened codes and offsets.
+
+    The list items are dictionary-encoded. The items for row `n` are
+    `categories[codes[offsets[n]:offsets[n + 1]]]`. Rows that have no
+    list (None) are tracked separately from empty lists.
+
+    Updates to existing rows are held as overrides and are merged
+    into the flattened arrays when the number of overrides grows
+    beyond a quarter of the rows.
+
+    """
+
+    kind = "list"
+
+    _MIN_OVERRIDES = 1024
+
+    def __init__(self):
+        """Initialize the column."""
+        self.categories: List[str] = []
+        self._lookup: Dict[str, int] = {}
+        self._codes = np.empty(0, dtype=np.int32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._present = np.empty(0, dtype=bool)
+        self._size = 0
+        self._overrides: Dict[int, Optional[List[str]]] = {}
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self._size
+
+    def __getitem__(self, row: int) -> Optional[List[str]]:
+        """Return the list for `row`."""
+        if row in self._overrides:
+            value = self._overrides[row]
+            return None if value is None else list(value)
+        if not self._present[row]:
+            return None
+        codes = self._codes[self._offsets[row] : self._offsets[row + 1]]
+        return [self.categories[code] for code in codes]
+
+    def append(self, values: Sequence[Optional[List[str]]]):
+        """Append lists to the column."""
+        codes = [
+            [self._encode(item) for item in value] if value is not None else []
+            for value in values
+        ]
+        lengths = np.array([len(row_codes) for row_codes in codes], dtype=np.int64)
+        flat_codes = np.array(
+            [code for row_codes in codes for code in row_codes], dtype=np.int32
+        )
+        n_codes = int(self._offsets[self._size])
+        self._codes = _grow(self._codes, n_codes + len(flat_codes))
+        self._codes[n_codes : n_codes + len(flat_codes)] = flat_codes
+        end = self._size + len(values)
+        self._offsets = _grow(self._offsets, end + 1)
+        self._offsets[self._size + 1 : end + 1] = n_codes + np.cumsum(lengths)
+        self._present = _grow(self._present, end)
+        self._present[self._size : end] = [value is not None for value in values]
+        self._size = end
+
+    def set(self, row: int, value: Optional[List[str]]):
+        """Set the list for an existing row."""
+        self._overrides[row] = None if value is None else list(value)
+        if len(self._overrides) > max(self._MIN_OVERRIDES, self._size // 4):
+            self.compact()
+
+    def compact(self):
+        """Merge row overrides into the flattened arrays."""
+        if not self._overrides:
+            return
+        values = [self[row] for row in range(self._size)]
+        self._codes = np.empty(0, dtype=np.int32)
+        self._offsets = np.zeros(1, dtype=np.int64)
+        self._present = np.empty(0, dtype=bool)
+        self._size = 0
+        self._overrides = {}
+        self.append(values)
+
+    def take(self, rows: Iterable[int]) -> List[Optional[List[str]]]:
+        """Return the lists for `rows`."""
+        return [self[row] for row in rows]
+
+    def values(self) -> List[Optional[List[str]]]:
+        """Return the lists for all rows."""
+        return self.take(range(self._size))
+
+    def flatten(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the list items of `rows` as flat arrays.
+
+        Parameters
+        ----------
+        rows : np.ndarray
+            The rows to return.
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray, np.ndarray]
+            The (object) array of the list items of all of the rows,
+            the position in `rows` of the row of each item and a
+            boolean mask of the rows that have a list (are not None).
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self._offsets[rows]
+        lengths = self._offsets[rows + 1] - starts
+        present = self._present[rows]
+        overridden = None
+        if self._overrides:
+            overridden = np.flatnonzero(
+                np.isin(rows, np.fromiter(self._overrides, dtype=np.int64))
+            )
+            lengths[overridden] = 0
+        positions = np.repeat(np.arange(len(rows)), lengths)
+        # the code index of an item is its row start plus its offset in the row
+        firsts = np.cumsum(lengths) - lengths
+        items_idx = np.repeat(starts - firsts, lengths) + np.arange(lengths.sum())
+        items = _object_array(self.categories)[self._codes[items_idx]]
+        if overridden is None or not len(overridden):
+            return items, positions, present
+        extra_items: List[str] = []
+        extra_positions: List[int] = []
+        for pos in overridden.tolist():
+            value = self._overrides[int(rows[pos])]
+            present[pos] = value is not None
+            extra_items.extend(value or [])
+            extra_positions.extend([pos] * len(value or []))
+        return (
+            np.concatenate([items, _object_array(extra_items)]),
+            np.concatenate([positions, np.array(extra_positions, dtype=np.int64)]),
+            present,
+        )
+
+    def copy(self) -> "ListColumn":
+        """Return a copy of the column that shares its (read-only) arrays."""
+        column = type(self)()
+        column.categories = list(self.categories)
+        column._lookup = dict(self._lookup)
+        column._codes = _share(self._codes)
+        column._offsets = _share(self._offsets)
+        column._present = _share(self._present)
+        column._size = self._size
+        column._overrides = dict(self._overrides)
+        return column
+
+    def flattened(self):
+        """Return the (codes, offsets, present) arrays for all rows."""
+        self.compact()
+        return (
+            self._codes[: self._offsets[self._size]],
+            self._offsets[: self._size + 1],
+            self._present[: self._size],
+        )
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """Return the column as a dict of arrays."""
+        codes, offsets, present = self.flattened()
+        return {
+            "codes": codes,
+            "offsets": offsets,
+            "present": present,
+            "categories": encode_json_heap(self.categories)["heap"],
+        }
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "ListColumn":
+        """Return a column from `to_buffers` arrays."""
+        column = cls()
+        column._codes = buffers["codes"]
+        column._offsets = buffers["offsets"]
+        column._present = buffers["present"]
+        column._size = len(column._present)
+        column.categories = decode_json_heap(buffers["categories"])
+        column._lookup = {value: code for code, value in enumerate(column.categories)}
+        return column
+
+    def _encode(self, value: str) -> int:
+        """Return the code for `value`, adding a new category if needed."""
+        code = self._lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(value)
+            self._lookup[value] = code
+        return code
+
+
+_COLUMN_CLASSES = {
+    "object": ObjectColumn,
+    "int": IntColumn,
+    "category": CategoryColumn,
+    "blob": BlobColumn,
+    "list": ListColumn,
+}
+
+# suffix of the column holding the content hash of each row of a blob column
+BLOB_KEY_SUFFIX = "_hash"
+
+
+class ColumnStore:
+    """
+    Set of equal length columns.
+
+    Parameters
+    ----------
+    column_types : Dict[str, str]
+        Mapping of column name to column type. Column types are
+        "object", "int", "category", "blob" and "list". Blob columns
+        are keyed by the value of the `<name>_hash` column of each row.
+
+    """
+
+    def __init__(self, column_types: Dict[str, str]):
+        """Initialize the column store."""
+        self.column_types = dict(column_types)
+        self.columns = {
+            name: _COLUMN_CLASSES[col_type]() for name, col_type in column_types.items()
+        }
+        self._size = 0
+
+    @classmethod
+    def from_buffers(
+        cls, column_types: Dict[str, str], buffers: Dict[str, Dict[str, np.ndarray]]
+    ) -> "ColumnStore":
+        """Return a column store from the `to_buffers` arrays of each column."""
+        store = cls(column_types)
+        for name, col_type in column_types.items():
+            store.columns[name] = _COLUMN_CLASSES[col_type].from_buffers(buffers[name])
+        store._size = len(next(iter(store.columns.values()), ()))
+        return store
+
+    def to_buffers(self) -> Dict[str, Dict[str, np.ndarray]]:
+        """Return the arrays of each column."""
+        return {name: column.to_buffers() for name, column in self.columns.items()}
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return self._size
+
+    def copy(self) -> "ColumnStore":
+        """
+        Return a copy of the column store.
+
+        The copy shares the column arrays with this store. The arrays
+        are marked read-only and are copied by the first write to them,
+        so changes to the copy are not seen by this store (or the
+        reverse).
+
+        """
+        store = ColumnStore.__new__(ColumnStore)
+        store.column_types = dict(self.column_types)
+        store.columns = {name: column.copy() for name, column in self.columns.items()}
+        store._size = self._size
+        return store
+
+    def __getitem__(self, name: str):
+        """Return the column `name`."""
+        return self.columns[name]
+
+    def add_column(self, name: str, col_type: str):
+        """Add a column of None values."""
+        column = _COLUMN_CLASSES[col_type]()
+        if col_type == "blob":
+            column.append([None] * self._size, [None] * self._size)
+        else:
+            column.append([None] * self._size)
+        self.column_types[name] = col_type
+        self.columns[name] = column
+
+    def append(self, records: Sequence[Dict[str, Any]]):
+        """Append records (dicts of column values) as new rows."""
+        if not records:
+            return
+        for name, column in self.columns.items():
+            values = [record.get(name) for record in records]
+            if column.kind == "blob":
+                key_name = f"{name}{BLOB_KEY_SUFFIX}"
+                column.append(values, [record.get(key_name) for record in records])
+            else:
+                column.append(values)
+        self._size += len(records)
+
+    def set_row(self, row: int, record: Dict[str, Any]):
+        """Set the column values in `record` for an existing row."""
+        for name, value in record.items():
+            if name not in self.columns:
+                continue
+            if self.columns[name].kind == "blob":
+                self.columns[name].set(
+                    row, value, record.get(f"{name}{BLOB_KEY_SUFFIX}")
+                )
+            else:
+                self.columns[name].set(row, value)
+
+    def get_row(self, row: int) -> Dict[str, Any]:
+        """Return the column values of `row` as a dict."""
+        return {name: column[row] for name, column in self.columns.items()}
+
+    def to_df(
+        self, rows: Optional[np.ndarray] = None, columns: Optional[List[str]] = None
+    ) -> pd.DataFrame:
+        """Return a DataFrame of the `columns` for `rows`."""
+        if rows is None:
+            rows = np.arange(self._size)
+        return pd.DataFrame(
+            {
+                name: self.columns[name].take(rows)
+                for name in (columns or list(self.columns))
+            }
+        )
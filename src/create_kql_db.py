@@ -8,6 +8,7 @@
 import argparse
 import logging
 import sys
+from concurrent.futures import as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 from typing import Any, Dict
@@ -19,9 +20,8 @@ from tqdm.auto import tqdm
 from . import kql_extract as extract
 from .az_mon_schema import AzMonitorSchemas
 from .data_store import DataStore
-
-# from .kql_query import KqlQuery
 from .kql_download import get_community_queries, get_sentinel_queries
+from .kql_query import KqlQuery
 
 # ######### MOCK Stuff for stubbing code
 # from unittest.mock import MagicMock
@@ -65,6 +65,30 @@ def _add_script_args():
         default=False,
         help="Write a pickled dataframe.",
     )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=["json", "ndjson", "parquet"],
+        default="json",
+        help="Output format for the query store (parquet requires pyarrow).",
+    )
+    parser.add_argument(
+        "--dedupe",
+        "-e",
+        action="store_true",
+        default=False,
+        help=(
+            "Omit the query text of repeated queries from the JSON output"
+            " (restored when the JSON is read by DataStore)."
+        ),
+    )
+    parser.add_argument(
+        "--binary",
+        "-b",
+        action="store_true",
+        default=False,
+        help="Write a memory-mappable binary store (open with DataStore.open).",
+    )
     parser.add_argument(
         "--quiet",
         "-q",
@@ -93,6 +117,23 @@ def _add_script_args():
         default=False,
         help="Save outputs after initial query load/parsing.",
     )
+    parser.add_argument(
+        "--skip-duplicates",
+        "-k",
+        action="store_true",
+        default=False,
+        help=(
+            "Only extract KQL properties for one query of each set of"
+            " near-duplicate queries and copy them to the others."
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Number of KQL extraction processes (default is the number of CPUs).",
+    )
     parser.add_argument(
         "--az-schemas",
         "-a",
@@ -145,50 +186,80 @@ def main(args):
 
     # parse Kql for query properties
     logging.info("Getting KQL properties for %d kql queries.", len(results))
+    duplicate_of = _get_duplicate_map(store) if args.skip_duplicates else {}
+    # queries that differ only in formatting and comments (with the same
+    # canonical_hash) are extracted once and share the kql_properties
+    to_extract: Dict[str, KqlQuery] = {}
+    canonical_ids: Dict[str, str] = {}
+    for query in store.queries:
+        if query.query_id in duplicate_of:
+            continue
+        if query.canonical_hash is None:
+            # no canonical form - the query is not a duplicate of another
+            to_extract[query.query_id] = query
+            continue
+        first_id = canonical_ids.setdefault(query.canonical_hash, query.query_id)
+        if first_id == query.query_id:
+            to_extract[query.query_id] = query
+        else:
+            duplicate_of[query.query_id] = first_id
+    extracted: Dict[str, Dict[str, Any]] = {}
     try:
-        extract.start()
-        for query in tqdm(store.queries):
-            try:
-                kql_properties = extract.extract_kql(
-                    kql_query=query.query, query_id=query.query_id
-                )
-            except Exception as err:  # pylint: disable=broad-except
-                logging.exception(
-                    "Failed to parse query '%s'.\n %s",
-                    query.query_id,
-                    query.source_path,
-                    exc_info=err,
-                )
-                continue
-            try:
-                if not kql_properties.get("Valid_Query", True):
-                    logging.error(
-                        "Invalid KQL for query %s (%s)",
-                        query.query_id,
-                        query.source_path,
+        with extract.ExtractorPool(args.workers) as pool:
+            futures = {
+                pool.submit(query.query, query.query_id): query_id
+                for query_id, query in to_extract.items()
+            }
+            # an error in one query does not stop the others
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                query_id = futures[future]
+                try:
+                    kql_properties = future.result()
+                    if not kql_properties.get("Valid_Query", True):
+                        logging.error(
+                            "Invalid KQL for query %s (%s)",
+                            query_id,
+                            to_extract[query_id].source_path,
+                        )
+                    store.add_kql_properties(
+                        query_id=query_id, kql_properties=kql_properties
+                    )
+                    extracted[query_id] = kql_properties
+                except Exception as err:  # pylint: disable=broad-except
+                    logging.exception(
+                        "Failed to get kql properties for query '%s'.",
+                        query_id,
+                        exc_info=err,
                     )
-                store.add_kql_properties(
-                    query_id=query.query_id, kql_properties=kql_properties
-                )
-            except Exception as err:  # pylint: disable=broad-except
-                logging.exception(
-                    "Failed to update kql properties for query '%s'.",
-                    query.query_id,
-                    exc_info=err,
-                )
-    finally:
-        extract.stop()
+    except Exception as err:  # pylint: disable=broad-except
+        logging.exception("Failed to start KQL extraction.", exc_info=err)
+    for query_id, first_id in duplicate_of.items():
+        if first_id in extracted:
+            # the result Id is the query_id of the extracted query
+            store.add_kql_properties(
+                query_id=query_id,
+                kql_properties={**extracted[first_id], "Id": query_id},
+            )
     logging.info("Finished getting KQL properties for %d kql queries.", len(results))
 
     # write output
-    out_json_path = _get_output_file(args, "json")
-    store.to_json(out_json_path)
-    logging.info("Writing JSON output to %s", out_json_path)
+    if args.format == "parquet":
+        out_parquet_path = _get_output_file(args, "parquet")
+        store.to_parquet(out_parquet_path)
+        logging.info("Writing Parquet output to %s", out_parquet_path)
+    else:
+        out_json_path = _get_output_file(args, args.format)
+        store.to_json(out_json_path, ndjson=args.format == "ndjson", dedupe=args.dedupe)
+        logging.info("Writing JSON output to %s", out_json_path)
     if args.df:
         query_df = store.to_df()
         out_df_path = _get_output_file(args, "pkl")
         query_df.to_pickle(out_df_path)
         logging.info("Writing Pickled dataframe output to %s", out_df_path)
+    if args.binary:
+        out_store_path = _get_output_file(args, "kqlstore")
+        store.save(out_store_path)
+        logging.info("Writing binary store output to %s", out_store_path)
 
     # get Azure monitor table schema
     # and write JSON and DF
@@ -208,6 +279,19 @@ def main(args):
     logging.info("============================================")
 
 
+def _get_duplicate_map(store: DataStore) -> Dict[str, str]:
+    """Return mapping of query_id to the first query_id of its duplicate cluster."""
+    duplicate_of = {
+        query_id: cluster[0]
+        for cluster in store.get_duplicate_clusters()
+        for query_id in cluster[1:]
+    }
+    logging.info(
+        "Skipping KQL extraction for %d near-duplicate queries.", len(duplicate_of)
+    )
+    return duplicate_of
+
+
 def _get_output_file(args, file_type):
     """Return formatted path for output files."""
     if args.timestamp:
@@ -4,14 +4,51 @@
 # license information.
 # --------------------------------------------------------------------------
 """DataStore class."""
-import json
+import logging
+import re
+from copy import deepcopy
+from itertools import chain, islice
 from pathlib import Path
-from typing import Any, Dict, List, Optional, Set, Union
+from typing import (
+    Any,
+    Dict,
+    Hashable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 import numpy as np
 import pandas as pd
 
+from .binary_store import open_arrays, write_arrays
+from .columnar import ColumnStore, _object_array
+from .filter_expr import (
+    INDEX_OPERATORS,
+    And,
+    FilterExpr,
+    Not,
+    Predicate,
+    QueryPlan,
+    criteria_to_filter,
+    parse_filter,
+)
+from .inverted_index import Bitmap, InvertedIndex
+from .json_stream import dump_json_records, read_json_records, write_json_records
 from .kql_query import KqlQuery
+from .near_duplicates import NearDuplicateIndex
+from .parquet_store import iter_parquet, write_parquet
+from .query_cache import CacheInfo, QueryCache
+from .result_set import ResultSet
+from .similarity import FeatureMatrix
+from .text_index import TextIndex, tokenize_kql
+from .trigram_index import TrigramIndex
 
 __author__ = "Ian Hellen"
 
@@ -64,6 +101,43 @@ class DataStore:
         "contains": ".*{expr}.*",
         "matches": "{expr}",
     }
+    _SET_OPERATORS = ("all", "any", "none")
+    # assumed fraction of rows matched by a regular expression
+    _REGEX_SELECTIVITY = 0.25
+    _TEXT_FIELDS = ("query", "context")
+    # indexed attributes used as structural features by similar_queries
+    _SIMILARITY_FEATURES = (
+        "tables",
+        "operators",
+        "functioncalls",
+        "joins",
+        "tactics",
+        "techniques",
+    )
+    _TRIGRAM_FIELDS = ("query_name", "source_path", "repo_name", "query")
+    _QUERY_CACHE_SIZE = 128
+    # number of queries read from a JSON file before they are added
+    _LOAD_BATCH_SIZE = 10000
+
+    # columnar storage types for KqlQuery fields
+    _COLUMN_TYPES: Dict[str, str] = {
+        "source_path": "object",
+        # query text is stored once per query_hash
+        "query": "blob",
+        "source_type": "category",
+        "source_index": "int",
+        "repo_name": "category",
+        "query_name": "category",
+        "context": "object",
+        "attributes": "object",
+        "kql_properties": "object",
+        "query_id": "object",
+        "query_hash": "object",
+        "query_version": "int",
+        "canonical_hash": "object",
+    }
+    # kql_properties stored in their own list columns
+    _LIST_PROPERTIES = ("tables", "operators", "fields", "functioncalls")
 
     def __init__(
         self,
@@ -71,98 +145,545 @@ class DataStore:
         json_path: Optional[str] = None,
     ):
         self._json_path = json_path
+        self._columns = ColumnStore(
+            {
+                **self._COLUMN_TYPES,
+                **{key: "list" for key in self._LIST_PROPERTIES},
+            }
+        )
+        # query_id to row mapping - created on first use for opened stores
+        self._row_id_map: Optional[Dict[str, int]] = {}
+        self._indexes: Dict[str, InvertedIndex] = {}
+        # full text index is created on first use
+        self._text_index: Optional[TextIndex] = None
+        # near-duplicate (MinHash LSH) index is created on first use
+        self._near_dup_index: Optional[NearDuplicateIndex] = None
+        # structural feature matrix is created on first use
+        self._feature_matrix: Optional[FeatureMatrix] = None
+        # trigram indexes of string fields are created on first use
+        self._trigram_indexes: Dict[str, TrigramIndex] = {}
+        # find_queries results - invalidated by any change to the store
+        self._generation = 0
+        self._query_cache = QueryCache(self._QUERY_CACHE_SIZE)
+        # a frozen store is a published (read-only) snapshot
+        self._frozen = False
+
         if json_path:
-            self._data = {
-                query.get("query_id"): KqlQuery(**query)
-                for query in self._read_json_data(json_path)
+            kql_queries = self._read_json_data(json_path)
+        if kql_queries:
+            queries = iter(kql_queries)
+            # derived query_ids seen in earlier batches
+            occurrences: Dict[str, int] = {}
+            while True:
+                batch = [
+                    query if isinstance(query, KqlQuery) else KqlQuery(**query)
+                    for query in islice(queries, self._LOAD_BATCH_SIZE)
+                ]
+                if not batch:
+                    break
+                KqlQuery.set_unique_query_ids(batch, occurrences)
+                self.add_queries(batch)
+
+    def __len__(self) -> int:
+        """Return the number of queries in the store."""
+        return len(self._columns)
+
+    @classmethod
+    def open(cls, file_path: Union[str, Path]) -> "DataStore":
+        """
+        Open a store saved with `save`.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            Path to the binary store file.
+
+        Returns
+        -------
+        DataStore
+            The store.
+
+        Notes
+        -----
+        The file is memory-mapped and the columns and posting lists
+        are read directly from the mapped pages, so opening the store
+        does not parse, hash or index the queries. Column values are
+        decoded as they are accessed. Processes that open the same file
+        share its pages in the OS page cache. Changes to an opened
+        store are not written to the file - use `save` to write them.
+
+        """
+        arrays, metadata = open_arrays(file_path)
+        buffers: Dict[str, Dict[str, Dict[str, np.ndarray]]] = {
+            "columns": {},
+            "indexes": {},
+        }
+        for name, array in arrays.items():
+            section, item, buffer = name.split("/")
+            buffers[section].setdefault(item, {})[buffer] = array
+        store = cls()
+        store._columns = ColumnStore.from_buffers(
+            metadata["column_types"], buffers["columns"]
+        )
+        # columns added to the store since the file was saved
+        for name, col_type in store._COLUMN_TYPES.items():
+            if name not in store._columns.column_types:
+                store._columns.add_column(name, col_type)
+        store._indexes = {
+            key: InvertedIndex.from_buffers(index_buffers)
+            for key, index_buffers in buffers["indexes"].items()
+        }
+        store._row_id_map = None
+        return store
+
+    def save(self, file_path: Union[str, Path]):
+        """
+        Save the store as a binary file that can be opened with `open`.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            Path to the binary store file.
+
+        Notes
+        -----
+        The file holds the store columns and the attribute and KQL
+        property indexes. The full text and trigram indexes are not
+        saved - they are built on first use.
+
+        """
+        arrays = {
+            f"{section}/{item}/{buffer}": array
+            for section, items in (
+                ("columns", self._columns.to_buffers()),
+                (
+                    "indexes",
+                    {key: index.to_buffers() for key, index in self._indexes.items()},
+                ),
+            )
+            for item, item_buffers in items.items()
+            for buffer, array in item_buffers.items()
+        }
+        write_arrays(file_path, arrays, {"column_types": self._columns.column_types})
+
+    @property
+    def read_only(self) -> bool:
+        """Return True if the store is frozen and cannot be changed."""
+        return self._frozen
+
+    def copy(self) -> "DataStore":
+        """
+        Return a copy of the store that can be changed independently.
+
+        Returns
+        -------
+        DataStore
+            A writable copy of the store.
+
+        Notes
+        -----
+        The copy is copy-on-write: the column arrays and posting lists
+        are shared with this store and are only copied when they are
+        first changed. The category and posting dictionaries are copied,
+        as are any full text, trigram, near-duplicate and feature
+        indexes that have been built. The find_queries cache is not
+        copied.
+
+        """
+        store = DataStore()
+        store._json_path = self._json_path
+        store._columns = self._columns.copy()
+        store._row_id_map = None if self._row_id_map is None else dict(self._row_id_map)
+        store._indexes = {key: index.copy() for key, index in self._indexes.items()}
+        store._text_index = deepcopy(self._text_index)
+        store._near_dup_index = deepcopy(self._near_dup_index)
+        store._feature_matrix = deepcopy(self._feature_matrix)
+        store._trigram_indexes = deepcopy(self._trigram_indexes)
+        store._generation = self._generation
+        return store
+
+    def freeze(self) -> "DataStore":
+        """
+        Make the store read-only, so that it can be shared by concurrent readers.
+
+        Returns
+        -------
+        DataStore
+            The (frozen) store.
+
+        Notes
+        -----
+        The index write buffers are merged so that reads do not change
+        the indexes. Methods that change the store raise a RuntimeError
+        after the store is frozen - use `copy` to create a writable
+        version. The search indexes that are built on first use can
+        still be created by readers of a frozen store.
+
+        """
+        for index in self._indexes.values():
+            index.merge()
+        for field in self._trigram_indexes:
+            # index any new categories now rather than on use
+            self._get_trigram_index(field)
+        self._frozen = True
+        return self
+
+    @property
+    def _row_ids(self) -> Dict[str, int]:
+        """Return the mapping of query_id to row."""
+        if self._row_id_map is None:
+            self._row_id_map = {
+                query_id: row
+                for row, query_id in enumerate(self._columns["query_id"].values())
             }
-        elif kql_queries:
-            if isinstance(kql_queries[0], KqlQuery):
-                self._data = {query.query_id: query for query in kql_queries}
-            else:
-                self._data = {
-                    query["query_id"]: KqlQuery(**query) for query in kql_queries
-                }
-        else:
-            self._data = {}
-        # self.attributes = self._extract_attributes()
-        if self._data:
-            self._data_df = pd.DataFrame(self.queries).set_index("query_id")
-        else:
-            self._data_df = pd.DataFrame(
-                self.queries, columns=KqlQuery.field_names()
-            ).set_index("query_id")
-        self._indexes: Dict[str, pd.DataFrame] = {}
-        self._create_indexes("attributes")
-        self._create_indexes("kql_properties")
+        return self._row_id_map
+
+    @property
+    def _data(self) -> Mapping[str, KqlQuery]:
+        """Return a mapping of query_id to KqlQuery."""
+        return _QueryMapping(self)
 
     @property
     def queries(self) -> List[KqlQuery]:
         """Get the list of current queries."""
-        return list(self._data.values())
+        return [self._get_query(row) for row in range(len(self))]
 
     @property
-    def queries_dict(self) -> List[KqlQuery]:
+    def queries_dict(self) -> List[Dict[str, Any]]:
         """Get the list of current queries."""
-        return [query.asdict() for query in self._data.values()]
+        return [self._get_record(row) for row in range(len(self))]
+
+    def has_query_hash(self, query_hash: str) -> bool:
+        """Return True if the store has a query with the `query_hash` text."""
+        return query_hash in self._columns["query"]
+
+    def to_json(
+        self,
+        file_path: Optional[str] = None,
+        ndjson: bool = False,
+        dedupe: bool = False,
+    ) -> Optional[str]:
+        """
+        Return the queries as JSON or save to `file_path`, if specified.
+
+        Parameters
+        ----------
+        file_path : Optional[str], optional
+            Path of the file to write. Records are written one at a
+            time. Paths ending in ".gz" are gzip compressed.
+        ndjson : bool, optional
+            Write one query per line (NDJSON) rather than a JSON
+            array, by default False
+        dedupe : bool, optional
+            Only write the query text for the first query with each
+            query_hash - later queries with the same query_hash have
+            no "query" value, by default False. The text is restored
+            when the JSON is read by DataStore.
 
-    def to_json(self, file_path: Optional[str] = None) -> Optional[str]:
-        """Return the queries as JSON or save to `file_path`, if specified."""
-        if file_path is not None:
-            Path(file_path).write_text(self.to_json(), encoding="utf-8")
-        return json.dumps(self.queries_dict)
+        Returns
+        -------
+        Optional[str]
+            The JSON text if `file_path` is not specified.
+
+        """
+        records: Iterable[Dict[str, Any]] = (
+            self._get_record(row) for row in range(len(self))
+        )
+        if dedupe:
+            records = _dedupe_query_text(records)
+        if file_path is None:
+            return dump_json_records(records, ndjson=ndjson)
+        write_json_records(records, file_path, ndjson=ndjson)
+        return None
+
+    @classmethod
+    def from_parquet(
+        cls, file_path: Union[str, Path], case: bool = False, **criteria
+    ) -> "DataStore":
+        """
+        Create a store from a Parquet file written by `to_parquet`.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            Path to the Parquet file.
+        case : bool, optional
+            Use case-sensitive string matching, by default False
+
+        Other Parameters
+        ----------------
+        criteria :
+            Optional `find_queries`-style criteria - only the matching
+            queries are loaded. See `parquet_store.iter_parquet` for
+            the supported expressions.
+
+        Returns
+        -------
+        DataStore
+            The store.
+
+        Notes
+        -----
+        Requires pyarrow. To read a subset of columns (without
+        creating a store) use `parquet_store.read_parquet`.
+
+        """
+        return cls(iter_parquet(file_path, case=case, **criteria))
+
+    def to_parquet(self, file_path: Union[str, Path], row_group_size: int = 10000):
+        """
+        Write the queries to a Parquet file.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            Path of the file to write.
+        row_group_size : int, optional
+            The number of queries in each row group, by default 10000
+
+        Notes
+        -----
+        Requires pyarrow.
+
+        """
+        write_parquet(
+            (self._get_record(row) for row in range(len(self))),
+            file_path,
+            row_group_size=row_group_size,
+        )
 
     def to_df(self) -> pd.DataFrame:
         """Return queries as a pandas DataFrame."""
-        return pd.DataFrame(self.queries)
+        return self._get_df(index=False)
 
     def get_query_ids(self) -> pd.DataFrame:
         """Return subset of query columns."""
-        columns = ["source_path", "query_name", "query_hash"]
-        if self._data_df is None:
-            return pd.DataFrame(columns=columns)
-        return self._data_df[columns]
+        return self._get_df(columns=["source_path", "query_name", "query_hash"])
 
     def add_queries(self, queries: KqlQueryList):
-        """Add a list of queries to the store."""
-        self._data.update({query.query_id: query for query in queries})
-        self._create_indexes("attributes")
-        self._create_indexes("kql_properties")
-        self._data_df = pd.DataFrame(self.queries).set_index("query_id")
+        """
+        Add a list of queries to the store.
+
+        Only the added queries are indexed. Queries with a query_id
+        already in the store replace the existing query (keeping
+        its position), new queries are appended. Queries in `queries`
+        with the same derived query_id are given different ids
+        (see `KqlQuery.set_unique_query_ids`).
+
+        """
+        self._check_writable()
+        queries = list(queries)
+        KqlQuery.set_unique_query_ids(queries)
+        batch = {query.query_id: query for query in queries}
+        if not batch:
+            return
+        KqlQuery.set_canonical_hashes(batch.values())
+        self._generation += 1
+        new_records = []
+        replaced_rows = []
+        for query_id, query in batch.items():
+            record = self._to_record(query)
+            if query_id in self._row_ids:
+                replaced_rows.append(self._row_ids[query_id])
+                self._columns.set_row(self._row_ids[query_id], record)
+            else:
+                self._row_ids[query_id] = len(self) + len(new_records)
+                new_records.append(record)
+        self._columns.append(new_records)
+
+        if replaced_rows:
+            for index in self._indexes.values():
+                index.remove_rows(np.array(replaced_rows))
+        rows = [self._row_ids[query_id] for query_id in batch]
+        self._add_rows_to_indexes(rows)
+        self._add_to_search_indexes(rows)
 
     def add_query(self, query: KqlQuery):
-        """Add a single query to the store."""
-        self._data[query.query_id] = query
-        self._add_item_to_indexes(query)
-        self._data_df = pd.concat(
-            [self._data_df, pd.DataFrame(query).set_index("query_id")]
-        )
+        """
+        Add a single query to the store.
+
+        The query is appended to the store columns and added to the
+        write buffers of the indexes.
+
+        """
+        self._check_writable()
+        self._generation += 1
+        KqlQuery.set_canonical_hashes([query])
+        row_id = self._row_ids.get(query.query_id)
+        if row_id is not None:
+            prev_keys = set(self._get_indexed_attribs(row_id))
+            self._columns.set_row(row_id, self._to_record(query))
+            self._update_item_indexes(
+                row_id, prev_keys | set(self._get_indexed_attribs(row_id))
+            )
+        else:
+            row_id = self._row_ids[query.query_id] = len(self)
+            self._columns.append([self._to_record(query)])
+            self._add_item_to_indexes(row_id)
+        self._add_to_search_indexes([row_id])
 
     def add_kql_properties(self, query_id: str, kql_properties: Dict[str, Any]):
         """Add Kql properties to a query."""
+        self._check_writable()
         kql_props = {key.casefold(): value for key, value in kql_properties.items()}
         if "valid_query" not in kql_props:
             kql_props["valid_query"] = True
-        self._data[query_id].kql_properties = kql_props
-        # update indexes
-        self._add_item_to_indexes(self._data[query_id])
+        row_id = self._row_ids[query_id]
+        self._generation += 1
+        prev_keys = set(self._get_kql_properties(row_id))
+        self._columns.set_row(row_id, self._split_kql_properties(kql_props))
+        # replace the query's entries in the affected indexes
+        self._update_item_indexes(row_id, prev_keys | set(kql_props))
+        if self._feature_matrix is not None:
+            self._feature_matrix.set_row(row_id, self._get_features(row_id))
+
+    def search_text(self, text: str, top_k: int = 10) -> pd.DataFrame:
+        """
+        Return the queries best matching a full text search.
+
+        Parameters
+        ----------
+        text : str
+            The search terms - e.g. "DeviceProcessEvents ProcessCommandLine has_any"
+        top_k : int, optional
+            The maximum number of results to return, by default 10
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame of matching queries ordered by descending
+            relevance, with the BM25 relevance in the "score" column.
+
+        Notes
+        -----
+        The query text and context of each query are indexed. The
+        index is built on first use and updated as queries are added.
+
+        """
+        if self._text_index is None:
+            # build the index before publishing it to concurrent readers
+            text_index = TextIndex()
+            for row_id in range(len(self)):
+                text_index.add_terms(row_id, self._get_text_terms(row_id))
+            self._text_index = text_index
+        row_ids, scores = self._text_index.search(text, top_k=top_k)
+        results = self._get_df(row_ids)
+        results["score"] = scores
+        return results
+
+    def get_duplicate_clusters(self) -> List[List[str]]:
+        """
+        Return clusters of near-duplicate queries.
+
+        Returns
+        -------
+        List[List[str]]
+            Lists of the query_ids of queries that are near duplicates
+            of each other (in store order). Queries with no near
+            duplicates are not included.
+
+        Notes
+        -----
+        Queries are compared using MinHash signatures of the shingles
+        of their normalized KQL tokens - comments, case and whitespace
+        are ignored. Candidate pairs are found by LSH banding so the
+        whole store is not compared pairwise. The index is built on
+        first use and updated as queries are added.
+
+        """
+        query_ids = self._columns["query_id"]
+        return [
+            [query_ids[row_id] for row_id in rows]
+            for rows in self._get_near_dup_index().clusters()
+        ]
+
+    def get_exact_duplicate_clusters(self) -> List[List[str]]:
+        """
+        Return clusters of queries with the same canonical query text.
+
+        Returns
+        -------
+        List[List[str]]
+            Lists of the query_ids of queries with the same
+            canonical_hash (in store order) - queries that differ only
+            in whitespace, comments and the case of tabular operator
+            names. Queries with no duplicates are not included.
+
+        """
+        hashes_df = self._columns.to_df(columns=["query_id", "canonical_hash"])
+        hashes_df = hashes_df[
+            hashes_df["canonical_hash"].notna()
+            & hashes_df["canonical_hash"].duplicated(keep=False)
+        ]
+        return list(
+            hashes_df.groupby("canonical_hash", sort=False)["query_id"].agg(list)
+        )
+
+    def find_near_duplicates(self, query_id: str) -> pd.DataFrame:
+        """Return the queries that are near duplicates of `query_id`."""
+        row_id = self._row_ids[query_id]
+        return self._get_df(self._get_near_dup_index().near_duplicates(row_id))
+
+    def similar_queries(
+        self, query_id: str, k: int = 10, metric: str = "cosine"
+    ) -> pd.DataFrame:
+        """
+        Return the queries most similar in structure to `query_id`.
+
+        Parameters
+        ----------
+        query_id : str
+            The query to find similar queries for.
+        k : int, optional
+            The maximum number of queries to return, by default 10
+        metric : str, optional
+            The similarity measure - "cosine" or "jaccard",
+            by default "cosine"
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame of similar queries (not including `query_id`)
+            ordered by descending similarity, with the similarity in
+            the "score" column.
+
+        Notes
+        -----
+        Queries are compared on the tables, operators, function calls
+        and joins in their kql_properties and on their tactics and
+        techniques. The feature matrix is built on first use and
+        updated as queries are added.
+
+        """
+        row_id = self._row_ids[query_id]
+        row_ids, scores = self._get_feature_matrix().similar(row_id, k, metric)
+        results = self._get_df(row_ids)
+        results["score"] = scores
+        return results
 
     def get_filter_lists(
         self, categories: Optional[List[str]] = None
     ) -> Dict[str, List[str]]:
         """Return unique lists of values for each category."""
         return {
-            attrib: sorted(self._indexes[attrib].index.unique())
+            attrib: sorted(self._indexes[attrib].keys())
             for attrib in {**self._ATTRIB_INDEXES, **self._KQL_INDEXES}
             if attrib in self._indexes and (categories is None or attrib in categories)
         }
 
-    def find_queries(self, case: bool = False, **kwargs) -> pd.DataFrame:
+    def find_queries(
+        self, *, where: Optional[str] = None, case: bool = False, **kwargs
+    ) -> ResultSet:
         """
-        Return matching values as a pandas DataFrame.
+        Return the matching queries as a lazy ResultSet.
 
         Parameters
         ----------
+        where : Optional[str], optional
+            A filter expression - e.g.
+            'tables has_any ("SigninLogs", "AuditLogs") and not operators has "join"'.
+            See `filter_expr` for the expression syntax. The expression
+            is ANDed with any keyword criteria.
         case : bool, optional
             Use case-sensitive matching, by default False
 
@@ -171,16 +692,24 @@ class DataStore:
         kwargs :
             You can specify search criteria in the general form attrib_name=expression.
             You can specify multiple criteria - all will be ANDed together.
-            attrib=value - exact match (case sensitive for strings)
+            attrib=value - exact match (case insensitive for strings unless
+            `case` is True)
             attrib={operator: value} - match based on a string operator (matches,
             contains, startswith, endswith)
-            attrib=["value1", "value2"] - intersection of items that have
-            matches for ALL items in the list.
+            attrib=["value1", "value2"] - for indexed attributes, intersection
+            of items that have matches for ALL items in the list. For other
+            attributes, exact match of ANY of the values.
+            attrib={"all": [...], "any": [...], "none": [...]} - for indexed
+            attributes (e.g. tables, operators, tactics), match queries
+            that have ALL, ANY or NONE of the values. Multiple set operators
+            are ANDed together.
 
         Returns
         -------
-        pd.DataFrame
-            DataFrame of matching queries
+        ResultSet
+            The matching queries. Use `order_by`, `limit`, `offset`,
+            `page` and `select` to choose the rows and columns and
+            `to_df` to return them as a DataFrame.
 
         Examples
         --------
@@ -190,153 +719,714 @@ class DataStore:
         - query_name={matches: "AAD.*"} - match based on an operator
           like regex, startswith, contains
         - table=["table1", "table2"] - the queries that use both these tables
+        - tables={"any": ["table1", "table2"], "none": ["table3"]} - queries
+          that use either table1 or table2 but do not use table3
 
         >>>> ds.find_queries(
                  query_name={"contains": "AAD"},
                  tables=["table1", "table2"],
                  operations=[...]
             )
+        >>>> ds.find_queries(
+                 where='(tables has "SigninLogs" or tactics has "Persistence")'
+                 ' and query_name matches "AAD.*"'
+            )
+
+        Notes
+        -----
+        The criteria are evaluated in the order chosen by the query
+        planner - indexed attributes first, in order of their estimated
+        number of matches. Use `explain` to show the plan.
 
         """
-        if self._data_df is None:
-            return pd.DataFrame()
-        # Create a base criterion where all rows == True
-        criteria = self._data_df.index.notna()
         debug = kwargs.pop("debug", False)
-        valid_fields = KqlQuery.field_names() + list(self._indexes.keys())
+        return ResultSet(self, self._find_row_ids(case, kwargs, debug, where))
+
+    def explain(
+        self, *, where: Optional[str] = None, case: bool = False, **kwargs
+    ) -> str:
+        """
+        Return the query plan for `find_queries` criteria.
+
+        The parameters are the same as `find_queries`. Each line of the
+        plan is a step with its estimated number of matching rows.
+        INDEX steps are evaluated with the attribute indexes and SCAN
+        steps by reading the column values of the remaining rows.
+
+        Examples
+        --------
+        >>>> print(
+                 ds.explain(
+                     where='query_name matches "AAD.*" and tables has "SigninLogs"'
+                 )
+             )
+        AND (est. 95 rows)
+          INDEX tables has_all ("SigninLogs") (est. 95 rows)
+          SCAN query_name matches "AAD.*" (est. 1032 rows)
+
+        """
+        return self._get_plan(self._get_filter(where, kwargs)).explain()
+
+    def get_facets(
+        self,
+        categories: Optional[List[str]] = None,
+        case: bool = False,
+        disjunctive: bool = False,
+        **kwargs,
+    ) -> Dict[str, Dict[Any, int]]:
+        """
+        Return the count of matching queries for each indexed value.
+
+        Parameters
+        ----------
+        categories : Optional[List[str]], optional
+            The indexed attributes to return (e.g. tables, operators),
+            by default all indexed attributes.
+        case : bool, optional
+            Use case-sensitive matching, by default False
+        disjunctive : bool, optional
+            If True, the counts for each attribute ignore the criteria
+            on that attribute (so that the other values of the attribute
+            remain available to add to the selection), by default False
+
+        Other Parameters
+        ----------------
+        kwargs :
+            Search criteria, in the same form as `find_queries`.
+
+        Returns
+        -------
+        Dict[str, Dict[Any, int]]
+            For each attribute, a dictionary of value to the number of
+            matching queries that have the value, ordered by descending
+            count. Values with no matching queries are not included.
+
+        Examples
+        --------
+        >>>> ds.get_facets(["operators"], tables={"any": ["SigninLogs"]})
+        {"operators": {"where": 120, "project": 87, ...}}
+
+        """
+        row_ids = self._find_row_ids(case, kwargs)
+        facets = {}
+        for attrib in {**self._ATTRIB_INDEXES, **self._KQL_INDEXES}:
+            if attrib not in self._indexes:
+                continue
+            if categories is not None and attrib not in categories:
+                continue
+            facet_ids = row_ids
+            if disjunctive and attrib in kwargs:
+                other_criteria = {
+                    arg_name: arg_expr
+                    for arg_name, arg_expr in kwargs.items()
+                    if arg_name != attrib
+                }
+                facet_ids = self._find_row_ids(case, other_criteria)
+            mask = np.zeros(len(self), dtype=bool)
+            mask[facet_ids] = True
+            counts = self._indexes[attrib].value_counts(mask)
+            facets[attrib] = dict(
+                sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))
+            )
+        return facets
+
+    def cache_info(self) -> CacheInfo:
+        """Return hit/miss statistics for the find_queries result cache."""
+        return self._query_cache.info()
+
+    def clear_cache(self):
+        """Clear the find_queries result cache."""
+        self._query_cache.clear()
+
+    def _check_writable(self):
+        """Raise an error if the store is frozen."""
+        if self._frozen:
+            raise RuntimeError(
+                "The store is read-only (frozen).",
+                "Use copy() to create a writable version of the store.",
+            )
+
+    def _find_row_ids(
+        self,
+        case: bool,
+        kwargs: Dict[str, Any],
+        debug: bool = False,
+        where: Optional[str] = None,
+    ) -> np.ndarray:
+        """Return the (cached) sorted row ids matching find_queries criteria."""
+        filter_expr = self._get_filter(where, kwargs)
+        cache_key = None if debug else self._get_cache_key(case, kwargs, where)
+        if cache_key is not None:
+            row_ids = self._query_cache.get(cache_key, self._generation)
+            if row_ids is not None:
+                return row_ids
 
+        plan = self._get_plan(filter_expr)
+        if debug:
+            logging.debug("Query plan:\n%s", plan.explain())
+        criteria = plan.execute(
+            lambda predicate, rows: self._get_predicate_matches(predicate, rows, case)
+        )
+        if debug:
+            logging.debug("Matching rows: %d", criteria.count())
+        row_ids = criteria.to_ids()
+        if cache_key is not None:
+            row_ids.flags.writeable = False
+            self._query_cache.put(cache_key, self._generation, row_ids)
+        return row_ids
+
+    def _get_filter(
+        self, where: Optional[str], kwargs: Dict[str, Any]
+    ) -> Optional[FilterExpr]:
+        """Return the filter expression for a where expression and criteria."""
+        valid_fields = set(KqlQuery.field_names()) | self._indexed_attribs
         for arg_name, arg_expr in kwargs.items():
             if arg_name not in valid_fields:
                 raise ValueError(
                     f"Unknown attribute name {arg_name}",
                     f"Search expression: {arg_expr}.",
                 )
-            if isinstance(arg_expr, str):
-                criteria &= self._data_df[arg_name] == arg_expr
-            if isinstance(arg_expr, dict):
-                operator, expr = next(iter(arg_expr.items()))
-                crit_expr = self._OPERATOR.get(operator)
-                if crit_expr:
-                    criteria &= self._data_df[arg_name].str.match(
-                        crit_expr.format(expr=expr), case=case
-                    )
-                    if debug:
-                        print(arg_expr, criteria.value_counts())
-            if isinstance(arg_expr, list) and arg_name in self._indexes:
-                query_ids = self._get_matching_ids(debug, arg_name, arg_expr)
-
-                # Add the matched query IDs to criteria
-                criteria &= self._data_df.index.isin(query_ids)
-                if debug:
-                    print(arg_expr, criteria.value_counts())
-        # return the data subset
-        if debug:
-            print("final criteria:", criteria.value_counts())
-        return self._data_df[criteria]
-
-    def _get_matching_ids(self, debug, arg_name, arg_expr):
-        query_ids: Optional[Set] = None
-        # we're looking for queries in the indexes that have a matching value
-        for match_value in arg_expr:
-            # matched_ids == all query_ids with this property
-            matched_ids = set(
-                self._indexes[arg_name][self._indexes[arg_name].index == match_value][
-                    "query_id"
-                ].values
+        exprs = [
+            expr
+            for expr in (
+                parse_filter(where) if where else None,
+                criteria_to_filter(kwargs, self._indexed_attribs),
             )
-        if debug:
-            print(len(matched_ids))
-        # AND this with query_ids (unless None, then just use this as the
-        # first criterion)
-        return matched_ids if query_ids is None else matched_ids | query_ids
+            if expr is not None
+        ]
+        if len(exprs) < 2:
+            return exprs[0] if exprs else None
+        return And(tuple(exprs))
+
+    def _get_plan(self, filter_expr: Optional[FilterExpr]) -> QueryPlan:
+        """Return the query plan for a filter expression."""
+        return QueryPlan(filter_expr, self._estimate_matches, len(self))
+
+    @property
+    def _indexed_attribs(self) -> Set[str]:
+        """Return the names of the indexed attributes."""
+        return set(self._ALL_INDEXES) | set(self._indexes)
+
+    def _get_index_operands(self, predicate: Predicate) -> Tuple[str, List[Any]]:
+        """Return the set operator ("all" or "any") and values of an index predicate."""
+        if predicate.operator in ("has_all", "=="):
+            operator = "all"
+        elif predicate.operator in ("has_any", "in"):
+            operator = "any"
+        else:
+            raise ValueError(
+                f"Operator {predicate.operator} is not valid for the indexed",
+                f"attribute {predicate.attribute}. Use {', '.join(INDEX_OPERATORS)}.",
+            )
+        values = predicate.value
+        return operator, list(values) if isinstance(values, tuple) else [values]
+
+    def _estimate_matches(self, predicate: Predicate) -> Tuple[bool, int]:
+        """Return whether a predicate is indexed and its estimated matching rows."""
+        attrib = predicate.attribute
+        if attrib in self._indexed_attribs:
+            operator, values = self._get_index_operands(predicate)
+            index = self._indexes.get(attrib)
+            counts = [len(index.get(value)) if index else 0 for value in values]
+            if operator == "all":
+                return True, min(counts, default=len(self))
+            return True, sum(counts)
+        if attrib not in KqlQuery.field_names():
+            raise ValueError(f"Unknown attribute name {attrib}")
+        if predicate.operator in INDEX_OPERATORS:
+            raise ValueError(
+                f"Operator {predicate.operator} is only valid for indexed attributes",
+                f"({', '.join(sorted(self._indexed_attribs))}).",
+            )
+        if predicate.operator in ("==", "in"):
+            column = self._columns[attrib]
+            distinct = len(self)
+            if column.kind == "category":
+                distinct = len(column.categories)
+            elif column.kind == "blob":
+                distinct = column.num_blobs
+            num_values = len(predicate.value) if predicate.operator == "in" else 1
+            return False, num_values * len(self) // max(distinct, 1)
+        return False, int(len(self) * self._REGEX_SELECTIVITY)
+
+    def _get_predicate_matches(
+        self, predicate: Predicate, rows: Bitmap, case: bool
+    ) -> Bitmap:
+        """Return the rows (of `rows`) matching a predicate."""
+        attrib = predicate.attribute
+        if attrib in self._indexed_attribs:
+            operator, values = self._get_index_operands(predicate)
+            index = self._indexes.get(attrib)
+            if index is None:
+                return Bitmap.empty(len(self))
+            if operator == "all":
+                return index.match_all(values, len(self))
+            return index.match_any(values, len(self))
+        if predicate.operator in ("==", "in"):
+            values = predicate.value
+            if not isinstance(values, tuple):
+                values = (values,)
+            return self._get_exact_matches(attrib, values, case, rows)
+        pattern = self._OPERATOR[predicate.operator].format(expr=predicate.value)
+        return self._get_regex_matches(attrib, pattern, case, rows)
+
+    def _get_cache_key(
+        self, case: bool, criteria: Dict[str, Any], where: Optional[str] = None
+    ) -> Optional[Hashable]:
+        """Return a normalized, order-insensitive key for query criteria."""
+        try:
+            return (
+                case,
+                where,
+                frozenset(
+                    (arg_name, self._normalize_expr(arg_name, arg_expr, case))
+                    for arg_name, arg_expr in criteria.items()
+                ),
+            )
+        except TypeError:
+            # unhashable expression - don't cache
+            return None
+
+    def _normalize_expr(self, arg_name: str, arg_expr: Any, case: bool) -> Hashable:
+        """Return a hashable, normalized form of a query expression."""
+        if arg_name in self._indexed_attribs:
+            if isinstance(arg_expr, (str, bool, list)):
+                arg_expr = {"all": arg_expr}
+            return frozenset(
+                (
+                    operator,
+                    frozenset([values] if isinstance(values, (str, bool)) else values),
+                )
+                for operator, values in arg_expr.items()
+            )
+        if isinstance(arg_expr, dict):
+            # only the first operator is evaluated (see criteria_to_filter)
+            operator, expr = next(iter(arg_expr.items()))
+            return operator, self._normalize_pattern(expr, case)
+        if isinstance(arg_expr, list):
+            # matches ANY of the values, in any order
+            return frozenset(self._normalize_value(value, case) for value in arg_expr)
+        return self._normalize_value(arg_expr, case)
 
     @staticmethod
-    def _read_json_data(json_path: str):
-        return json.loads(Path(json_path).read_text(encoding="utf-8"))
+    def _normalize_value(value: Any, case: bool) -> Any:
+        """Return the case-insensitive form of an exact match value."""
+        return value if case or not isinstance(value, str) else value.casefold()
 
-    def _create_indexes(self, sub_key: str):
-        """Create indexes for child items in queries."""
-        # create DF with attributes expanded to columns
-        if self._data_df is None:
-            return
-        exp_df = (
-            # avoid rows with null or empty dictionaries
-            self._data_df[
-                ~((self._data_df[sub_key] == {}) | (self._data_df[sub_key].isna()))
-            ][[sub_key]].apply(
-                lambda x: pd.Series(x[sub_key]), result_type="expand", axis=1
+    @staticmethod
+    def _normalize_pattern(expr: Any, case: bool) -> Any:
+        """Return the case-insensitive form of a pattern, if safe to do so."""
+        # escape sequences such as \w and \W are case-sensitive
+        if case or not isinstance(expr, str) or "\\" in expr or not expr.isascii():
+            return expr
+        return expr.lower()
+
+    def _get_exact_matches(
+        self, field: str, values: Tuple[Any, ...], case: bool, criteria: Bitmap
+    ) -> Bitmap:
+        """Return rows (of `criteria`) where `field` is equal to any of `values`."""
+        column = self._columns[field]
+        if column.kind == "category":
+            # match the distinct values then select the rows with those values
+            codes = np.flatnonzero(self._match_values(column.categories, values, case))
+            return Bitmap.from_mask(np.isin(column.codes, codes))
+        row_ids = criteria.to_ids()
+        matches = self._match_values(column.take(row_ids), values, case)
+        return Bitmap.from_ids(row_ids[matches], criteria.size)
+
+    @staticmethod
+    def _match_values(
+        values: Sequence[Any], targets: Tuple[Any, ...], case: bool
+    ) -> np.ndarray:
+        """Return a boolean mask of the `values` equal to any of `targets`."""
+        series = pd.Series(_object_array(values), dtype=object)
+        if not case:
+            series = series.map(
+                lambda value: value.casefold() if isinstance(value, str) else value
+            )
+            targets = tuple(
+                target.casefold() if isinstance(target, str) else target
+                for target in targets
+            )
+        return series.isin(targets).values
+
+    def _get_regex_matches(
+        self, field: str, pattern: str, case: bool, criteria: Bitmap
+    ) -> Bitmap:
+        """Return rows where `field` matches `pattern`."""
+        column = self._columns[field]
+        candidates = None
+        if field in self._TRIGRAM_FIELDS:
+            candidates = self._get_trigram_index(field).candidates(pattern)
+        if column.kind == "category":
+            # match the distinct values then select the rows with those values
+            categories = _object_array(column.categories)
+            codes = self._match_regex(categories, pattern, case, candidates)
+            return Bitmap.from_mask(np.isin(column.codes, codes))
+        if candidates is not None:
+            # only verify the candidates that match the other criteria
+            candidates = (
+                Bitmap.from_ids(candidates, criteria.size) & criteria
+            ).to_ids()
+        elif criteria.count() < criteria.size:
+            candidates = criteria.to_ids()
+        return Bitmap.from_ids(
+            self._match_regex(column.values(), pattern, case, candidates),
+            criteria.size,
+        )
+
+    @staticmethod
+    def _match_regex(
+        values: np.ndarray, pattern: str, case: bool, candidates: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """Return the positions of `values` (or `candidates`) that match `pattern`."""
+        if candidates is None:
+            return np.flatnonzero(
+                pd.Series(values, dtype=object)
+                .str.match(pattern, case=case)
+                .fillna(False)
+                .values.astype(bool)
             )
+        regex = re.compile(pattern, flags=0 if case else re.IGNORECASE)
+        return np.array(
+            [
+                pos
+                for pos in candidates
+                if isinstance(values[pos], str) and regex.match(values[pos])
+            ],
+            dtype=int,
         )
-        for key, data_type in self._ALL_INDEXES.items():
-            if key not in exp_df.columns:
+
+    def _get_trigram_index(self, field: str) -> TrigramIndex:
+        """Return the trigram index for `field`, creating it if needed."""
+        column = self._columns[field]
+        if field not in self._trigram_indexes:
+            self._trigram_indexes[field] = TrigramIndex.from_values(
+                column.categories if column.kind == "category" else column.values()
+            )
+        trigram_index = self._trigram_indexes[field]
+        if column.kind == "category":
+            # index any categories added since the index was created
+            for code in range(trigram_index.size, len(column.categories)):
+                trigram_index.set_row(code, column.categories[code])
+        return trigram_index
+
+    @staticmethod
+    def _read_json_data(json_path: str) -> Iterator[KqlQuery]:
+        """Yield queries from a JSON array or NDJSON (optionally gzip) file."""
+        query_text: Dict[str, str] = {}
+        for record in read_json_records(json_path):
+            if "query" not in record:
+                # query text de-duplicated by to_json
+                record["query"] = query_text[record["query_hash"]]
+            elif record.get("query_hash"):
+                query_text.setdefault(record["query_hash"], record["query"])
+            # the stored query_hash and repo_name are not derived again
+            yield KqlQuery.from_record(record)
+
+    def _to_record(self, query: KqlQuery) -> Dict[str, Any]:
+        """Return the column values for a query."""
+        record = query.to_record()
+        record.update(self._split_kql_properties(query.kql_properties))
+        return record
+
+    def _split_kql_properties(
+        self, kql_properties: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Split kql_properties into list column values and other properties."""
+        kql_properties = dict(kql_properties or {})
+        record: Dict[str, Any] = {}
+        for key in self._LIST_PROPERTIES:
+            value = kql_properties.get(key)
+            if isinstance(value, list) and all(isinstance(item, str) for item in value):
+                record[key] = kql_properties.pop(key)
+            else:
+                record[key] = None
+        record["kql_properties"] = kql_properties
+        return record
+
+    def _get_kql_properties(self, row_id: int) -> Dict[str, Any]:
+        """Return the kql_properties of a row."""
+        kql_properties = {
+            key: value
+            for key in self._LIST_PROPERTIES
+            for value in [self._columns[key][row_id]]
+            if value is not None
+        }
+        kql_properties.update(self._columns["kql_properties"][row_id] or {})
+        return kql_properties
+
+    def _get_record(self, row_id: int) -> Dict[str, Any]:
+        """Return the KqlQuery fields of a row as a dict."""
+        record = {name: self._columns[name][row_id] for name in KqlQuery.field_names()}
+        record["kql_properties"] = self._get_kql_properties(row_id)
+        return record
+
+    def _get_query(self, row_id: int) -> KqlQuery:
+        """Return a row as a KqlQuery."""
+        return KqlQuery.from_record(self._get_record(row_id))
+
+    def _take_column(self, column: str, row_ids: Sequence[int]) -> Sequence:
+        """Return the values of `column` for `row_ids`, in row_ids order."""
+        return self._columns[column].take(row_ids)
+
+    def _get_df(
+        self,
+        row_ids: Optional[Sequence[int]] = None,
+        columns: Optional[List[str]] = None,
+        index: bool = True,
+    ) -> pd.DataFrame:
+        """
+        Return a DataFrame of queries.
+
+        Parameters
+        ----------
+        row_ids : Optional[Sequence[int]], optional
+            The rows to return, by default all rows.
+        columns : Optional[List[str]], optional
+            The query fields to return, by default all fields.
+        index : bool, optional
+            If True (the default) the DataFrame is indexed by query_id.
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame of the queries.
+
+        """
+        if row_ids is None:
+            row_ids = np.arange(len(self))
+        data = {}
+        for name in KqlQuery.field_names():
+            if columns is not None and name not in columns and name != "query_id":
                 continue
-            if data_type == list:
-                self._indexes[key] = self._create_list_index(
-                    data=exp_df,
-                    key_col=key,
-                )
-            if data_type == dict:
-                self._indexes[key] = self._create_dict_index(
-                    data=exp_df,
-                    key_col=key,
+            if name == "kql_properties":
+                data[name] = _object_array(
+                    [self._get_kql_properties(row) for row in row_ids]
                 )
-            if data_type == bool:
-                self._indexes[key] = self._create_bool_index(
-                    data=exp_df,
-                    key_col=key,
+            else:
+                data[name] = self._columns[name].take(row_ids)
+        data_df = pd.DataFrame(data)
+        if index:
+            return data_df.set_index("query_id")
+        return data_df if columns is None or "query_id" in columns else data_df[columns]
+
+    def _add_rows_to_indexes(self, row_ids: Iterable[int]):
+        """Add attributes and kql_properties of rows to indexes."""
+        for key, (values, rows) in self._get_index_pairs(row_ids).items():
+            new_index = InvertedIndex.from_pairs(values, rows)
+            if key in self._indexes:
+                self._indexes[key].update(new_index)
+            else:
+                self._indexes[key] = new_index
+
+    def _get_index_pairs(
+        self, row_ids: Iterable[int]
+    ) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """
+        Return the (index values, row ids) arrays of rows for each index key.
+
+        The list kql_properties (e.g. tables) are read from the flattened
+        list columns. The values of the other index keys are read from
+        the attributes and kql_properties dicts and flattened with
+        array operations for all rows at once. Keys that are present
+        in any of the rows are returned, even if they have no values.
+
+        """
+        row_ids = np.fromiter(row_ids, dtype=np.int64)
+        attributes = [
+            value or {} for value in self._columns["attributes"].take(row_ids)
+        ]
+        kql_properties = [
+            value or {} for value in self._columns["kql_properties"].take(row_ids)
+        ]
+        present_keys = {key for attribs in attributes for key in attribs}
+        present_keys.update(key for kql_props in kql_properties for key in kql_props)
+
+        pairs = {}
+        for key, data_type in self._ALL_INDEXES.items():
+            items, positions = np.empty(0, dtype=object), np.empty(0, dtype=np.int64)
+            has_list = np.zeros(len(row_ids), dtype=bool)
+            if key in self._LIST_PROPERTIES:
+                items, positions, has_list = self._columns[key].flatten(row_ids)
+            if not has_list.any() and key not in present_keys:
+                continue
+            if key in present_keys:
+                # kql_properties replace attributes and list columns replace both
+                values = _object_array(
+                    [
+                        kql_props[key] if key in kql_props else attribs.get(key)
+                        for attribs, kql_props in zip(attributes, kql_properties)
+                    ]
                 )
+                values[has_list] = None
+                dict_items, dict_positions = _flatten_index_values(values, data_type)
+                items = np.concatenate([items, dict_items])
+                positions = np.concatenate([positions, dict_positions])
+            pairs[key] = (items, row_ids[positions])
+        return pairs
+
+    def _add_item_to_indexes(self, row_id: int):
+        """Add attributes and kql_properties of a new row to indexes."""
+        for key, values in self._get_indexed_attribs(row_id).items():
+            index = self._indexes.setdefault(key, InvertedIndex())
+            for value in values:
+                index.add(value, row_id)
+
+    def _update_item_indexes(self, row_id: int, keys: Set[str]):
+        """Replace the index entries of an existing row for `keys`."""
+        index_attribs = self._get_indexed_attribs(row_id)
+        for key in keys:
+            if key not in self._ALL_INDEXES:
+                continue
+            if key not in self._indexes and not index_attribs.get(key):
+                continue
+            index = self._indexes.setdefault(key, InvertedIndex())
+            index.set_row(row_id, index_attribs.get(key, []))
 
-    def _add_item_to_indexes(self, query: KqlQuery):
-        """Add attributes and kql_properties to indexes."""
-        index_attribs = {**(query.attributes), **(query.kql_properties)}
-        for key in self._ALL_INDEXES:
-            if key not in index_attribs:
+    def _get_indexed_attribs(self, row_id: int) -> Dict[str, List[Any]]:
+        """Return the index values of a row for each index key."""
+        index_attribs = {
+            **(self._columns["attributes"][row_id] or {}),
+            **self._get_kql_properties(row_id),
+        }
+        return {
+            key: self._get_index_values(index_attribs[key], data_type)
+            for key, data_type in self._ALL_INDEXES.items()
+            if key in index_attribs
+        }
+
+    def _add_to_search_indexes(self, row_ids: List[int]):
+        """Add (or replace) rows in the search, near-duplicate and feature indexes."""
+        for field, trigram_index in self._trigram_indexes.items():
+            column = self._columns[field]
+            if column.kind == "category":
+                # category trigram indexes are updated on use
                 continue
-            df_index = (
-                list(index_attribs[key])
-                if isinstance(index_attribs[key], (list, dict))
-                else [index_attribs[key]]
-                if isinstance(index_attribs[key], bool)
-                else None
+            for row_id in row_ids:
+                trigram_index.set_row(row_id, column[row_id])
+        if self._near_dup_index is not None:
+            for row_id in row_ids:
+                self._near_dup_index.add(row_id, self._columns["query"][row_id])
+        if self._feature_matrix is not None:
+            for row_id in row_ids:
+                self._feature_matrix.set_row(row_id, self._get_features(row_id))
+        if self._text_index is None:
+            return
+        for row_id in row_ids:
+            self._text_index.add_terms(row_id, self._get_text_terms(row_id))
+
+    def _get_near_dup_index(self) -> NearDuplicateIndex:
+        """Return the near-duplicate index, creating it if needed."""
+        if self._near_dup_index is None:
+            near_dup_index = NearDuplicateIndex()
+            for row_id, query in enumerate(self._columns["query"].values()):
+                near_dup_index.add(row_id, query)
+            self._near_dup_index = near_dup_index
+        return self._near_dup_index
+
+    def _get_feature_matrix(self) -> FeatureMatrix:
+        """Return the structural feature matrix, creating it if needed."""
+        if self._feature_matrix is None:
+            self._feature_matrix = FeatureMatrix.from_rows(
+                [self._get_features(row_id) for row_id in range(len(self))]
             )
-            if df_index is not None:
-                current_index = self._indexes.get(key)
-                new_index_items = pd.DataFrame(
-                    data=[{"query_id": query.query_id} for _ in df_index],
-                    index=df_index,
-                )
-                if current_index is None:
-                    self._indexes[key] = new_index_items
-                else:
-                    self._indexes[key] = pd.concat(
-                        [self._indexes[key], new_index_items]
-                    )
+        return self._feature_matrix
 
-    @staticmethod
-    def _create_list_index(data, key_col):
-        return (
-            data[[key_col]].explode(key_col).dropna().reset_index().set_index(key_col)
-        )
+    def _get_features(self, row_id: int) -> List[Any]:
+        """Return the (attribute, value) structural features of a row."""
+        return [
+            (key, value)
+            for key, values in self._get_indexed_attribs(row_id).items()
+            if key in self._SIMILARITY_FEATURES
+            for value in values
+        ]
 
-    @staticmethod
-    def _create_bool_index(data, key_col):
-        return data[[key_col]].dropna().reset_index().set_index(key_col)
+    def _get_text_terms(self, row_id: int) -> List[str]:
+        """Return the full text search terms for a row."""
+        return [
+            term
+            for field in self._TEXT_FIELDS
+            for term in tokenize_kql(self._columns[field][row_id])
+        ]
 
     @staticmethod
-    def _extract_dict_keys(row, col_name):
-        if isinstance(row[col_name], dict):
-            return {
-                col_name: [
-                    inner_val
-                    for val in row[col_name].values()
-                    for inner_val in val
-                    if isinstance(val, dict) and inner_val != np.nan
-                ]
-            }
-        return row
+    def _get_index_values(value: Any, data_type: type) -> List[Any]:
+        """Return the list of index values for a property value."""
+        if data_type == bool:
+            return [value] if isinstance(value, bool) else []
+        if isinstance(value, dict):
+            # dict properties (e.g. joins) are indexed by key
+            value = list(value)
+        if isinstance(value, (list, tuple, set)):
+            return [item for item in value if isinstance(item, str)]
+        return []
 
-    def _create_dict_index(self, data, key_col):
-        df_dict_keys = data[[key_col]].apply(
-            lambda x: self._extract_dict_keys(x, key_col), result_type="expand", axis=1
-        )
-        return self._create_list_index(df_dict_keys, key_col)
+
+def _flatten_index_values(
+    values: Sequence[Any], data_type: type
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return the index values of a sequence of property values.
+
+    This is the equivalent of `DataStore._get_index_values` for all of
+    the values at once.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The (object) array of index values and the position in
+        `values` of the property value of each index value.
+
+    """
+    values = _object_array(values)
+    kinds = np.fromiter(map(type, values), dtype=object, count=len(values))
+    if data_type == bool:
+        positions = np.flatnonzero(kinds == bool)
+        return values[positions], positions
+    # dict properties (e.g. joins) are indexed by key
+    positions = np.flatnonzero(
+        (kinds == list) | (kinds == tuple) | (kinds == set) | (kinds == dict)
+    )
+    lengths = np.fromiter(map(len, values[positions]), dtype=np.int64)
+    items = np.fromiter(
+        chain.from_iterable(values[positions]), dtype=object, count=lengths.sum()
+    )
+    positions = np.repeat(positions, lengths)
+    is_str = np.fromiter(map(type, items), dtype=object, count=len(items)) == str
+    return items[is_str], positions[is_str]
+
+
+def _dedupe_query_text(records: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    """Yield records, removing the query text of repeated query_hash values."""
+    written: Set[str] = set()
+    for record in records:
+        query_hash = record.get("query_hash")
+        if query_hash:
+            if query_hash in written:
+                del record["query"]
+            else:
+                written.add(query_hash)
+        yield record
+
+
+class _QueryMapping(Mapping):
+    """Read-only mapping of query_id to KqlQuery, created on access."""
+
+    def __init__(self, store: DataStore):
+        """Initialize the mapping."""
+        self._store = store
+
+    def __getitem__(self, query_id: str) -> KqlQuery:
+        """Return the KqlQuery for `query_id`."""
+        # pylint: disable=protected-access
+        return self._store._get_query(self._store._row_ids[query_id])
+
+    def __iter__(self) -> Iterator[str]:
+        """Iterate over query_ids."""
+        # pylint: disable=protected-access
+        return iter(self._store._row_ids)
+
+    def __len__(self) -> int:
+        """Return the number of queries."""
+        return len(self._store)
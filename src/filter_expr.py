@@ -0,0 +1,449 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+Filter expression language and query planner for DataStore.
+
+Filter expressions combine predicates with `and`, `or`, `not` and
+parentheses. Each predicate is `<attribute> <operator> <value>`.
+
+Operators for indexed attributes (e.g. tables, operators, tactics):
+
+- has - the query has the value
+- has_all - the query has all of a list of values
+- has_any (or in) - the query has any of a list of values
+
+Operators for other query fields (e.g. query_name, source_path):
+
+- == and != - exact match (case-insensitive unless `case` is used)
+- in - exact match of any of a list of values
+- matches (or =~) - regular expression match
+- contains, startswith, endswith - regular expression match
+  at any position, at the start or at the end.
+
+Values are quoted strings, numbers, true/false or lists of values
+in parentheses or brackets.
+
+Examples
+--------
+>>>> parse_filter(
+...     'tables has_any ("SigninLogs", "AuditLogs")'
+...     ' and not operators has "mv-expand"'
+...     ' and (query_name matches "AAD.*" or tactics has "Persistence")'
+... )
+
+"""
+import re
+from dataclasses import dataclass
+from typing import Any, Callable, Collection, Dict, List, Optional, Tuple, Union
+
+from .inverted_index import Bitmap
+
+__author__ = "Ian Hellen"
+
+INDEX_OPERATORS = ("has", "has_all", "has_any")
+SCAN_OPERATORS = ("==", "in", "matches", "contains", "startswith", "endswith")
+
+# "has" is stored as has_all of a single value
+_OPERATOR_ALIASES = {"=~": "matches"}
+_LIST_OPERATORS = ("has_all", "has_any", "in")
+_KEYWORDS = ("and", "or", "not", "true", "false")
+
+_TOKENS = re.compile(
+    r"""
+    \s*(?:
+        (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+        |(?P<number>-?\d+(?:\.\d+)?(?![\w.]))
+        |(?P<symbol>==|!=|=~|[()\[\],])
+        |(?P<word>[A-Za-z_][\w\-]*)
+    )
+    """,
+    re.VERBOSE,
+)
+_ESCAPED_QUOTE = re.compile(r"\\([\\'\"])")
+
+
+class FilterSyntaxError(ValueError):
+    """Invalid filter expression."""
+
+
+@dataclass(frozen=True)
+class Predicate:
+    """A single attribute comparison."""
+
+    attribute: str
+    operator: str
+    value: Any
+
+    def __str__(self) -> str:
+        """Return the predicate as filter expression text."""
+        return f"{self.attribute} {self.operator} {_format_value(self.value)}"
+
+
+@dataclass(frozen=True)
+class And:
+    """Rows matching all of the child expressions."""
+
+    children: Tuple["FilterExpr", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    """Rows matching any of the child expressions."""
+
+    children: Tuple["FilterExpr", ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    """Rows not matching the child expression."""
+
+    child: "FilterExpr"
+
+
+FilterExpr = Union[Predicate, And, Or, Not]
+# (indexed, estimated rows) for a predicate
+Estimator = Callable[[Predicate], Tuple[bool, int]]
+# rows (within the bitmap) matching a predicate
+Evaluator = Callable[[Predicate, Bitmap], Bitmap]
+
+
+def _format_value(value: Any) -> str:
+    """Return a value as filter expression text."""
+    if isinstance(value, tuple):
+        return f"({', '.join(_format_value(item) for item in value)})"
+    if isinstance(value, bool):
+        return str(value).lower()
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+    return str(value)
+
+
+def make_predicate(attribute: str, operator: str, value: Any) -> Predicate:
+    """Return a predicate with a normalized operator and (hashable) value."""
+    operator = _OPERATOR_ALIASES.get(operator, operator)
+    if operator not in INDEX_OPERATORS + SCAN_OPERATORS:
+        raise FilterSyntaxError(f"Unknown operator {operator} for {attribute}.")
+    if operator == "has":
+        operator = "has_all"
+    if isinstance(value, (list, tuple, set, frozenset)):
+        value = tuple(value)
+        if operator not in _LIST_OPERATORS:
+            raise FilterSyntaxError(f"Operator {operator} does not accept a list.")
+    elif operator in _LIST_OPERATORS:
+        value = (value,)
+    return Predicate(attribute, operator, value)
+
+
+def parse_filter(text: str) -> FilterExpr:
+    """
+    Return the expression tree of a filter expression.
+
+    Raises
+    ------
+    FilterSyntaxError
+        If the expression is not valid.
+
+    """
+    return _Parser(text).parse()
+
+
+def criteria_to_filter(
+    criteria: Dict[str, Any], indexed: Collection[str]
+) -> Optional[FilterExpr]:
+    """
+    Return the filter expression for `find_queries` keyword criteria.
+
+    Parameters
+    ----------
+    criteria : Dict[str, Any]
+        The criteria - attrib=expression.
+    indexed : Collection[str]
+        The names of the indexed attributes.
+
+    Returns
+    -------
+    Optional[FilterExpr]
+        The AND of the criteria or None if there are no criteria.
+
+    """
+    predicates: List[FilterExpr] = []
+    for attrib, expr in criteria.items():
+        if attrib in indexed:
+            if isinstance(expr, (str, bool, list)):
+                expr = {"all": expr}
+            if not isinstance(expr, dict):
+                raise TypeError(
+                    f"Unsupported expression type for {attrib}: {type(expr)}"
+                )
+            for set_op, values in expr.items():
+                if set_op not in ("all", "any", "none"):
+                    raise ValueError(
+                        f"Unknown operator {set_op} for {attrib}.",
+                        "Valid operators are all, any, none.",
+                    )
+                if isinstance(values, (str, bool)):
+                    values = [values]
+                if not values:
+                    continue
+                operator = "has_all" if set_op == "all" else "has_any"
+                predicate = make_predicate(attrib, operator, values)
+                predicates.append(Not(predicate) if set_op == "none" else predicate)
+        elif isinstance(expr, dict):
+            # only the first operator is used
+            operator, value = next(iter(expr.items()))
+            if operator in SCAN_OPERATORS:
+                predicates.append(make_predicate(attrib, operator, value))
+        elif isinstance(expr, list):
+            predicates.append(make_predicate(attrib, "in", expr))
+        else:
+            predicates.append(make_predicate(attrib, "==", expr))
+    if not predicates:
+        return None
+    return predicates[0] if len(predicates) == 1 else And(tuple(predicates))
+
+
+class QueryPlan:
+    """
+    Execution plan for a filter expression.
+
+    Parameters
+    ----------
+    expr : Optional[FilterExpr]
+        The filter expression - None matches all rows.
+    estimator : Estimator
+        Function returning (indexed, estimated rows) for a predicate.
+    size : int
+        The number of rows in the store.
+
+    Notes
+    -----
+    The children of each AND and OR are ordered so that indexed
+    predicates (evaluated with posting list bitmaps) run before scan
+    predicates (evaluated by reading column values), then by the
+    estimated number of matching rows - ascending for AND and
+    descending for OR. Each child is only evaluated
+    for the rows that can still change the result - the matches of
+    the preceding children of an AND and the non-matches of the
+    preceding children of an OR - and evaluation stops when no
+    rows remain.
+
+    """
+
+    def __init__(self, expr: Optional[FilterExpr], estimator: Estimator, size: int):
+        """Create the plan."""
+        self.size = size
+        self.root = None if expr is None else self._plan(expr, estimator)
+
+    def execute(self, evaluator: Evaluator) -> Bitmap:
+        """Return the bitmap of rows matching the expression."""
+        rows = Bitmap.full(self.size)
+        if self.root is None:
+            return rows
+        return self._execute(self.root, evaluator, rows)
+
+    def explain(self) -> str:
+        """Return a description of the plan."""
+        if self.root is None:
+            return f"ALL (est. {self.size} rows)"
+        return "\n".join(self._explain(self.root, 0))
+
+    def _plan(self, expr: FilterExpr, estimator: Estimator) -> "_PlanNode":
+        """Return the plan tree for an expression."""
+        if isinstance(expr, Predicate):
+            indexed, estimate = estimator(expr)
+            return _PlanNode(expr, indexed, min(estimate, self.size), [])
+        if isinstance(expr, Not):
+            child = self._plan(expr.child, estimator)
+            return _PlanNode(expr, child.indexed, self.size - child.estimate, [child])
+        # an AND runs the most selective children first (leaving the
+        # fewest rows to check) an OR the least selective (leaving the
+        # fewest non-matching rows to check)
+        sign = 1 if isinstance(expr, And) else -1
+        children = sorted(
+            (self._plan(child, estimator) for child in _flatten(expr)),
+            key=lambda node: (not node.indexed, sign * node.estimate),
+        )
+        if isinstance(expr, And):
+            estimate = min(child.estimate for child in children)
+        else:
+            estimate = min(sum(child.estimate for child in children), self.size)
+        indexed = all(child.indexed for child in children)
+        return _PlanNode(expr, indexed, estimate, children)
+
+    def _execute(self, node: "_PlanNode", evaluator: Evaluator, rows: Bitmap) -> Bitmap:
+        """Return the rows (of `rows`) matching a plan node."""
+        if isinstance(node.expr, Predicate):
+            return evaluator(node.expr, rows) & rows
+        if isinstance(node.expr, Not):
+            return rows - self._execute(node.children[0], evaluator, rows)
+        if isinstance(node.expr, And):
+            for child in node.children:
+                if not rows:
+                    break
+                rows = self._execute(child, evaluator, rows)
+            return rows
+        matches = Bitmap.empty(self.size)
+        for child in node.children:
+            if not rows:
+                break
+            child_matches = self._execute(child, evaluator, rows)
+            matches |= child_matches
+            rows -= child_matches
+        return matches
+
+    def _explain(self, node: "_PlanNode", depth: int) -> List[str]:
+        """Return the description lines of a plan node."""
+        indent = "  " * depth
+        estimate = f"(est. {node.estimate} rows)"
+        if isinstance(node.expr, Predicate):
+            method = "INDEX" if node.indexed else "SCAN"
+            return [f"{indent}{method} {node.expr} {estimate}"]
+        lines = [f"{indent}{type(node.expr).__name__.upper()} {estimate}"]
+        for child in node.children:
+            lines.extend(self._explain(child, depth + 1))
+        return lines
+
+
+def _flatten(expr: Union[And, Or]) -> List[FilterExpr]:
+    """Return the children of an AND/OR, merging nested nodes of the same type."""
+    children: List[FilterExpr] = []
+    for child in expr.children:
+        if type(child) is type(expr):
+            children.extend(_flatten(child))  # type: ignore
+        else:
+            children.append(child)
+    return children
+
+
+@dataclass
+class _PlanNode:
+    """Node of a query plan."""
+
+    expr: FilterExpr
+    indexed: bool
+    estimate: int
+    children: List["_PlanNode"]
+
+
+class _Parser:
+    """Recursive descent parser for filter expressions."""
+
+    def __init__(self, text: str):
+        """Tokenize the expression."""
+        self._text = text
+        self._tokens: List[Tuple[str, Any]] = []
+        self._pos = 0
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKENS.match(text, pos)
+            if not match or match.end() == pos:
+                raise FilterSyntaxError(f"Invalid filter expression at: {text[pos:]}")
+            pos = match.end()
+            kind = match.lastgroup
+            token = match[kind]
+            if kind == "string":
+                self._tokens.append(("value", _ESCAPED_QUOTE.sub(r"\1", token[1:-1])))
+            elif kind == "number":
+                number = float(token) if "." in token else int(token)
+                self._tokens.append(("value", number))
+            elif kind == "word" and token.casefold() in _KEYWORDS:
+                self._tokens.append(("keyword", token.casefold()))
+            else:
+                self._tokens.append((kind, token))
+
+    def parse(self) -> FilterExpr:
+        """Return the expression tree."""
+        if not self._tokens:
+            raise FilterSyntaxError("Empty filter expression.")
+        expr = self._parse_or()
+        if self._pos < len(self._tokens):
+            self._error()
+        return expr
+
+    def _peek(self) -> Tuple[str, Any]:
+        """Return the next token."""
+        if self._pos < len(self._tokens):
+            return self._tokens[self._pos]
+        return ("end", None)
+
+    def _next(self) -> Tuple[str, Any]:
+        """Return and consume the next token."""
+        token = self._peek()
+        self._pos += 1
+        return token
+
+    def _accept(self, kind: str, value: Any) -> bool:
+        """Consume the next token if it matches."""
+        if self._peek() == (kind, value):
+            self._pos += 1
+            return True
+        return False
+
+    def _expect(self, kind: str, value: Any):
+        """Consume the next token or raise an error."""
+        if not self._accept(kind, value):
+            self._error()
+
+    def _error(self):
+        """Raise a syntax error for the next token."""
+        kind, value = self._peek()
+        found = "end of expression" if kind == "end" else repr(value)
+        raise FilterSyntaxError(f"Unexpected {found} in filter: {self._text}")
+
+    def _parse_or(self) -> FilterExpr:
+        children = [self._parse_and()]
+        while self._accept("keyword", "or"):
+            children.append(self._parse_and())
+        return children[0] if len(children) == 1 else Or(tuple(children))
+
+    def _parse_and(self) -> FilterExpr:
+        children = [self._parse_not()]
+        while self._accept("keyword", "and"):
+            children.append(self._parse_not())
+        return children[0] if len(children) == 1 else And(tuple(children))
+
+    def _parse_not(self) -> FilterExpr:
+        if self._accept("keyword", "not"):
+            return Not(self._parse_not())
+        if self._accept("symbol", "("):
+            expr = self._parse_or()
+            self._expect("symbol", ")")
+            return expr
+        return self._parse_predicate()
+
+    def _parse_predicate(self) -> FilterExpr:
+        kind, attribute = self._next()
+        if kind != "word":
+            self._pos -= 1
+            self._error()
+        kind, operator = self._next()
+        if kind not in ("word", "symbol") or operator in "()[],":
+            self._pos -= 1
+            self._error()
+        negate = operator == "!="
+        value = self._parse_value()
+        try:
+            predicate = make_predicate(attribute, "==" if negate else operator, value)
+        except FilterSyntaxError as err:
+            raise FilterSyntaxError(f"{err} In filter: {self._text}") from err
+        return Not(predicate) if negate else predicate
+
+    def _parse_value(self) -> Any:
+        for open_char, close_char in (("(", ")"), ("[", "]")):
+            if self._accept("symbol", open_char):
+                values = [self._parse_value()]
+                while self._accept("symbol", ","):
+                    values.append(self._parse_value())
+                self._expect("symbol", close_char)
+                return tuple(values)
+        kind, value = self._next()
+        if kind == "value":
+            return value
+        if kind == "keyword" and value in ("true", "false"):
+            return value == "true"
+        self._pos -= 1
+        return self._error()
@@ -0,0 +1,134 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+Benchmark of DataStore attribute and KQL property index construction.
+
+Run from the repository root with:
+
+    python -m src.index_benchmark --sizes 4000 100000 1000000
+
+"""
+
+import argparse
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+from .data_store import DataStore
+from .inverted_index import InvertedIndex
+
+__author__ = "Ian Hellen"
+
+_TABLES = [f"Table{idx}" for idx in range(200)]
+_OPERATORS = ["where", "project", "extend", "summarize", "join", "mv-expand", "take"]
+_FUNCTIONS = [f"function{idx}" for idx in range(100)]
+_FIELDS = [f"Field{idx}" for idx in range(1000)]
+_TACTICS = ["Persistence", "Execution", "Discovery", "LateralMovement", "Collection"]
+
+
+def _add_script_args():
+    parser = argparse.ArgumentParser(description="DataStore index build benchmark.")
+    parser.add_argument(
+        "--sizes",
+        "-s",
+        nargs="+",
+        type=int,
+        default=[4000, 100000, 1000000],
+        help="Numbers of queries to index.",
+    )
+    parser.add_argument(
+        "--repeat",
+        "-r",
+        type=int,
+        default=3,
+        help="Number of times to build each index (the best time is reported).",
+    )
+    return parser
+
+
+def _get_record(ds: DataStore, idx: int) -> Dict[str, Any]:
+    """Return the column values of a random query."""
+    kql_properties = {
+        "tables": random.sample(_TABLES, random.randint(1, 3)),
+        "operators": random.sample(_OPERATORS, random.randint(1, 5)),
+        "fields": random.sample(_FIELDS, random.randint(0, 10)),
+        "functioncalls": random.sample(_FUNCTIONS, random.randint(0, 4)),
+        "joins": {"inner": ["Table1"]} if idx % 5 == 0 else {},
+        "valid_query": idx % 50 != 0,
+    }
+    return {
+        "query_id": str(idx),
+        "source_path": f"/queries/{idx}.yaml",
+        "query_name": f"query_{idx}",
+        "attributes": {
+            "description": "Benchmark query",
+            "tactics": random.sample(_TACTICS, random.randint(0, 2)),
+            "techniques": [f"T{1000 + idx % 300}"],
+        },
+        # pylint: disable=protected-access
+        **ds._split_kql_properties(kql_properties),
+    }
+
+
+def _create_store(size: int) -> DataStore:
+    """Return a store with `size` random queries (and no indexes)."""
+    ds = DataStore()
+    # pylint: disable=protected-access
+    ds._columns.append([_get_record(ds, idx) for idx in range(size)])
+    return ds
+
+
+def _build_row_wise(ds: DataStore):
+    """Build the indexes from the index values of each row (previous method)."""
+    # pylint: disable=protected-access
+    index_values: Dict[str, List[Any]] = {}
+    index_rows: Dict[str, List[int]] = {}
+    for row_id in range(len(ds)):
+        for key, values in ds._get_indexed_attribs(row_id).items():
+            index_values.setdefault(key, []).extend(values)
+            index_rows.setdefault(key, []).extend([row_id] * len(values))
+    ds._indexes = {}
+    for key, values in index_values.items():
+        grouped: Dict[Any, List[int]] = {}
+        for value, row_id in zip(values, index_rows[key]):
+            grouped.setdefault(value, []).append(row_id)
+        ds._indexes[key] = InvertedIndex(
+            {value: sorted(set(rows)) for value, rows in grouped.items()}
+        )
+
+
+def _build_bulk(ds: DataStore):
+    """Build the indexes with `_add_rows_to_indexes`."""
+    # pylint: disable=protected-access
+    ds._indexes = {}
+    ds._add_rows_to_indexes(range(len(ds)))
+
+
+def _time(builder: Callable[[DataStore], None], ds: DataStore, repeat: int) -> float:
+    """Return the best time of `repeat` runs of `builder`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        builder(ds)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main(args):
+    """Print the index build times for each store size."""
+    print(f"{'queries':>10} {'row-wise (s)':>14} {'bulk (s)':>10} {'speedup':>8}")
+    for size in args.sizes:
+        ds = _create_store(size)
+        row_wise = _time(_build_row_wise, ds, args.repeat)
+        bulk = _time(_build_bulk, ds, args.repeat)
+        print(f"{size:>10} {row_wise:>14.3f} {bulk:>10.3f} {row_wise / bulk:>7.1f}x")
+
+
+# pylint: disable=invalid-name
+if __name__ == "__main__":
+
+    arg_parser = _add_script_args()
+    main(arg_parser.parse_args())
@@ -0,0 +1,485 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Inverted index of property values to row id posting lists and bitmaps."""
+import json
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+__author__ = "Ian Hellen"
+
+ROW_ID_TYPE = np.int64
+
+_EMPTY = np.empty(0, dtype=ROW_ID_TYPE)
+# number of set bits for each byte value
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.uint8)
+
+
+def _to_array(values: Iterable[Hashable]) -> np.ndarray:
+    """Return a 1-D object array of `values` (tuples are not expanded)."""
+    return np.fromiter(values, dtype=object)
+
+
+def intersect_postings(postings: Iterable[np.ndarray]) -> np.ndarray:
+    """
+    Return the intersection of sorted posting lists.
+
+    The lists are merged smallest first, so the cost is bounded by the
+    size of the shortest list and the intersection stops as soon as the
+    intermediate result is empty.
+
+    """
+    ordered = sorted(postings, key=len)
+    if not ordered:
+        return _EMPTY
+    result = ordered[0]
+    for posting in ordered[1:]:
+        if not len(result):
+            break
+        # find the insert positions of the (smaller) result list in
+        # the (larger) posting list - matching items are the intersection
+        pos = np.searchsorted(posting, result)
+        pos[pos == len(posting)] = 0
+        result = result[posting[pos] == result]
+    return result
+
+
+def union_postings(postings: Iterable[np.ndarray]) -> np.ndarray:
+    """Return the sorted union of posting lists."""
+    postings = [posting for posting in postings if len(posting)]
+    if not postings:
+        return _EMPTY
+    if len(postings) == 1:
+        return postings[0]
+    return np.unique(np.concatenate(postings))
+
+
+class Bitmap:
+    """
+    Packed bitset of row ids supporting AND/OR/NOT set algebra.
+
+    Parameters
+    ----------
+    bits : np.ndarray
+        Packed bits (uint8 array as produced by np.packbits)
+    size : int
+        The number of rows represented by the bitmap.
+
+    Notes
+    -----
+    Bitmaps support `&` (AND), `|` (OR), `-` (AND NOT) and `~` (NOT).
+    Both operands must have the same size.
+
+    """
+
+    __slots__ = ("bits", "size")
+
+    def __init__(self, bits: np.ndarray, size: int):
+        """Initialize the bitmap."""
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def empty(cls, size: int) -> "Bitmap":
+        """Return a bitmap with no rows set."""
+        return cls(np.zeros((size + 7) // 8, dtype=np.uint8), size)
+
+    @classmethod
+    def full(cls, size: int) -> "Bitmap":
+        """Return a bitmap with all rows set."""
+        return ~cls.empty(size)
+
+    @classmethod
+    def from_mask(cls, mask: np.ndarray) -> "Bitmap":
+        """Return a bitmap from a boolean mask."""
+        return cls(np.packbits(np.asarray(mask, dtype=bool)), len(mask))
+
+    @classmethod
+    def from_ids(cls, row_ids: np.ndarray, size: int) -> "Bitmap":
+        """Return a bitmap with `row_ids` set."""
+        mask = np.zeros(size, dtype=bool)
+        mask[row_ids] = True
+        return cls.from_mask(mask)
+
+    def to_mask(self) -> np.ndarray:
+        """Return the bitmap as a boolean mask."""
+        return np.unpackbits(self.bits, count=self.size).astype(bool)
+
+    def to_ids(self) -> np.ndarray:
+        """Return the sorted row ids set in the bitmap."""
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.size)).astype(
+            ROW_ID_TYPE
+        )
+
+    def count(self) -> int:
+        """Return the number of rows set."""
+        return int(_POPCOUNT[self.bits].sum(dtype=np.int64))
+
+    def __len__(self) -> int:
+        """Return the number of rows set."""
+        return self.count()
+
+    def __bool__(self) -> bool:
+        """Return True if any rows are set."""
+        return bool(self.bits.any())
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        """Return the intersection of two bitmaps."""
+        return Bitmap(self.bits & other.bits, self.size)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        """Return the union of two bitmaps."""
+        return Bitmap(self.bits | other.bits, self.size)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        """Return rows in this bitmap and not in `other`."""
+        return Bitmap(self.bits & ~other.bits, self.size)
+
+    def __invert__(self) -> "Bitmap":
+        """Return the complement of the bitmap."""
+        bits = ~self.bits
+        if self.size % 8:
+            # clear the padding bits in the last byte
+            bits[-1] &= np.uint8((0xFF << (8 - self.size % 8)) & 0xFF)
+        return Bitmap(bits, self.size)
+
+    def __eq__(self, other: object) -> bool:
+        """Return True if both bitmaps have the same rows set."""
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+        return self.size == other.size and np.array_equal(self.bits, other.bits)
+
+    __hash__ = None  # type: ignore
+
+
+class InvertedIndex:
+    """
+    Inverted index mapping a value to the sorted array of row ids.
+
+    Parameters
+    ----------
+    postings : Optional[Dict[Hashable, np.ndarray]], optional
+        Initial mapping of value to row ids.
+    buffer_size : int, optional
+        Number of buffered writes after which the write buffer is
+        merged into the main postings, by default 1000.
+
+    Notes
+    -----
+    Single row writes (`add` and `set_row`) go to a small write buffer
+    rather than re-allocating the main posting arrays. Reads consult
+    both the main postings and the buffer. The buffer is merged into
+    the main postings when it reaches `buffer_size` or when `merge`
+    is called.
+
+    """
+
+    def __init__(
+        self,
+        postings: Optional[Dict[Hashable, np.ndarray]] = None,
+        buffer_size: int = 1000,
+    ):
+        """Initialize the index."""
+        self._postings: Dict[Hashable, np.ndarray] = postings or {}
+        self._bitmaps: Dict[Hashable, Bitmap] = {}
+        self.buffer_size = buffer_size
+        # write buffer - added postings and rows superseding the main postings
+        self._delta: Dict[Hashable, Set[int]] = {}
+        self._delta_rows: Dict[int, List[Hashable]] = {}
+        self._deleted: Set[int] = set()
+        self._deleted_ids: Optional[np.ndarray] = None
+        self._buffered = 0
+        # concatenated postings used for value counts
+        self._flat: Optional[Tuple[List[Hashable], np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_pairs(
+        cls, values: Iterable[Hashable], row_ids: Iterable[int]
+    ) -> "InvertedIndex":
+        """
+        Create an index from parallel iterables (or arrays) of values and row ids.
+
+        Notes
+        -----
+        The values are hash-encoded and the (value, row id) pairs are
+        sorted and split into posting lists with array operations, so
+        there is no per-pair Python work apart from reading the values.
+
+        """
+        values = values if isinstance(values, np.ndarray) else _to_array(values)
+        row_ids = np.asarray(
+            row_ids if isinstance(row_ids, np.ndarray) else list(row_ids),
+            dtype=ROW_ID_TYPE,
+        )
+        if not len(values):
+            return cls()
+        codes, uniques = pd.factorize(values)
+        order = np.lexsort((row_ids, codes))
+        codes, row_ids = codes[order], row_ids[order]
+        # remove repeated (value, row id) pairs
+        keep = np.ones(len(codes), dtype=bool)
+        keep[1:] = (codes[1:] != codes[:-1]) | (row_ids[1:] != row_ids[:-1])
+        codes, row_ids = codes[keep], row_ids[keep]
+        # the codes are sorted, so each value's rows are a contiguous run
+        bounds = np.flatnonzero(codes[1:] != codes[:-1]) + 1
+        return cls(dict(zip(uniques.tolist(), np.split(row_ids, bounds))))
+
+    @classmethod
+    def from_buffers(cls, buffers: Dict[str, np.ndarray]) -> "InvertedIndex":
+        """
+        Create an index from `to_buffers` arrays.
+
+        The posting lists are views of the "postings" array, so a
+        memory-mapped array is not copied.
+
+        """
+        values = json.loads(buffers["values"].tobytes() or b"[]")
+        postings, offsets = buffers["postings"], buffers["offsets"]
+        index = cls(
+            {
+                value: postings[offsets[idx] : offsets[idx + 1]]
+                for idx, value in enumerate(values)
+            }
+        )
+        index._flat = (values, postings, offsets)
+        return index
+
+    def copy(self) -> "InvertedIndex":
+        """
+        Return a copy of the index.
+
+        The posting arrays are shared - they are replaced, never
+        changed in place, by writes to either index.
+
+        """
+        index = InvertedIndex(dict(self._postings), buffer_size=self.buffer_size)
+        index._bitmaps = dict(self._bitmaps)
+        index._delta = {value: set(rows) for value, rows in self._delta.items()}
+        index._delta_rows = {
+            row_id: list(values) for row_id, values in self._delta_rows.items()
+        }
+        index._deleted = set(self._deleted)
+        index._deleted_ids = self._deleted_ids
+        index._buffered = self._buffered
+        index._flat = self._flat
+        return index
+
+    def to_buffers(self) -> Dict[str, np.ndarray]:
+        """
+        Return the index as a dict of arrays.
+
+        Returns
+        -------
+        Dict[str, np.ndarray]
+            "values" - the JSON encoded (uint8) list of values,
+            "postings" - the concatenated posting lists and
+            "offsets" - the start of each value's postings (with a
+            trailing end offset).
+
+        """
+        self.merge()
+        offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(posting) for posting in self._postings.values()])
+        return {
+            "values": np.frombuffer(
+                json.dumps(list(self._postings)).encode("utf-8"), dtype=np.uint8
+            ),
+            "postings": np.concatenate([_EMPTY, *self._postings.values()]).astype(
+                ROW_ID_TYPE
+            ),
+            "offsets": offsets,
+        }
+
+    def __len__(self) -> int:
+        """Return the total number of (value, row id) entries."""
+        self.merge()
+        return sum(len(posting) for posting in self._postings.values())
+
+    def __contains__(self, value: Any) -> bool:
+        """Return True if `value` has any postings."""
+        return len(self.get(value)) > 0
+
+    def keys(self) -> List[Hashable]:
+        """Return the indexed values."""
+        if not self._buffered:
+            return list(self._postings)
+        values = list(self._postings) + [
+            value for value in self._delta if value not in self._postings
+        ]
+        return [value for value in values if len(self.get(value))]
+
+    def get(self, value: Hashable) -> np.ndarray:
+        """Return the posting list (sorted row ids) for `value`."""
+        posting = self._postings.get(value, _EMPTY)
+        if not self._buffered:
+            return posting
+        if self._deleted and len(posting):
+            posting = posting[
+                ~np.isin(posting, self._get_deleted_ids(), assume_unique=True)
+            ]
+        delta = self._delta.get(value)
+        if delta:
+            posting = union_postings(
+                [posting, np.array(sorted(delta), dtype=ROW_ID_TYPE)]
+            )
+        return posting
+
+    def add(self, value: Hashable, row_id: int):
+        """Add a single row id to the posting list of `value`."""
+        self._delta.setdefault(value, set()).add(row_id)
+        self._delta_rows.setdefault(row_id, []).append(value)
+        self._bitmaps.pop(value, None)
+        self._buffered += 1
+        self._check_buffer()
+
+    def set_row(self, row_id: int, values: Iterable[Hashable]):
+        """Replace the values indexed for `row_id` with `values`."""
+        # mask any postings for the row in the main index
+        if row_id not in self._deleted:
+            self._deleted.add(row_id)
+            self._deleted_ids = None
+            self._buffered += 1
+        # remove any previously buffered values for the row
+        for value in self._delta_rows.pop(row_id, []):
+            self._delta[value].discard(row_id)
+        self._bitmaps.clear()
+        for value in values:
+            self.add(value, row_id)
+        self._check_buffer()
+
+    def merge(self):
+        """Merge the write buffer into the main postings."""
+        if not self._buffered:
+            return
+        values = list(self._postings) + [
+            value for value in self._delta if value not in self._postings
+        ]
+        postings = {value: self.get(value) for value in values}
+        self._postings = {
+            value: posting for value, posting in postings.items() if len(posting)
+        }
+        self._delta.clear()
+        self._delta_rows.clear()
+        self._deleted.clear()
+        self._deleted_ids = None
+        self._buffered = 0
+        self._bitmaps.clear()
+        self._flat = None
+
+    def update(self, other: "InvertedIndex"):
+        """Merge the postings of `other` into this index."""
+        self.merge()
+        other.merge()
+        self._flat = None
+        for value, posting in other._postings.items():
+            current = self._postings.get(value)
+            if current is None or not len(current):
+                self._postings[value] = posting
+            elif current[-1] < posting[0]:
+                # new rows are usually appended after the existing ones
+                self._postings[value] = np.concatenate([current, posting])
+            else:
+                self._postings[value] = union_postings([current, posting])
+            self._bitmaps.pop(value, None)
+
+    def remove_rows(self, row_ids: np.ndarray):
+        """Remove `row_ids` from all posting lists."""
+        self.merge()
+        row_ids = np.unique(np.asarray(row_ids, dtype=ROW_ID_TYPE))
+        if not len(row_ids):
+            return
+        self._flat = None
+        for value, posting in list(self._postings.items()):
+            keep = ~np.isin(posting, row_ids, assume_unique=True)
+            if keep.all():
+                continue
+            if keep.any():
+                self._postings[value] = posting[keep]
+            else:
+                del self._postings[value]
+            self._bitmaps.pop(value, None)
+
+    def bitmap(self, value: Hashable, size: int) -> Bitmap:
+        """Return the (cached) bitmap of rows for `value`."""
+        bitmap = self._bitmaps.get(value)
+        if bitmap is None or bitmap.size != size:
+            bitmap = Bitmap.from_ids(self.get(value), size)
+            self._bitmaps[value] = bitmap
+        return bitmap
+
+    def match_all(self, values: Iterable[Hashable], size: int) -> Bitmap:
+        """Return a bitmap of rows that have ALL of `values`."""
+        result = Bitmap.full(size)
+        for value in values:
+            result &= self.bitmap(value, size)
+            if not result:
+                break
+        return result
+
+    def match_any(self, values: Iterable[Hashable], size: int) -> Bitmap:
+        """Return a bitmap of rows that have ANY of `values`."""
+        result = Bitmap.empty(size)
+        for value in values:
+            result |= self.bitmap(value, size)
+        return result
+
+    def value_counts(self, mask: Optional[np.ndarray] = None) -> Dict[Hashable, int]:
+        """
+        Return the number of rows for each value.
+
+        Parameters
+        ----------
+        mask : Optional[np.ndarray], optional
+            Boolean mask of the rows to count, by default all rows.
+
+        Returns
+        -------
+        Dict[Hashable, int]
+            Mapping of value to row count, values with no rows in
+            the mask are omitted.
+
+        """
+        self.merge()
+        if self._flat is None:
+            offsets = np.zeros(len(self._postings) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(
+                [len(posting) for posting in self._postings.values()]
+            )
+            self._flat = (
+                list(self._postings),
+                np.concatenate([_EMPTY, *self._postings.values()]),
+                offsets,
+            )
+        values, flat, offsets = self._flat
+        if mask is None:
+            counts = np.diff(offsets)
+        else:
+            # cumulative count of masked rows - the difference between the
+            # offsets of each value is the number of its rows in the mask
+            hits = np.zeros(len(flat) + 1, dtype=np.int64)
+            np.cumsum(mask[flat], out=hits[1:])
+            counts = hits[offsets[1:]] - hits[offsets[:-1]]
+        return {value: int(count) for value, count in zip(values, counts) if count}
+
+    def intersect(self, values: Iterable[Hashable]) -> np.ndarray:
+        """Return row ids that have ALL of `values`."""
+        return intersect_postings(self.get(value) for value in values)
+
+    def union(self, values: Iterable[Hashable]) -> np.ndarray:
+        """Return row ids that have ANY of `values`."""
+        return union_postings(self.get(value) for value in values)
+
+    def _get_deleted_ids(self) -> np.ndarray:
+        """Return the sorted array of rows masked in the main postings."""
+        if self._deleted_ids is None:
+            self._deleted_ids = np.array(sorted(self._deleted), dtype=ROW_ID_TYPE)
+        return self._deleted_ids
+
+    def _check_buffer(self):
+        """Merge the write buffer if it has reached `buffer_size`."""
+        if self._buffered >= self.buffer_size:
+            self.merge()
@@ -0,0 +1,143 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Streaming reader and writer for JSON array and NDJSON query files."""
+import gzip
+import io
+import json
+from pathlib import Path
+from typing import IO, Any, Dict, Iterable, Iterator, Union
+
+__author__ = "Ian Hellen"
+
+_CHUNK_SIZE = 1 << 16
+_GZIP_MAGIC = b"\x1f\x8b"
+_WHITESPACE = " \t\r\n"
+
+PathOrFile = Union[str, Path, IO[str]]
+
+
+def open_json_file(file_path: Union[str, Path], mode: str = "r") -> IO[str]:
+    """
+    Open a JSON file in text mode, using gzip for ".gz" files.
+
+    When reading, gzip compressed files are also detected from the
+    file content.
+
+    """
+    if "r" in mode:
+        with open(file_path, "rb") as in_file:
+            is_gzip = in_file.read(2) == _GZIP_MAGIC
+    else:
+        is_gzip = str(file_path).endswith(".gz")
+    if is_gzip:
+        return gzip.open(file_path, f"{mode[0]}t", encoding="utf-8")  # type: ignore
+    return open(file_path, mode[0], encoding="utf-8")
+
+
+def read_json_records(source: PathOrFile) -> Iterator[Dict[str, Any]]:
+    """
+    Yield records one at a time from a JSON array or NDJSON file.
+
+    Parameters
+    ----------
+    source : PathOrFile
+        Path to the file or a file opened in text mode. The file may
+        contain a JSON array of records or one record per line (NDJSON)
+        and may be gzip compressed.
+
+    Yields
+    ------
+    Dict[str, Any]
+        The records in the file.
+
+    Notes
+    -----
+    The file is read in chunks and each record is decoded as soon as
+    it is complete, so only the current record (and chunk) is held
+    in memory.
+
+    """
+    if isinstance(source, (str, Path)):
+        with open_json_file(source) as in_file:
+            yield from read_json_records(in_file)
+        return
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    in_array = None
+    end_of_file = False
+    while True:
+        # skip whitespace (and array commas) to the next value
+        while pos < len(buffer) and (
+            buffer[pos] in _WHITESPACE or (in_array and buffer[pos] == ",")
+        ):
+            pos += 1
+        if pos == len(buffer):
+            if end_of_file:
+                break
+            buffer, pos = source.read(_CHUNK_SIZE), 0
+            end_of_file = not buffer
+            continue
+        if in_array is None:
+            in_array = buffer[pos] == "["
+            pos += int(in_array)
+            continue
+        if in_array and buffer[pos] == "]":
+            break
+        try:
+            record, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if end_of_file:
+                raise
+            # the record continues in the next chunk
+            chunk = source.read(_CHUNK_SIZE)
+            end_of_file = not chunk
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        yield record
+        pos = end
+
+
+def write_json_records(
+    records: Iterable[Dict[str, Any]], target: PathOrFile, ndjson: bool = False
+):
+    """
+    Write records to a file one at a time.
+
+    Parameters
+    ----------
+    records : Iterable[Dict[str, Any]]
+        The records to write.
+    target : PathOrFile
+        Path to the file or a file opened in text mode. Paths ending
+        in ".gz" are written with gzip compression.
+    ndjson : bool, optional
+        If True, write one record per line (NDJSON), otherwise write
+        a JSON array. The default is False.
+
+    """
+    if isinstance(target, (str, Path)):
+        with open_json_file(target, "w") as out_file:
+            write_json_records(records, out_file, ndjson=ndjson)
+        return
+    if ndjson:
+        for record in records:
+            target.write(json.dumps(record))
+            target.write("\n")
+        return
+    target.write("[")
+    for idx, record in enumerate(records):
+        if idx:
+            target.write(", ")
+        target.write(json.dumps(record))
+    target.write("]")
+
+
+def dump_json_records(records: Iterable[Dict[str, Any]], ndjson: bool = False) -> str:
+    """Return records as a JSON array (or NDJSON) string."""
+    out_text = io.StringIO()
+    write_json_records(records, out_text, ndjson=ndjson)
+    return out_text.getvalue()
@@ -4,16 +4,22 @@
 # license information.
 # --------------------------------------------------------------------------
 """Kql extract threading interface with .Net Kqlextract."""
+import abc
 import contextlib
+import itertools
 import json
 import logging
+import os
 import queue
 import subprocess
 import threading
-import time
 from base64 import b64encode
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import as_completed
+from functools import partial
 from pathlib import Path
-from typing import Optional
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
 from uuid import uuid4
 
 __author__ = "Liam Kirton"
@@ -22,11 +28,6 @@ __author__ = "Liam Kirton"
 base_path = Path(__file__).parent
 CS_PROJ_PATH = base_path.joinpath("../kqlextraction/KqlExtraction/KqlExtraction.csproj")
 
-worker_exit = threading.Event()
-worker_queue = queue.Queue()  # type: ignore
-worker_results = queue.Queue()  # type: ignore
-worker_thread = None
-
 # pylint: disable=broad-except
 
 _EXTRACT_ARGS = [
@@ -38,98 +39,520 @@ _EXTRACT_ARGS = [
     str(CS_PROJ_PATH),
 ]
 _SYNTAX_ERROR = "[!]"
+# the pool builds the project once and runs the build output in each worker
+_BUILD_ARGS = ["dotnet", "build", "-c", "Release", str(CS_PROJ_PATH)]
+_POOL_EXTRACT_ARGS = [*_EXTRACT_ARGS, "--no-build"]
+
+# client used by the module-level start, stop and extract_kql functions
+_client: Optional["KqlExtractionClient"] = None
+
 
+def extract_kql(kql_query: str, query_id: Optional[str] = None, timeout: float = 5.0):
+    """
+    Extract kql_properties from Kql query.
 
-def _worker_thread_proc():
+    An empty dict is returned if the extraction fails or the result
+    is not returned within `timeout` seconds.
+
+    """
+    kql_result: Dict[str, Any] = {}
     try:
-        kql_extraction = None
-
-        while not worker_exit.is_set():
-            try:
-                if kql_extraction is not None and kql_extraction.poll() is not None:
-                    kql_extraction = None
-                if kql_extraction is None:
-                    kql_extraction = subprocess.Popen(
-                        _EXTRACT_ARGS,
-                        stdin=subprocess.PIPE,
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.PIPE,
-                    )
-            except Exception as subp_ex:
-                logging.exception(
-                    "[!] Exception Starting KqlExtraction Process.", exc_info=subp_ex
-                )
-                break
+        kql_result = _client.extract_kql(kql_query, query_id, timeout)  # type: ignore
+    except FutureTimeoutError:
+        logging.warning("[!] Timed out extracting query '%s'.", query_id)
+    except Exception:
+        logging.debug("[!] Failed to extract query '%s'.", query_id, exc_info=True)
+    return kql_result
 
-            try:
-                uuid, kql = worker_queue.get(timeout=2.0)
-                kql_extraction.stdin.write(
-                    bytes(f"{uuid},", encoding="utf-8")
-                    + b64encode(bytes(kql, encoding="utf-8"))
-                    + b"\n"
-                )
-                kql_extraction.stdin.flush()
-
-                kql_extraction_result = kql_extraction.stdout.readline()
-                if (
-                    str(kql_extraction_result, encoding="utf-8")
-                    .strip()
-                    .startswith(_SYNTAX_ERROR)
-                ):
-                    worker_results.put(_syntax_err_result(uuid))
-                else:
-                    worker_results.put(json.loads(kql_extraction_result))
-                    # try:
-                    #     worker_results.put(json.loads(kql_extraction_result))
-                    # except json.JSONDecodeError:
-                    #     worker_results.put(_syntax_err_result(uuid))
-            except queue.Empty:
-                pass
-            except Exception as thread_ex:
-                logging.exception(
-                    "[!] Unhandled Exception in 'while not worker_exit.is_set', query_id='%s', \ninput sample: %s",
-                    uuid,
-                    kql_extraction_result[:200],
-                    exc_info=thread_ex,
-                )
-                kql_extraction.kill()
-
-        if kql_extraction is not None and kql_extraction.poll() is None:
-            kql_extraction.kill()
-    except Exception as thread_out_ex:
-        logging.exception(
-            "[!] Unhandled Exception at 'while not worker_exit.is_set()'",
-            exc_info=thread_out_ex,
+
+def start():
+    """Start the extractor process."""
+    global _client  # pylint: disable=invalid-name, global-statement
+    _client = KqlExtractionClient()
+    _client.start()
+    logging.info("Started kql extractor.")
+
+
+def stop():
+    """Stop the extractor process."""
+    if _client is not None:
+        _client.stop()
+    logging.info("Kql extractor stopped.")
+
+
+class _Request(NamedTuple):
+    """A query sent to an extractor process."""
+
+    query_id: str
+    kql_query: str
+    future: Future
+
+
+class _Extractor(abc.ABC):
+    """Extraction methods of clients that implement `submit`."""
+
+    @abc.abstractmethod
+    def submit(self, kql_query: str, query_id: Optional[str] = None) -> Future:
+        """Queue a query for extraction and return a future of its result."""
+
+    def extract_kql(
+        self,
+        kql_query: str,
+        query_id: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Return the kql_properties of a query.
+
+        Parameters
+        ----------
+        kql_query : str
+            The query text.
+        query_id : Optional[str], optional
+            The query identifier, by default a new UUID.
+        timeout : Optional[float], optional
+            The number of seconds to wait for the result, by default
+            no limit.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The extraction result.
+
+        """
+        return self.submit(kql_query, query_id).result(timeout)
+
+    def extract_all(
+        self, queries: Iterable[Tuple[str, str]]
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Extract the kql_properties of queries.
+
+        Parameters
+        ----------
+        queries : Iterable[Tuple[str, str]]
+            The (query_id, query text) of each query.
+
+        Yields
+        ------
+        Tuple[str, Dict[str, Any]]
+            The query_id and extraction result of each query, in the
+            order of `queries`. Queries that fail to extract are
+            logged and are skipped.
+
+        """
+        futures = [(query_id, self.submit(kql, query_id)) for query_id, kql in queries]
+        for query_id, future in futures:
+            result = _get_result(query_id, future)
+            if result is not None:
+                yield query_id, result
+
+    def extract_many(
+        self, queries: Iterable[Tuple[str, str]]
+    ) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Extract the kql_properties of queries, in completion order.
+
+        Parameters are the same as `extract_all`. All of the queries
+        are submitted before the first result is returned and results
+        are returned as soon as they are extracted.
+
+        """
+        futures = {self.submit(kql, query_id): query_id for query_id, kql in queries}
+        for future in as_completed(futures):
+            result = _get_result(futures[future], future)
+            if result is not None:
+                yield futures[future], result
+
+
+class KqlExtractionClient(_Extractor):
+    """
+    Client of a KqlExtraction process with many requests in flight.
+
+    Parameters
+    ----------
+    command : Optional[List[str]], optional
+        The extractor command line, by default `dotnet run` of the
+        KqlExtraction project.
+
+    Notes
+    -----
+    `submit` writes the query to the process and returns a future
+    of the result without waiting for earlier results, so the
+    process always has queued input. A reader thread sets the result
+    of each request's future as the process writes it. If the process
+    exits, the request it was extracting fails with an EOFError and
+    the other pending requests are sent to a new process. If
+    `_MAX_FAILED_STARTS` processes in a row exit without writing any
+    output (e.g. the extractor cannot be built), the pending requests
+    fail with an EOFError instead of being resent.
+
+    Examples
+    --------
+    >>>> client = KqlExtractionClient()
+    >>>> client.start()
+    >>>> future = client.submit("SecurityAlert | take 1", query_id="q1")
+    >>>> for query_id, kql_properties in client.extract_many(queries):
+    ....     store.add_kql_properties(query_id, kql_properties)
+    >>>> client.stop()
+
+    """
+
+    _MAX_FAILED_STARTS = 3
+
+    def __init__(self, command: Optional[List[str]] = None):
+        """Initialize the client."""
+        self._command = command or _EXTRACT_ARGS
+        self._process: Optional[_ExtractionProcess] = None
+        self._request_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._started = False
+        # processes in a row that exited without writing any output
+        self._failed_starts = 0
+
+    def __enter__(self) -> "KqlExtractionClient":
+        """Start the client as a context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the client."""
+        self.stop()
+
+    @property
+    def in_flight(self) -> int:
+        """Return the number of requests waiting for a result."""
+        process = self._process
+        return len(process.pending) if process is not None else 0
+
+    def start(self):
+        """Start the extractor process."""
+        with self._lock:
+            self._started = True
+            self._get_process()
+
+    def stop(self):
+        """Stop the extractor process (after the pending requests complete)."""
+        with self._lock:
+            process, self._process = self._process, None
+            self._started = False
+        if process is not None:
+            process.close()
+
+    def submit(self, kql_query: str, query_id: Optional[str] = None) -> Future:
+        """
+        Send a query to the extractor and return a future of its result.
+
+        Parameters
+        ----------
+        kql_query : str
+            The query text.
+        query_id : Optional[str], optional
+            The query identifier (the "Id" of the result), by default
+            a new UUID.
+
+        Returns
+        -------
+        Future
+            The future extraction result.
+
+        """
+        if not self._started:
+            raise RuntimeError("The extraction client has not been started.")
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+        self._send(_Request(query_id or str(uuid4()), kql_query, future))
+        return future
+
+    def _send(self, request: "_Request"):
+        """Send a request to the current process, starting one if needed."""
+        try:
+            with self._lock:
+                if not self._started:
+                    raise EOFError("The extraction client was stopped.")
+                process = self._get_process()
+            process.send(str(next(self._request_ids)), request)
+        except Exception as err:
+            request.future.set_exception(err)
+
+    def _get_process(self) -> "_ExtractionProcess":
+        """Return the extractor process (the caller holds the lock)."""
+        if self._process is None or self._process.closed:
+            self._process = _ExtractionProcess(self._command, self._resend)
+        return self._process
+
+    def _resend(self, requests: List["_Request"], had_output: bool):
+        """Send the requests pending when a process exited to a new process."""
+        with self._lock:
+            self._failed_starts = 0 if had_output else self._failed_starts + 1
+            failed_starts = self._failed_starts
+        if failed_starts >= self._MAX_FAILED_STARTS:
+            error = EOFError(
+                f"KqlExtraction process exited {failed_starts} times without output."
+            )
+            for request in requests:
+                request.future.set_exception(error)
+            return
+        for request in requests:
+            self._send(request)
+
+
+class _ExtractionProcess:
+    """A KqlExtraction process and its pending requests."""
+
+    def __init__(self, command: List[str], on_exit):
+        """Start the process and its result reader thread."""
+        self.popen = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
         )
+        # requests by request id, in the order they were sent
+        self.pending: Dict[str, _Request] = {}
+        self.closed = False
+        self.had_output = False
+        self._on_exit = on_exit
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_results, daemon=True)
+        self._reader.start()
+
+    def send(self, request_id: str, request: _Request):
+        """Write a request to the process."""
+        with self._lock:
+            if self.closed:
+                raise EOFError("KqlExtraction process exited.")
+            self.pending[request_id] = request
+        line = (
+            bytes(f"{request_id},", encoding="utf-8")
+            + b64encode(bytes(request.kql_query, encoding="utf-8"))
+            + b"\n"
+        )
+        try:
+            # the reader does not take the write lock, so the process
+            # output is read while a write is blocked on a full pipe
+            with self._write_lock:
+                self.popen.stdin.write(line)  # type: ignore
+                self.popen.stdin.flush()  # type: ignore
+        except (OSError, ValueError):
+            # the process has exited - the reader resends the request
+            pass
+
+    def close(self):
+        """Close the process input and wait for the pending results."""
+        with self._write_lock, contextlib.suppress(OSError):
+            self.popen.stdin.close()  # type: ignore
+        self._reader.join()
+        self.popen.wait()
+
+    def _read_results(self):
+        """Set the result of each request as it is written by the process."""
+        for line in self.popen.stdout:  # type: ignore
+            self.had_output = True
+            result = str(line, encoding="utf-8").strip()
+            request_id, kql_result, error = None, None, None
+            if result.startswith("{"):
+                try:
+                    kql_result = json.loads(result)
+                    request_id = kql_result.get("Id")
+                except ValueError as err:
+                    error = err
+            elif not result.startswith(_SYNTAX_ERROR):
+                # the diagnostic lines following a syntax error
+                continue
+            with self._lock:
+                # error results have no Id - results are written in the
+                # order the requests were sent
+                if request_id not in self.pending:
+                    request_id = next(iter(self.pending), None)
+                request = self.pending.pop(request_id, None)  # type: ignore
+            if request is None:
+                continue
+            if error is not None:
+                request.future.set_exception(error)
+                continue
+            if kql_result is None:
+                kql_result = _syntax_err_result(request.query_id)
+            kql_result["Id"] = request.query_id
+            request.future.set_result(kql_result)
+        self.popen.wait()
+        with self._lock:
+            self.closed = True
+            requests = list(self.pending.values())
+            self.pending = {}
+        if requests:
+            # the first pending request was being extracted when the
+            # process exited, the others are resent to a new process
+            requests[0].future.set_exception(
+                EOFError(f"KqlExtraction process exited ({self.popen.returncode}).")
+            )
+            self._on_exit(requests[1:], self.had_output)
 
 
-def extract_kql(kql_query: str, query_id: Optional[str] = None):
-    """Extract kql_properties from Kql query."""
-    kql_id = query_id or str(uuid4())
-    worker_queue.put((kql_id, kql_query))
+class ExtractorPool(_Extractor):
+    """
+    Pool of KqlExtraction processes that extract queries in parallel.
 
-    with contextlib.suppress(Exception):
-        kql_result = {}
+    Parameters
+    ----------
+    n_workers : Optional[int], optional
+        The maximum number of extractor processes, by default the
+        number of CPUs.
+    command : Optional[List[str]], optional
+        The extractor command line. By default, the KqlExtraction
+        project is built when the pool is started and each worker
+        runs the build output.
+    max_in_flight : int, optional
+        The maximum number of queries sent to each process before
+        their results are returned, by default 8
+
+    Notes
+    -----
+    Each worker is a thread that sends queries to its own extractor
+    process with a `KqlExtractionClient`. Queries are queued on a
+    single queue shared by the workers, so a worker takes the next
+    query as soon as one of its queries has been extracted - slow
+    queries do not hold up the queries behind them. Workers (and their
+    processes) are started as queries are queued, when there are more
+    queued queries than idle workers, up to `n_workers`.
+
+    Examples
+    --------
+    >>>> with ExtractorPool() as pool:
+    ....     for query_id, kql_properties in pool.extract_many(
+    ....         (query.query_id, query.query) for query in queries
+    ....     ):
+    ....         store.add_kql_properties(query_id, kql_properties)
+
+    """
+
+    def __init__(
+        self,
+        n_workers: Optional[int] = None,
+        command: Optional[List[str]] = None,
+        max_in_flight: int = 8,
+    ):
+        """Initialize the pool."""
+        self.n_workers = max(n_workers or os.cpu_count() or 1, 1)
+        self.max_in_flight = max(max_in_flight, 1)
+        self._command = command
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._workers: List[threading.Thread] = []
+        self._idle = 0
+        self._lock = threading.Lock()
+        self._started = False
+
+    def __enter__(self) -> "ExtractorPool":
+        """Start the pool as a context manager."""
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        """Stop the pool."""
+        self.stop()
+
+    @property
+    def active_workers(self) -> int:
+        """Return the number of started workers."""
+        return len(self._workers)
+
+    def start(self):
+        """Start the pool, building the KqlExtraction project if needed."""
+        if self._started:
+            return
+        if self._command is None:
+            logging.info("Building KqlExtraction.")
+            subprocess.run(_BUILD_ARGS, check=True, capture_output=True)
+            self._command = _POOL_EXTRACT_ARGS
+        self._started = True
+        logging.info("Started kql extractor pool (%d workers).", self.n_workers)
+
+    def stop(self):
+        """Stop the workers (after the queued queries are extracted)."""
+        with self._lock:
+            workers, self._workers = self._workers, []
+            self._started = False
+        for _ in workers:
+            self._queue.put(None)
+        for worker in workers:
+            worker.join()
+        logging.info("Kql extractor pool stopped.")
+
+    def submit(self, kql_query: str, query_id: Optional[str] = None) -> Future:
+        """
+        Queue a query for extraction and return a future of its result.
+
+        Parameters
+        ----------
+        kql_query : str
+            The query text.
+        query_id : Optional[str], optional
+            The query identifier (the "Id" of the result), by default
+            a new UUID.
+
+        Returns
+        -------
+        Future
+            The future extraction result.
+
+        """
+        if not self._started:
+            raise RuntimeError("The extractor pool has not been started.")
+        future: Future = Future()
+        self._queue.put(_Request(query_id or str(uuid4()), kql_query, future))
+        with self._lock:
+            if self._queue.qsize() > self._idle and len(self._workers) < self.n_workers:
+                worker = threading.Thread(target=self._worker_proc, daemon=True)
+                self._workers.append(worker)
+                self._idle += 1
+                worker.start()
+        return future
+
+    def _worker_proc(self):
+        """Extract queued queries until the stop sentinel is received."""
+        client = KqlExtractionClient(self._command)
+        try:
+            client.start()
+        except Exception as err:
+            # the queries sent to the client fail with the same error
+            logging.exception("[!] Failed to start KqlExtraction.", exc_info=err)
+        # a slot is released as each of the worker's queries is extracted
+        slots = threading.Semaphore(self.max_in_flight - 1)
         while True:
-            kql_result = worker_results.get(timeout=5.0)
-            if "Id" in kql_result and kql_result["Id"] == kql_id:
+            request = self._queue.get()
+            with self._lock:
+                self._idle -= 1
+            if request is None:
                 break
-    return kql_result
+            if request.future.set_running_or_notify_cancel():
+                client.submit(request.kql_query, request.query_id).add_done_callback(
+                    partial(_copy_result, request.future, slots)
+                )
+            else:
+                slots.release()
+            slots.acquire()
+            with self._lock:
+                self._idle += 1
+        client.stop()
 
 
-def start():
-    """Start extractor worker thread."""
-    global worker_thread  # pylint: disable=invalid-name, global-use
-    worker_thread = threading.Thread(target=_worker_thread_proc)
-    worker_thread.start()
-    logging.info("Started kql extractor thread.")
+def _copy_result(target: Future, slots: threading.Semaphore, source: Future):
+    """Set the result of `target` from `source` and release a worker slot."""
+    slots.release()
+    if source.exception() is not None:
+        target.set_exception(source.exception())  # type: ignore
+    else:
+        target.set_result(source.result())
 
 
-def stop():
-    """Stop worker thread."""
-    worker_exit.set()
-    worker_thread.join()
-    logging.info("Kql extractor thread stopped.")
+def _get_result(query_id: str, future: Future) -> Optional[Dict[str, Any]]:
+    """Return the result of an extraction, logging any exception."""
+    try:
+        return future.result()
+    except Exception as err:
+        logging.exception("[!] Failed to extract query '%s'.", query_id, exc_info=err)
+    return None
 
 
 def _syntax_err_result(query_id):
@@ -144,8 +567,7 @@ def _syntax_err_result(query_id):
 
 
 if __name__ == "__main__":
-    worker_thread = threading.Thread(target=_worker_thread_proc)
-    worker_thread.start()
+    start()
 
     test_path = base_path.joinpath("test_data")
     print("using", test_path)
@@ -162,13 +584,9 @@ if __name__ == "__main__":
             with open(kql_file, "r", encoding="utf-8") as f:
                 kql_text = f.read()
 
-            print(f"[{file_no}]", extract_kql(kql_text, query_id=file_no))
+            print(f"[{file_no}]", extract_kql(kql_text, query_id=str(file_no)))
 
     except Exception as ex:
         print("[!] Unhandled Exception", ex)
 
-    while not worker_queue.empty():
-        time.sleep(0.5)
-
-    worker_exit.set()
-    worker_thread.join()
+    stop()
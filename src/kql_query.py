@@ -8,23 +8,80 @@ import hashlib
 import json
 import re
 import uuid
-from dataclasses import asdict, dataclass, field, fields
-from typing import Any, Dict, List, Literal, Optional
+from dataclasses import MISSING, asdict, dataclass, field, fields
+from typing import Any, Dict, Iterable, List, Literal, Optional
 
 import pandas as pd
 
+from .text_index import normalize_kql
+
 __author__ = "Ian Hellen"
 
 
 _SOURCE_TYPES = ["text", "markdown", "sentinel_yaml", "api", "other"]
 SourceType = Literal["text", "markdown", "sentinel_yaml", "api", "other"]
 _REPO_NAME = re.compile(r"https://github\.com/(?P<name>[^/]+/[^/]+)/.*", re.IGNORECASE)
+# fields set from other fields if they are not supplied
+_DERIVED_FIELDS = ("query_name", "query_hash", "repo_name", "query_id")
+
+
+def get_query_id(
+    source_path: Optional[str], source_index: Optional[int] = 0, occurrence: int = 0
+) -> str:
+    """
+    Return the query_id of the query at `source_index` of `source_path`.
+
+    The id is a name-based (version 5) UUID of the source path and
+    index, so a query has the same id in each build of the store.
+    Changes to the query text are tracked by its query_hash.
+    `occurrence` distinguishes queries with the same source path and
+    index (see `KqlQuery.set_unique_query_ids`).
+
+    """
+    name = f"{source_path}#{source_index}"
+    if occurrence:
+        name = f"{name}#{occurrence}"
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, name))
 
 
-def _uuid_str():
-    return str(uuid.uuid4())
+def _get_query_hash(query: str) -> str:
+    """Return the SHA256 hash of the query text."""
+    return hashlib.sha256(
+        bytes(query, encoding="utf-8"),
+        # usedforsecurity=False
+    ).hexdigest()
+
+
+def get_canonical_hash(query: Optional[str]) -> Optional[str]:
+    """
+    Return the SHA256 hash of the canonical form of the query text.
+
+    Queries that differ only in whitespace, comments and the case
+    of tabular operator names have the same hash (see `normalize_kql`).
+
+    """
+    return _get_query_hash(normalize_kql(query)) if query else None
 
 
+def _with_slots(cls: type) -> type:
+    """
+    Return dataclass `cls` re-created with its fields stored in `__slots__`.
+
+    The equivalent of `dataclass(slots=True)`, which requires Python 3.10.
+    Instances have no `__dict__`, so they use less memory. Methods of
+    `cls` must not use zero-argument `super()`.
+
+    """
+    cls_dict = dict(cls.__dict__)
+    field_names = tuple(fld.name for fld in fields(cls))
+    for name in (*field_names, "__dict__", "__weakref__"):
+        # the field defaults are held by the dataclass fields and __init__
+        cls_dict.pop(name, None)
+    cls_dict["__slots__"] = field_names
+    return type(cls)(cls.__name__, cls.__bases__, cls_dict)
+
+
+@_with_slots
 @dataclass
 class KqlQuery:
     """
@@ -51,11 +108,17 @@ class KqlQuery:
     kql_properties: Dict[str, Any], optional
         Dictionary of properties derived from the KQL query
     query_id: Optional[str], optional
-        UUID used to identify the query
+        UUID used to identify the query. If None this will be derived
+        from source_path and source_index (see `get_query_id`)
     query_hash: int, optional
         Hash of the query text
     query_version: int, optional
         Query version, not currently used. Default is 0
+    canonical_hash: Optional[str], optional
+        Hash of the canonical (normalized) query text - see
+        `get_canonical_hash`. This is set in bulk by
+        `set_canonical_hashes` (called when queries are added to
+        a DataStore) and is reset to None if the query is changed.
 
     Examples
     --------
@@ -92,6 +155,9 @@ class KqlQuery:
     '[{"source_path": "https://github.com/a/b/file.kql", "query": "SecurityAlert... "query_version": 0}]'
 
     Class method to convert list of KqlQuery instances to a DataFrame
+
+    Create a KqlQuery from a stored record without re-hashing the query
+    >>>> kql = KqlQuery.from_record(record)
     """
 
     source_path: str
@@ -103,23 +169,81 @@ class KqlQuery:
     context: Optional[str] = None
     attributes: Dict[str, Any] = field(default_factory=dict)
     kql_properties: Dict[str, Any] = field(default_factory=dict)
-    query_id: str = field(default_factory=_uuid_str)
+    query_id: Optional[str] = None
     query_hash: int = 0
     query_version: int = 0
+    canonical_hash: Optional[str] = None
 
     def __post_init__(self):
         """Run post"""
-        if self.query_name is None and self.source_path is not None:
-            self.query_name = self.source_path.rsplit("/", maxsplit=1)[-1]
-        if self.query:
-            self.query_hash = hashlib.sha256(
-                bytes(self.query, encoding="utf-8"),
-                # usedforsecurity=False
-            ).hexdigest()
-        if self.repo_name is None and self.source_path is not None:
-            match = _REPO_NAME.match(self.source_path)
-            if match:
-                self.repo_name = match["name"]
+        self._set_derived_fields(_DERIVED_FIELDS)
+
+    def __setattr__(self, name: str, value: Any):
+        """Set an attribute, updating query_hash if the query is changed."""
+        object.__setattr__(self, name, value)
+        # query_hash is not set until __init__ has assigned the query
+        if name == "query" and hasattr(self, "query_hash"):
+            object.__setattr__(
+                self, "query_hash", _get_query_hash(value) if value else 0
+            )
+            object.__setattr__(self, "canonical_hash", None)
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "KqlQuery":
+        """
+        Return a KqlQuery from a trusted record - e.g. one read from a store.
+
+        Parameters
+        ----------
+        record : Dict[str, Any]
+            Dictionary of KqlQuery fields, such as one returned by
+            `to_record`.
+
+        Returns
+        -------
+        KqlQuery
+            The query.
+
+        Notes
+        -----
+        Unlike `KqlQuery(**record)`, the derived fields (query_name,
+        query_hash and repo_name) in `record` are used as they are, so
+        the query text is not hashed again. Derived fields that are not
+        in `record` are set as they are by `__init__`. The record values
+        are not copied.
+
+        """
+        kql_query = cls.__new__(cls)
+        found = 0
+        for name, default, default_factory, set_value in _FIELD_SETTERS:
+            if name in record:
+                value = record[name]
+                found += 1
+            elif default_factory is not MISSING:
+                value = default_factory()
+            elif default is not MISSING:
+                value = default
+            else:
+                raise TypeError(f"Missing KqlQuery field {name}.")
+            set_value(kql_query, value)
+        if found < len(record):
+            unknown = sorted(record.keys() - set(cls.field_names()))
+            raise TypeError(f"Unknown KqlQuery field(s) {', '.join(unknown)}.")
+        missing = [name for name in _DERIVED_FIELDS if name not in record]
+        if missing:
+            kql_query._set_derived_fields(missing)
+        return kql_query
+
+    def to_record(self) -> Dict[str, Any]:
+        """
+        Return a dictionary of attributes without copying the values.
+
+        Unlike `asdict`, the attributes and kql_properties values are the
+        query's own dictionaries, so the record is cheap to create and
+        serialize. Copy them before changing them.
+
+        """
+        return {name: getattr(self, name) for name in _FIELD_NAMES}
 
     def asdict(self):
         """Return a dictionary of attributes."""
@@ -127,7 +251,81 @@ class KqlQuery:
 
     def to_json(self):
         """Return JSON representation of attributes."""
-        return json.dumps(self.asdict())
+        return json.dumps(self.to_record())
+
+    def _set_derived_fields(self, names: Iterable[str]):
+        """Set the derived fields in `names` from the other fields."""
+        if (
+            "query_name" in names
+            and self.query_name is None
+            and self.source_path is not None
+        ):
+            self.query_name = self.source_path.rsplit("/", maxsplit=1)[-1]
+        if "query_id" in names and not self.query_id:
+            self.query_id = get_query_id(self.source_path, self.source_index)
+        if "query_hash" in names and self.query:
+            self.query_hash = _get_query_hash(self.query)
+        if (
+            "repo_name" in names
+            and self.repo_name is None
+            and self.source_path is not None
+        ):
+            match = _REPO_NAME.match(self.source_path)
+            if match:
+                self.repo_name = match["name"]
+
+    @staticmethod
+    def set_unique_query_ids(
+        kql_queries: Iterable["KqlQuery"], occurrences: Optional[Dict[str, int]] = None
+    ):
+        """
+        Give queries with the same derived query_id different ids.
+
+        Parameters
+        ----------
+        kql_queries : Iterable[KqlQuery]
+            The queries, in source order.
+        occurrences : Optional[Dict[str, int]], optional
+            The number of queries seen with each derived query_id -
+            pass the same dict for each batch of a set of queries.
+
+        Notes
+        -----
+        Queries read from sources without a source_index (or with
+        a repeated one) have the same derived query_id and would
+        replace each other in a store. The second and later queries
+        with the same source path and index are given the id of their
+        occurrence number (see `get_query_id`). Query ids that were
+        not derived from the source path and index are not changed.
+
+        """
+        occurrences = {} if occurrences is None else occurrences
+        for kql in kql_queries:
+            if kql.query_id != get_query_id(kql.source_path, kql.source_index):
+                continue
+            occurrence = occurrences.get(kql.query_id, 0)
+            occurrences[kql.query_id] = occurrence + 1
+            if occurrence:
+                kql.query_id = get_query_id(
+                    kql.source_path, kql.source_index, occurrence
+                )
+
+    @staticmethod
+    def set_canonical_hashes(kql_queries: Iterable["KqlQuery"]):
+        """
+        Set the canonical_hash of queries that do not have one.
+
+        The query text is normalized once for each distinct
+        query_hash in `kql_queries`.
+
+        """
+        canonical_hashes: Dict[Any, Optional[str]] = {}
+        for kql in kql_queries:
+            if kql.canonical_hash is not None or not kql.query:
+                continue
+            if kql.query_hash not in canonical_hashes:
+                canonical_hashes[kql.query_hash] = get_canonical_hash(kql.query)
+            kql.canonical_hash = canonical_hashes[kql.query_hash]
 
     # helper methods and properties
     @property
@@ -149,9 +347,17 @@ class KqlQuery:
     @classmethod
     def kql_list_to_json(cls, kql_queries: List["KqlQuery"]):
         """Return JSON from a list of KqlQuery instances."""
-        return json.dumps(cls.kql_list_to_pylist(kql_queries))
+        return json.dumps([kql.to_record() for kql in kql_queries])
 
     @classmethod
     def kql_list_to_df(cls, kql_queries: List["KqlQuery"]):
         """Return a pandas DataFrame from a list of KqlQuery instances."""
         return pd.DataFrame(cls.kql_list_to_pylist(kql_queries))
+
+
+# field names, defaults and slot setters used by from_record and to_record
+_FIELD_NAMES = tuple(KqlQuery.field_names())
+_FIELD_SETTERS = [
+    (fld.name, fld.default, fld.default_factory, getattr(KqlQuery, fld.name).__set__)
+    for fld in fields(KqlQuery)
+]
@@ -0,0 +1,232 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Near-duplicate query detection with MinHash and LSH banding."""
+import zlib
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+from .text_index import iter_kql_tokens
+
+__author__ = "Ian Hellen"
+
+# Mersenne prime used for the MinHash permutations
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def get_shingles(query: Optional[str], size: int = 5) -> Set[str]:
+    """
+    Return the token shingles of a normalized KQL query.
+
+    Parameters
+    ----------
+    query : Optional[str]
+        The KQL query text.
+    size : int, optional
+        The number of tokens in each shingle, by default 5
+
+    Returns
+    -------
+    Set[str]
+        The set of shingles. Queries with fewer than `size` tokens
+        have a single shingle of all of their tokens.
+
+    Notes
+    -----
+    Comments are removed, identifiers and operators are case-folded
+    and whitespace is ignored, so queries that differ only in
+    layout, case or comments have the same shingles.
+
+    """
+    tokens = [
+        token if kind == "string" else token.casefold()
+        for kind, token in iter_kql_tokens(query)
+        if kind != "comment"
+    ]
+    if not tokens:
+        return set()
+    return {
+        " ".join(tokens[idx : idx + size])
+        for idx in range(max(len(tokens) - size + 1, 1))
+    }
+
+
+def _hash_shingles(shingles: Set[str]) -> np.ndarray:
+    """Return stable 32-bit hashes of the shingles."""
+    return np.fromiter(
+        (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+        dtype=np.uint64,
+        count=len(shingles),
+    )
+
+
+class NearDuplicateIndex:
+    """
+    Locality sensitive hash index of query MinHash signatures.
+
+    Parameters
+    ----------
+    threshold : float, optional
+        The minimum (estimated) Jaccard similarity of the query
+        shingles for queries to be near duplicates, by default 0.8
+    num_perm : int, optional
+        The number of MinHash permutations, by default 128
+    bands : int, optional
+        The number of LSH bands, by default 16. `num_perm` must be
+        a multiple of `bands`.
+    shingle_size : int, optional
+        The number of tokens in each shingle, by default 5
+    seed : int, optional
+        Seed for the MinHash permutations, by default 1
+
+    Notes
+    -----
+    Each signature is split into `bands` bands and queries that have
+    an identical band are candidates. The probability of a pair
+    becoming candidates rises steeply around a similarity of
+    (1 / bands) ** (bands / num_perm) (about 0.7 with the defaults)
+    so candidates are found without comparing all pairs. Candidates
+    are verified against `threshold` using the signatures.
+
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        num_perm: int = 128,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        """Initialize the index."""
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands.")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        self._perm_a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._perm_b = rng.integers(0, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._signatures = np.zeros((0, num_perm), dtype=np.uint32)
+        self._has_signature = np.zeros(0, dtype=bool)
+        self._buckets: List[Dict[bytes, List[int]]] = [{} for _ in range(bands)]
+
+    def __len__(self) -> int:
+        """Return the number of indexed rows."""
+        return int(self._has_signature.sum())
+
+    def signature(self, query: Optional[str]) -> Optional[np.ndarray]:
+        """Return the MinHash signature of a query (None if it has no tokens)."""
+        shingles = get_shingles(query, self.shingle_size)
+        if not shingles:
+            return None
+        hashes = _hash_shingles(shingles)
+        # (a * x + b) mod p for each permutation and shingle hash
+        permuted = (
+            self._perm_a[:, None] * hashes[None, :] + self._perm_b[:, None]
+        ) % _PRIME
+        return (permuted & _MAX_HASH).min(axis=1).astype(np.uint32)
+
+    def add(self, row_id: int, query: Optional[str]):
+        """Add (or replace) the query for `row_id`."""
+        self.remove(row_id)
+        signature = self.signature(query)
+        if signature is None:
+            return
+        if row_id >= len(self._signatures):
+            size = max(row_id + 1, 2 * len(self._signatures))
+            signatures = np.zeros((size, self.num_perm), dtype=np.uint32)
+            signatures[: len(self._signatures)] = self._signatures
+            has_signature = np.zeros(size, dtype=bool)
+            has_signature[: len(self._has_signature)] = self._has_signature
+            self._signatures, self._has_signature = signatures, has_signature
+        self._signatures[row_id] = signature
+        self._has_signature[row_id] = True
+        for band, key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(key, []).append(row_id)
+
+    def remove(self, row_id: int):
+        """Remove the query for `row_id`."""
+        if row_id >= len(self._has_signature) or not self._has_signature[row_id]:
+            return
+        for band, key in enumerate(self._band_keys(self._signatures[row_id])):
+            bucket = self._buckets[band][key]
+            bucket.remove(row_id)
+            if not bucket:
+                del self._buckets[band][key]
+        self._has_signature[row_id] = False
+
+    def similarity(self, row_id: int, other_ids: np.ndarray) -> np.ndarray:
+        """Return the estimated Jaccard similarity of `row_id` to `other_ids`."""
+        return (self._signatures[other_ids] == self._signatures[row_id]).mean(axis=1)
+
+    def near_duplicates(self, row_id: int) -> np.ndarray:
+        """Return the sorted rows that are near duplicates of `row_id`."""
+        if row_id >= len(self._has_signature) or not self._has_signature[row_id]:
+            return np.empty(0, dtype=np.int64)
+        candidates = {
+            other_id
+            for band, key in enumerate(self._band_keys(self._signatures[row_id]))
+            for other_id in self._buckets[band].get(key, [])
+            if other_id != row_id
+        }
+        candidate_ids = np.array(sorted(candidates), dtype=np.int64)
+        if not len(candidate_ids):
+            return candidate_ids
+        return candidate_ids[self.similarity(row_id, candidate_ids) >= self.threshold]
+
+    def clusters(self) -> List[List[int]]:
+        """
+        Return the clusters of near-duplicate rows.
+
+        Returns
+        -------
+        List[List[int]]
+            Sorted lists of rows (with two or more rows) ordered
+            by their first row.
+
+        Notes
+        -----
+        The pairs of members of each LSH bucket are compared, skipping
+        pairs that are already in the same cluster, so a bucket of
+        near duplicates costs one vectorized comparison per member.
+        Clusters are the connected components of the verified pairs.
+
+        """
+        parents = np.arange(len(self._has_signature))
+
+        def find(row_id: int) -> int:
+            while parents[row_id] != row_id:
+                parents[row_id] = parents[parents[row_id]]
+                row_id = parents[row_id]
+            return row_id
+
+        for band_buckets in self._buckets:
+            for bucket in band_buckets.values():
+                for idx, row_id in enumerate(bucket[:-1]):
+                    root = find(row_id)
+                    others = np.array(
+                        [other for other in bucket[idx + 1 :] if find(other) != root]
+                    )
+                    if not len(others):
+                        continue
+                    matched = others[self.similarity(row_id, others) >= self.threshold]
+                    for other_id in matched:
+                        other_root = find(other_id)
+                        if other_root != root:
+                            parents[max(root, other_root)] = min(root, other_root)
+                            root = min(root, other_root)
+
+        clusters: Dict[int, List[int]] = {}
+        for row_id in np.flatnonzero(self._has_signature):
+            clusters.setdefault(find(row_id), []).append(int(row_id))
+        return [rows for _, rows in sorted(clusters.items()) if len(rows) > 1]
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        """Return the bucket key of each band of a signature."""
+        return [band.tobytes() for band in signature.reshape(self.bands, -1)]
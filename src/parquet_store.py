@@ -0,0 +1,452 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""
+Parquet import and export of KqlQuery records.
+
+Requires the optional pyarrow package.
+
+Parquet schema
+--------------
+- scalar KqlQuery fields are string and int64 columns.
+- `attributes` is a struct with list<string> fields for the
+  indexed attributes (tactics, techniques) and a JSON string holding
+  the remaining attributes.
+- the list-valued kql_properties (tables, operators, fields,
+  functioncalls) are top-level list<string> columns.
+  The remaining kql_properties are stored as a JSON string.
+
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Union
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as pds
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+__author__ = "Ian Hellen"
+
+_ATTRIB_LISTS = ("tactics", "techniques")
+_KQL_LISTS = ("tables", "operators", "fields", "functioncalls")
+_STRING_OPERATORS = {
+    "startswith": "^{expr}.*",
+    "endswith": ".*{expr}$",
+    "contains": ".*{expr}.*",
+    "matches": "{expr}",
+}
+_SET_OPERATORS = ("all", "any", "none")
+# ordered after all ASCII characters (and after any character in UTF-8)
+_MAX_CHAR = "\U0010ffff"
+_ROW_GROUP_SIZE = 10000
+
+
+def _check_pyarrow():
+    """Raise an ImportError if pyarrow is not installed."""
+    if pa is None:
+        raise ImportError(
+            "Parquet support requires pyarrow.",
+            "Install with 'pip install pyarrow'.",
+        )
+
+
+def _get_schema() -> "pa.Schema":
+    """Return the Parquet schema for KqlQuery records."""
+    str_list = pa.list_(pa.string())
+    return pa.schema(
+        [
+            ("source_path", pa.string()),
+            ("query", pa.string()),
+            ("source_type", pa.string()),
+            ("source_index", pa.int64()),
+            ("repo_name", pa.string()),
+            ("query_name", pa.string()),
+            ("context", pa.string()),
+            (
+                "attributes",
+                pa.struct(
+                    [(name, str_list) for name in _ATTRIB_LISTS]
+                    + [("extra", pa.string())]
+                ),
+            ),
+            *[(name, str_list) for name in _KQL_LISTS],
+            ("kql_properties", pa.string()),
+            ("query_id", pa.string()),
+            ("query_hash", pa.string()),
+            ("query_version", pa.int64()),
+            ("canonical_hash", pa.string()),
+        ]
+    )
+
+
+def _is_str_list(value: Any) -> bool:
+    """Return True if `value` is a list of strings."""
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def _to_parquet_row(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a KqlQuery record in the Parquet schema layout."""
+    row = dict(record)
+    attributes = dict(record.get("attributes") or {})
+    row["attributes"] = {
+        name: attributes.pop(name) if _is_str_list(attributes.get(name)) else None
+        for name in _ATTRIB_LISTS
+    }
+    row["attributes"]["extra"] = json.dumps(attributes)
+    kql_properties = dict(record.get("kql_properties") or {})
+    for name in _KQL_LISTS:
+        value = kql_properties.get(name)
+        row[name] = kql_properties.pop(name) if _is_str_list(value) else None
+    row["kql_properties"] = json.dumps(kql_properties)
+    return row
+
+
+def _from_parquet_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a KqlQuery record from a row in the Parquet schema layout."""
+    record = dict(row)
+    if "attributes" in row:
+        struct = row["attributes"] or {}
+        attributes = {
+            name: struct[name] for name in _ATTRIB_LISTS if struct.get(name) is not None
+        }
+        attributes.update(json.loads(struct.get("extra") or "{}"))
+        record["attributes"] = attributes
+    if "kql_properties" in row:
+        kql_properties = {
+            name: record.pop(name)
+            for name in _KQL_LISTS
+            if name in record and record[name] is not None
+        }
+        for name in _KQL_LISTS:
+            record.pop(name, None)
+        kql_properties.update(json.loads(record.get("kql_properties") or "{}"))
+        record["kql_properties"] = kql_properties
+    return record
+
+
+def write_parquet(
+    records: Iterable[Dict[str, Any]],
+    file_path: Union[str, Path],
+    row_group_size: int = _ROW_GROUP_SIZE,
+):
+    """
+    Write KqlQuery records to a Parquet file.
+
+    Parameters
+    ----------
+    records : Iterable[Dict[str, Any]]
+        The KqlQuery records (as dicts).
+    file_path : Union[str, Path]
+        Path of the file to write.
+    row_group_size : int, optional
+        The number of records in each row group, by default 10000.
+        Records are converted and written one row group at a time.
+
+    """
+    _check_pyarrow()
+    schema = _get_schema()
+    with pq.ParquetWriter(str(file_path), schema) as writer:
+        batch: List[Dict[str, Any]] = []
+        for record in records:
+            batch.append(_to_parquet_row(record))
+            if len(batch) >= row_group_size:
+                writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+                batch = []
+        if batch:
+            writer.write_batch(pa.RecordBatch.from_pylist(batch, schema=schema))
+
+
+def iter_parquet(
+    file_path: Union[str, Path],
+    columns: Optional[List[str]] = None,
+    case: bool = False,
+    **criteria,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield KqlQuery records (as dicts) from a Parquet file.
+
+    Parameters
+    ----------
+    file_path : Union[str, Path]
+        Path of the Parquet file.
+    columns : Optional[List[str]], optional
+        The KqlQuery fields to read, by default all fields.
+    case : bool, optional
+        Use case-sensitive string matching, by default False
+
+    Other Parameters
+    ----------------
+    criteria :
+        Search criteria in the same form as `DataStore.find_queries`.
+        Scalar fields support exact matches, a list of values (ANY)
+        and the string operators (matches, contains, startswith,
+        endswith). The list fields
+        (tables, operators, fields, functioncalls, tactics, techniques)
+        support a list of values (ALL) or a dict of "all", "any" and
+        "none" value lists.
+
+    Yields
+    ------
+    Dict[str, Any]
+        The matching records.
+
+    Notes
+    -----
+    Only the requested columns (and columns used in the criteria) are
+    read. Exact matches on scalar fields are pushed down to the scan
+    and skip row groups whose column statistics exclude the value -
+    for case-insensitive string matches, row groups whose min/max
+    range cannot hold any upper/lower case variant of the value.
+    The string operators and the list field criteria are evaluated
+    for each row group that is read and do not skip row groups.
+    Regular expressions use the RE2 syntax supported by Arrow.
+
+    """
+    _check_pyarrow()
+    dataset = pds.dataset(str(file_path), format="parquet")
+    scan_filter, list_criteria, folded_values = _get_scan_filter(criteria, case)
+    if folded_values:
+        # Arrow cannot use the statistics for the lower-cased column values
+        dataset = pds.FileSystemDataset(
+            _get_row_groups(dataset, scan_filter, folded_values),
+            dataset.schema,
+            dataset.format,
+            dataset.filesystem,
+        )
+    read_columns = _get_read_columns(columns, list_criteria)
+    for batch in dataset.to_batches(columns=read_columns, filter=scan_filter):
+        if list_criteria:
+            batch = batch.filter(_get_list_mask(batch, list_criteria))
+        for row in batch.to_pylist():
+            record = _from_parquet_row(row)
+            if columns is not None:
+                record = {name: _get_field(record, name) for name in columns}
+            yield record
+
+
+def read_parquet(
+    file_path: Union[str, Path],
+    columns: Optional[List[str]] = None,
+    case: bool = False,
+    **criteria,
+) -> pd.DataFrame:
+    """
+    Return KqlQuery records from a Parquet file as a DataFrame.
+
+    Parameters are the same as `iter_parquet`.
+
+    """
+    columns_df = pd.DataFrame(iter_parquet(file_path, columns, case, **criteria))
+    if columns_df.empty and columns:
+        return pd.DataFrame(columns=columns)
+    return columns_df
+
+
+def _get_field(record: Dict[str, Any], name: str) -> Any:
+    """Return a KqlQuery field or a list attribute/property from a record."""
+    if name in record:
+        return record[name]
+    if name in _ATTRIB_LISTS:
+        return record.get("attributes", {}).get(name)
+    return record.get("kql_properties", {}).get(name)
+
+
+def _get_read_columns(
+    columns: Optional[List[str]], list_criteria: Dict[str, Dict[str, List[str]]]
+) -> Optional[List[str]]:
+    """Return the Parquet columns needed for `columns` and list criteria."""
+    if columns is None:
+        return None
+    read_columns = set()
+    for name in list(columns) + list(list_criteria):
+        if name in _ATTRIB_LISTS:
+            read_columns.add("attributes")
+        elif name == "kql_properties":
+            read_columns.update(["kql_properties", *_KQL_LISTS])
+        else:
+            read_columns.add(name)
+    return [name for name in _get_schema().names if name in read_columns]
+
+
+def _get_scan_filter(criteria: Dict[str, Any], case: bool):
+    """
+    Return the dataset filter expression and the list field criteria.
+
+    The third value is the string values of the case-insensitive exact
+    match criteria, by field name.
+
+    """
+    scan_filter = None
+    list_criteria: Dict[str, Dict[str, List[str]]] = {}
+    folded_values: Dict[str, List[str]] = {}
+    schema_names = _get_schema().names
+    for name, expr in criteria.items():
+        if name in _ATTRIB_LISTS or name in _KQL_LISTS:
+            list_criteria[name] = _normalize_list_expr(name, expr)
+            continue
+        if name not in schema_names:
+            raise ValueError(
+                f"Unknown attribute name {name}",
+                f"Search expression: {expr}.",
+            )
+        if isinstance(expr, dict):
+            operator, value = next(iter(expr.items()))
+            if operator not in _STRING_OPERATORS:
+                continue
+            pattern = _STRING_OPERATORS[operator].format(expr=value)
+            field_filter = pc.match_substring_regex(
+                pc.field(name), f"^(?:{pattern})", ignore_case=not case
+            )
+        else:
+            # a list of values matches ANY of the values, like DataStore
+            values = expr if isinstance(expr, list) else [expr]
+            field_filter = _get_exact_filter(name, values, case)
+            if not case and all(isinstance(value, str) for value in values):
+                folded_values[name] = values
+        scan_filter = (
+            field_filter if scan_filter is None else scan_filter & field_filter
+        )
+    return scan_filter, list_criteria, folded_values
+
+
+def _get_exact_filter(name: str, values: List[Any], case: bool) -> "pc.Expression":
+    """Return the filter expression for an exact match of any of `values`."""
+    field = pc.field(name)
+    if not values:
+        return pc.scalar(False)
+    if case:
+        return field.isin(values)
+    # exact string matches are case-insensitive, like DataStore
+    str_values = [value.lower() for value in values if isinstance(value, str)]
+    other_values = [value for value in values if not isinstance(value, str)]
+    if not other_values:
+        return pc.utf8_lower(field).isin(str_values)
+    if not str_values:
+        return field.isin(other_values)
+    return pc.utf8_lower(field).isin(str_values) | field.isin(other_values)
+
+
+def _get_row_groups(
+    dataset: "pds.FileSystemDataset",
+    scan_filter: Optional["pc.Expression"],
+    folded_values: Dict[str, List[str]],
+) -> List["pds.ParquetFileFragment"]:
+    """Return the row groups that may have case-insensitive matches."""
+    row_groups = []
+    for fragment in dataset.get_fragments(filter=scan_filter):
+        for row_group in fragment.split_by_row_group(scan_filter):
+            statistics = row_group.row_groups[0].statistics or {}
+            if all(
+                _may_contain_case_variant(values, statistics.get(name))
+                for name, values in folded_values.items()
+            ):
+                row_groups.append(row_group)
+    return row_groups
+
+
+def _may_contain_case_variant(
+    values: List[str], statistics: Optional[Dict[str, Any]]
+) -> bool:
+    """Return False if no case variant of `values` is in the statistics range."""
+    if not statistics or statistics.get("min") is None:
+        return True
+    min_value, max_value = statistics["min"], statistics["max"]
+    for value in values:
+        if not value.isascii():
+            return True
+        smallest = _min_case_variant(value, min_value)
+        if smallest is not None and smallest <= max_value:
+            return True
+    return False
+
+
+def _min_case_variant(value: str, min_value: str) -> Optional[str]:
+    """
+    Return the smallest case variant of `value` >= `min_value`.
+
+    The variants are an upper bound - a letter can also be matched by
+    a non-ASCII character with the same lower case (e.g. the Kelvin
+    sign), so each letter can be `_MAX_CHAR`.
+
+    """
+    choices = [
+        sorted({char.upper(), char.lower(), *([_MAX_CHAR] if char.isalpha() else [])})
+        for char in value
+    ]
+    smallest = None
+    # variants with a longer prefix in common with min_value are smaller
+    for idx, chars in enumerate(choices):
+        if idx == len(min_value):
+            return min_value + "".join(rest[0] for rest in choices[idx:])
+        larger = [char for char in chars if char > min_value[idx]]
+        if larger:
+            smallest = (
+                min_value[:idx]
+                + larger[0]
+                + "".join(rest[0] for rest in choices[idx + 1 :])
+            )
+        if min_value[idx] not in chars:
+            return smallest
+    # min_value is a variant or it starts with a variant
+    return min_value if len(value) == len(min_value) else smallest
+
+
+def _normalize_list_expr(name: str, expr: Any) -> Dict[str, List[str]]:
+    """Return a list field expression as a dict of set operator to values."""
+    if isinstance(expr, str):
+        expr = [expr]
+    if isinstance(expr, list):
+        expr = {"all": expr}
+    if not isinstance(expr, dict):
+        raise TypeError(f"Unsupported expression type for {name}: {type(expr)}")
+    for operator in expr:
+        if operator not in _SET_OPERATORS:
+            raise ValueError(
+                f"Unknown operator {operator} for {name}.",
+                f"Valid operators are {', '.join(_SET_OPERATORS)}.",
+            )
+    return {
+        operator: [values] if isinstance(values, str) else list(values)
+        for operator, values in expr.items()
+    }
+
+
+def _get_list_mask(
+    batch: "pa.RecordBatch", list_criteria: Dict[str, Dict[str, List[str]]]
+) -> "pa.Array":
+    """Return the mask of batch rows matching the list field criteria."""
+    mask = pa.array([True] * batch.num_rows, type=pa.bool_())
+    for name, expr in list_criteria.items():
+        if name in _ATTRIB_LISTS:
+            column = pc.struct_field(batch.column("attributes"), name)
+        else:
+            column = batch.column(name)
+        items = pc.list_flatten(column)
+        parents = pc.list_parent_indices(column)
+        for operator, values in expr.items():
+            if not values:
+                continue
+            if operator == "all":
+                for value in values:
+                    mask = pc.and_(mask, _rows_with(items, parents, [value], batch))
+            elif operator == "any":
+                mask = pc.and_(mask, _rows_with(items, parents, values, batch))
+            else:
+                mask = pc.and_not(mask, _rows_with(items, parents, values, batch))
+    return mask
+
+
+def _rows_with(
+    items: "pa.Array", parents: "pa.Array", values: List[str], batch: "pa.RecordBatch"
+) -> "pa.Array":
+    """Return the mask of rows that have any of `values` in a list column."""
+    rows = pc.filter(parents, pc.is_in(items, value_set=pa.array(values)))
+    return pc.is_in(pa.array(range(batch.num_rows), type=parents.type), rows)
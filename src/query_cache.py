@@ -0,0 +1,87 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""LRU cache for DataStore query results."""
+from collections import OrderedDict
+from typing import Any, Hashable, NamedTuple, Optional, Tuple
+
+__author__ = "Ian Hellen"
+
+
+class CacheInfo(NamedTuple):
+    """Query cache statistics."""
+
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results tagged with a store generation.
+
+    Parameters
+    ----------
+    maxsize : int, optional
+        The maximum number of cached results, by default 128
+
+    Notes
+    -----
+    Each result is stored with the generation of the store at the
+    time the result was created. A lookup with a different (newer)
+    generation is a miss and discards the stale result.
+
+    The cache may be shared by concurrent readers without a lock -
+    a key evicted by another thread during a lookup or an eviction
+    is skipped rather than raising an error.
+
+    """
+
+    def __init__(self, maxsize: int = 128):
+        """Initialize the cache."""
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, Tuple[int, Any]]" = OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key: Hashable, generation: int) -> Optional[Any]:
+        """Return the cached result for `key` or None if not cached."""
+        item = self._items.get(key)
+        if item is None or item[0] != generation:
+            if item is not None:
+                self._items.pop(key, None)
+            self._misses += 1
+            return None
+        try:
+            self._items.move_to_end(key)
+        except KeyError:
+            # evicted by another thread since the lookup
+            pass
+        self._hits += 1
+        return item[1]
+
+    def put(self, key: Hashable, generation: int, value: Any):
+        """Add a result to the cache."""
+        if self.maxsize <= 0:
+            return
+        # re-insert the key to move it to the end
+        self._items.pop(key, None)
+        self._items[key] = (generation, value)
+        while len(self._items) > self.maxsize:
+            try:
+                self._items.popitem(last=False)
+            except KeyError:
+                break
+
+    def clear(self):
+        """Remove all results and reset the statistics."""
+        self._items.clear()
+        self._hits = 0
+        self._misses = 0
+
+    def info(self) -> CacheInfo:
+        """Return cache statistics."""
+        return CacheInfo(self._hits, self._misses, self.maxsize, len(self._items))
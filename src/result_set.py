@@ -0,0 +1,211 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Lazy result set of DataStore query matches."""
+from typing import TYPE_CHECKING, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from .inverted_index import ROW_ID_TYPE
+from .kql_query import KqlQuery
+
+if TYPE_CHECKING:
+    from .data_store import DataStore
+    from .sqlite_store import SqliteDataStore
+
+__author__ = "Ian Hellen"
+
+
+class ResultSet:
+    """
+    Matching rows of a DataStore with lazy ordering, paging and projection.
+
+    Parameters
+    ----------
+    store : Union[DataStore, SqliteDataStore]
+        The store that the rows belong to.
+    row_ids : np.ndarray
+        The sorted row ids of the matching queries.
+
+    Notes
+    -----
+    The result set holds only the matching row ids. `order_by`,
+    `limit`, `offset`, `page` and `select` return new result sets
+    without reading any query data. The query fields are only read
+    when the results are materialized with `to_df` (or with
+    `index` or a column lookup) and then only for the rows of the
+    current page and the selected columns. Ordering a limited result
+    set uses a partial sort, so the cost of a top-k page does not
+    grow with the size of the full sort.
+
+    Results are not updated if the store changes - materialize them
+    before adding or changing queries, or search a read-only snapshot
+    of the store (see `VersionedStore`).
+
+    Examples
+    --------
+    >>>> results = ds.find_queries(tables=["SigninLogs"])
+    >>>> len(results)
+    120
+    >>>> page = results.order_by("query_name").select("query_name").page(2, 25)
+    >>>> page.to_df()
+
+    """
+
+    def __init__(
+        self,
+        store: Union["DataStore", "SqliteDataStore"],
+        row_ids: np.ndarray,
+        order: Optional[List[tuple]] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+        columns: Optional[List[str]] = None,
+    ):
+        """Initialize the result set."""
+        self._store = store
+        self._row_ids = row_ids
+        self._order = order or []
+        self._start = start
+        self._stop = stop
+        self._columns = columns
+
+    def __len__(self) -> int:
+        """Return the number of rows in the (paged) result set."""
+        stop = self.total if self._stop is None else min(self._stop, self.total)
+        return max(stop - self._start, 0)
+
+    def __repr__(self) -> str:
+        """Return a short description of the result set."""
+        return f"ResultSet(rows={len(self)}, total={self.total})"
+
+    def __getitem__(self, column: str) -> pd.Series:
+        """Return the values of `column` for the rows of the result set."""
+        return self.select(column).to_df()[column]
+
+    @property
+    def total(self) -> int:
+        """Return the number of matching rows, ignoring limit and offset."""
+        return len(self._row_ids)
+
+    @property
+    def empty(self) -> bool:
+        """Return True if the result set has no rows."""
+        return not len(self)
+
+    @property
+    def columns(self) -> List[str]:
+        """Return the names of the selected columns."""
+        return [
+            name
+            for name in KqlQuery.field_names()
+            if name != "query_id"
+            and (self._columns is None or name in self._columns)
+        ]
+
+    @property
+    def index(self) -> pd.Index:
+        """Return the query_ids of the rows of the result set."""
+        # pylint: disable=protected-access
+        query_ids = self._store._take_column("query_id", self.row_ids)
+        return pd.Index(query_ids, name="query_id")
+
+    @property
+    def row_ids(self) -> np.ndarray:
+        """Return the row ids of the result set, ordered and paged."""
+        stop = self.total if self._stop is None else min(self._stop, self.total)
+        if self._start >= stop:
+            return np.empty(0, dtype=ROW_ID_TYPE)
+        if not self._order:
+            return self._row_ids[self._start : stop]
+        keys = self._get_order_keys()
+        if stop < self.total:
+            # only the first `stop` rows need to be sorted
+            top = np.argpartition(keys, stop - 1)[:stop]
+            ordered = top[np.argsort(keys[top], kind="stable")]
+        else:
+            ordered = np.argsort(keys, kind="stable")
+        return self._row_ids[ordered[self._start : stop]]
+
+    def order_by(self, column: str, ascending: bool = True) -> "ResultSet":
+        """
+        Return the result set ordered by `column`.
+
+        Calling `order_by` again adds a secondary ordering. Rows with
+        no value for a column are ordered last. Rows with equal values
+        keep the store order.
+
+        """
+        if column not in KqlQuery.field_names():
+            raise ValueError(f"Unknown column {column}.")
+        return self._copy(order=[*self._order, (column, ascending)])
+
+    def limit(self, count: int) -> "ResultSet":
+        """Return the first `count` rows of the result set."""
+        stop = self._start + max(count, 0)
+        if self._stop is not None:
+            stop = min(stop, self._stop)
+        return self._copy(stop=stop)
+
+    def offset(self, count: int) -> "ResultSet":
+        """Return the result set without the first `count` rows."""
+        start = self._start + max(count, 0)
+        if self._stop is not None:
+            start = min(start, self._stop)
+        return self._copy(start=start)
+
+    def page(self, page: int, page_size: int) -> "ResultSet":
+        """Return page number `page` (0-based) of `page_size` rows."""
+        return self.offset(page * page_size).limit(page_size)
+
+    def select(self, *columns: str) -> "ResultSet":
+        """Return the result set with only `columns` (and the query_id index)."""
+        unknown = set(columns) - set(KqlQuery.field_names())
+        if unknown:
+            raise ValueError(f"Unknown column(s) {', '.join(sorted(unknown))}.")
+        return self._copy(columns=list(columns))
+
+    def to_df(self) -> pd.DataFrame:
+        """Return the rows and columns of the result set as a DataFrame."""
+        # pylint: disable=protected-access
+        return self._store._get_df(self.row_ids, columns=self.columns)
+
+    def _copy(self, **kwargs) -> "ResultSet":
+        """Return a copy of the result set with updated attributes."""
+        attribs = {
+            "order": self._order,
+            "start": self._start,
+            "stop": self._stop,
+            "columns": self._columns,
+            **kwargs,
+        }
+        return ResultSet(self._store, self._row_ids, **attribs)
+
+    def _get_order_keys(self) -> np.ndarray:
+        """Return unique int64 sort keys of the rows for the ordering columns."""
+        keys = np.zeros(self.total, dtype=np.int64)
+        for column, ascending in reversed(self._order):
+            ranks = self._get_ranks(column, ascending)
+            # combine with the ranks of the later columns and re-rank
+            # so that the keys stay smaller than the number of rows
+            combined = ranks * (int(keys.max(initial=0)) + 1) + keys
+            keys = np.unique(combined, return_inverse=True)[1].reshape(-1)
+        # the final tie-break is the store (row id) order
+        return keys.astype(np.int64) * self.total + np.arange(self.total)
+
+    def _get_ranks(self, column: str, ascending: bool) -> np.ndarray:
+        """Return the dense rank of the rows for the values of `column`."""
+        # pylint: disable=protected-access
+        values: Sequence = self._store._take_column(column, self._row_ids)
+        try:
+            ranks, uniques = pd.factorize(np.asarray(values), sort=True)
+        except TypeError as err:
+            raise ValueError(f"Cannot order by column {column}.") from err
+        ranks = ranks.astype(np.int64)
+        if not ascending:
+            ranks[ranks >= 0] = len(uniques) - 1 - ranks[ranks >= 0]
+        # missing values are last
+        ranks[ranks < 0] = len(uniques)
+        return ranks
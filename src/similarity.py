@@ -0,0 +1,140 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Sparse structural feature matrix for "more like this" query search."""
+from typing import Dict, Hashable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from .inverted_index import ROW_ID_TYPE, InvertedIndex
+
+__author__ = "Ian Hellen"
+
+_METRICS = ("cosine", "jaccard")
+
+
+class FeatureMatrix:
+    """
+    Sparse binary matrix of rows (queries) by features.
+
+    Features are any hashable values - e.g. ("tables", "SigninLogs").
+    Each row holds the array of its feature ids and the matrix columns
+    are held as an inverted index of feature id to sorted row ids, so
+    a row can be scored against all other rows with a single sparse
+    matrix-vector product.
+
+    Notes
+    -----
+    Rows are updated in place with `set_row`, the column postings are
+    updated through the write buffer of the inverted index.
+
+    """
+
+    def __init__(self):
+        """Initialize the matrix."""
+        self._feature_ids: Dict[Hashable, int] = {}
+        self._row_features: List[np.ndarray] = []
+        self._counts = np.zeros(0, dtype=np.int64)
+        self._columns = InvertedIndex()
+
+    def __len__(self) -> int:
+        """Return the number of rows."""
+        return len(self._row_features)
+
+    @property
+    def num_features(self) -> int:
+        """Return the number of distinct features."""
+        return len(self._feature_ids)
+
+    @classmethod
+    def from_rows(cls, row_features: Sequence[Iterable[Hashable]]) -> "FeatureMatrix":
+        """Return a matrix with the features of each row in `row_features`."""
+        matrix = cls()
+        matrix._row_features = [matrix._encode(features) for features in row_features]
+        matrix._counts = np.array(
+            [len(features) for features in matrix._row_features], dtype=np.int64
+        )
+        feature_ids = np.concatenate(
+            [np.empty(0, dtype=np.int64), *matrix._row_features]
+        )
+        matrix._columns = InvertedIndex.from_pairs(
+            feature_ids,
+            np.repeat(np.arange(len(matrix), dtype=ROW_ID_TYPE), matrix._counts),
+        )
+        return matrix
+
+    def set_row(self, row_id: int, features: Iterable[Hashable]):
+        """Set (or replace) the features of `row_id`."""
+        feature_ids = self._encode(features)
+        if row_id >= len(self._row_features):
+            empty = np.empty(0, dtype=np.int64)
+            self._row_features.extend([empty] * (row_id + 1 - len(self._row_features)))
+            counts = np.zeros(max(row_id + 1, 2 * len(self._counts)), dtype=np.int64)
+            counts[: len(self._counts)] = self._counts
+            self._counts = counts
+        self._row_features[row_id] = feature_ids
+        self._counts[row_id] = len(feature_ids)
+        self._columns.set_row(row_id, feature_ids.tolist())
+
+    def similar(
+        self, row_id: int, top_k: int = 10, metric: str = "cosine"
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the rows most similar to `row_id`.
+
+        Parameters
+        ----------
+        row_id : int
+            The row to compare to the other rows.
+        top_k : int, optional
+            The maximum number of rows to return, by default 10
+        metric : str, optional
+            "cosine" or "jaccard", by default "cosine"
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The row ids and their similarity scores, ordered by
+            descending score. Rows with no features in common with
+            `row_id` are not returned.
+
+        """
+        if metric not in _METRICS:
+            raise ValueError(
+                f"Unknown metric {metric}.",
+                f"Valid metrics are {', '.join(_METRICS)}.",
+            )
+        empty = np.empty(0, dtype=ROW_ID_TYPE), np.empty(0, dtype=float)
+        if row_id >= len(self._row_features) or top_k <= 0:
+            return empty
+        features = self._row_features[row_id]
+        if not len(features):
+            return empty
+        # the product of the matrix and the binary row vector is the
+        # number of features each row shares with `row_id`
+        postings = [self._columns.get(feature) for feature in features.tolist()]
+        overlap = np.bincount(np.concatenate(postings), minlength=len(self))
+        overlap[row_id] = 0
+        candidates = np.flatnonzero(overlap)
+        shared = overlap[candidates].astype(float)
+        counts = self._counts[candidates]
+        if metric == "cosine":
+            scores = shared / np.sqrt(len(features) * counts)
+        else:
+            scores = shared / (len(features) + counts - shared)
+        if len(candidates) > top_k:
+            top = np.argpartition(-scores, top_k - 1)[:top_k]
+            candidates, scores = candidates[top], scores[top]
+        # order by descending score, then row
+        order = np.lexsort((candidates, -scores))
+        return candidates[order].astype(ROW_ID_TYPE), scores[order]
+
+    def _encode(self, features: Iterable[Hashable]) -> np.ndarray:
+        """Return the sorted, unique feature ids of `features`."""
+        feature_ids = {
+            self._feature_ids.setdefault(feature, len(self._feature_ids))
+            for feature in features
+        }
+        return np.array(sorted(feature_ids), dtype=np.int64)
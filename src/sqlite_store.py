@@ -0,0 +1,659 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""SQLite backed query store with the DataStore API."""
+import json
+import logging
+import re
+import sqlite3
+from functools import lru_cache
+from pathlib import Path
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+import pandas as pd
+
+from .data_store import DataStore, KqlQueryList, QueryList
+from .filter_expr import (
+    INDEX_OPERATORS,
+    And,
+    FilterExpr,
+    Not,
+    Predicate,
+    criteria_to_filter,
+    parse_filter,
+)
+from .inverted_index import ROW_ID_TYPE
+from .json_stream import dump_json_records, read_json_records, write_json_records
+from .kql_query import KqlQuery
+from .result_set import ResultSet
+from .text_index import tokenize_kql
+
+__author__ = "Ian Hellen"
+
+# the DataStore index definitions and operators are shared
+# pylint: disable=protected-access
+
+
+# index key to (table, value column) - other index keys are stored
+# in the QueryAttribute table
+_INDEX_TABLES = {
+    "tables": ("QueryTable", "table_name"),
+    "operators": ("QueryOperator", "operator"),
+    "fields": ("QueryField", "field"),
+    "functioncalls": ("QueryFunction", "function"),
+}
+_ATTRIB_TABLE = ("QueryAttribute", "attribute_value")
+_JSON_FIELDS = ("attributes", "kql_properties")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS KqlQuery (
+    row_id INTEGER PRIMARY KEY,
+    query_id TEXT NOT NULL UNIQUE,
+    source_path TEXT,
+    query TEXT,
+    source_type TEXT,
+    source_index INTEGER,
+    repo_name TEXT,
+    query_name TEXT,
+    context TEXT,
+    attributes TEXT,
+    kql_properties TEXT,
+    query_hash TEXT,
+    query_version INTEGER,
+    canonical_hash TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_KqlQuery_source_path ON KqlQuery (source_path);
+CREATE INDEX IF NOT EXISTS ix_KqlQuery_query_name ON KqlQuery (query_name);
+CREATE INDEX IF NOT EXISTS ix_KqlQuery_repo_name ON KqlQuery (repo_name);
+CREATE INDEX IF NOT EXISTS ix_KqlQuery_source_type ON KqlQuery (source_type);
+{index_tables}
+CREATE TABLE IF NOT EXISTS QueryAttribute (
+    attribute_name TEXT NOT NULL,
+    attribute_value NOT NULL,
+    row_id INTEGER NOT NULL REFERENCES KqlQuery (row_id),
+    PRIMARY KEY (attribute_name, attribute_value, row_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_QueryAttribute_row_id ON QueryAttribute (row_id);
+CREATE VIRTUAL TABLE IF NOT EXISTS QueryText USING fts5 (
+    query, context, tokenize = "unicode61 tokenchars '_'"
+);
+"""
+_INDEX_TABLE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS {table} (
+    {column} TEXT NOT NULL,
+    row_id INTEGER NOT NULL REFERENCES KqlQuery (row_id),
+    PRIMARY KEY ({column}, row_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS ix_{table}_row_id ON {table} (row_id);
+"""
+
+
+@lru_cache(maxsize=256)
+def _compile_regex(pattern: str) -> "re.Pattern":
+    """Return a compiled regular expression."""
+    return re.compile(pattern)
+
+
+def _regexp(pattern: str, value: Optional[str]) -> bool:
+    """Implement the SQL REGEXP operator (matching at the start of `value`)."""
+    return isinstance(value, str) and _compile_regex(pattern).match(value) is not None
+
+
+def _casefold(value: Any) -> Any:
+    """Implement the SQL casefold function (other types are unchanged)."""
+    return value.casefold() if isinstance(value, str) else value
+
+
+class SqliteDataStore:
+    """
+    Query store persisted in a SQLite database.
+
+    Parameters
+    ----------
+    db_path : Union[str, Path], optional
+        Path to the database file, by default ":memory:". An existing
+        database is opened and its queries are available immediately.
+    kql_queries : Union[None, KqlQueryList, QueryList], optional
+        Queries to add to the store.
+    json_path : Optional[str], optional
+        Path to a JSON (or NDJSON) file of queries to add to the store.
+
+    Notes
+    -----
+    The store has the same public methods as `DataStore`. Queries
+    are stored in the KqlQuery table and the indexed attributes and
+    KQL properties in narrow (value, row_id) tables that are joined
+    to evaluate `find_queries` criteria. The query text and context
+    are indexed in an FTS5 table for `search_text`.
+
+    A database file can be shared between processes - it is opened
+    in write-ahead log mode so that readers are not blocked by writes.
+
+    """
+
+    _FIELDS = KqlQuery.field_names()
+
+    def __init__(
+        self,
+        db_path: Union[str, Path] = ":memory:",
+        kql_queries: Union[None, KqlQueryList, QueryList] = None,
+        json_path: Optional[str] = None,
+    ):
+        """Initialize the store."""
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._conn.create_function("regexp", 2, _regexp, deterministic=True)
+        self._conn.create_function("casefold", 1, _casefold, deterministic=True)
+        if str(db_path) != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        index_tables = "".join(
+            _INDEX_TABLE_SCHEMA.format(table=table, column=column)
+            for table, column in _INDEX_TABLES.values()
+        )
+        self._conn.executescript(_SCHEMA.format(index_tables=index_tables))
+        self._add_canonical_hash_column()
+
+        if json_path:
+            kql_queries = (
+                KqlQuery.from_record(record) for record in read_json_records(json_path)
+            )
+        if kql_queries:
+            self.add_queries(
+                [
+                    query if isinstance(query, KqlQuery) else KqlQuery(**query)
+                    for query in kql_queries
+                ]
+            )
+
+    def __len__(self) -> int:
+        """Return the number of queries in the store."""
+        return self._conn.execute("SELECT COUNT(*) FROM KqlQuery").fetchone()[0]
+
+    def __enter__(self) -> "SqliteDataStore":
+        """Return the store as a context manager."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the database connection."""
+        self.close()
+
+    def close(self):
+        """Close the database connection."""
+        self._conn.close()
+
+    @property
+    def queries(self) -> List[KqlQuery]:
+        """Get the list of current queries."""
+        return [KqlQuery.from_record(record) for record in self._iter_records()]
+
+    @property
+    def queries_dict(self) -> List[Dict[str, Any]]:
+        """Get the list of current queries."""
+        return list(self._iter_records())
+
+    def to_json(
+        self, file_path: Optional[str] = None, ndjson: bool = False
+    ) -> Optional[str]:
+        """Return the queries as JSON or save to `file_path`, if specified."""
+        if file_path is None:
+            return dump_json_records(self._iter_records(), ndjson=ndjson)
+        write_json_records(self._iter_records(), file_path, ndjson=ndjson)
+        return None
+
+    def to_df(self) -> pd.DataFrame:
+        """Return queries as a pandas DataFrame."""
+        return self._query_df("", [], index=False)
+
+    def get_query_ids(self) -> pd.DataFrame:
+        """Return subset of query columns."""
+        return self._query_df(
+            "", [], columns=["query_id", "source_path", "query_name", "query_hash"]
+        )
+
+    def add_queries(self, queries: KqlQueryList):
+        """
+        Add a list of queries to the store.
+
+        Queries with a query_id already in the store replace the
+        existing query, new queries are appended.
+
+        """
+        queries = list(queries)
+        KqlQuery.set_unique_query_ids(queries)
+        KqlQuery.set_canonical_hashes(queries)
+        with self._conn:
+            for query in queries:
+                self._add_query(query)
+
+    def add_query(self, query: KqlQuery):
+        """Add a single query to the store."""
+        self.add_queries([query])
+
+    def add_kql_properties(self, query_id: str, kql_properties: Dict[str, Any]):
+        """Add Kql properties to a query."""
+        kql_props = {key.casefold(): value for key, value in kql_properties.items()}
+        if "valid_query" not in kql_props:
+            kql_props["valid_query"] = True
+        row = self._conn.execute(
+            "SELECT row_id, attributes FROM KqlQuery WHERE query_id = ?", (query_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(query_id)
+        row_id, attributes = row
+        with self._conn:
+            self._conn.execute(
+                "UPDATE KqlQuery SET kql_properties = ? WHERE row_id = ?",
+                (json.dumps(kql_props), row_id),
+            )
+            self._delete_index_rows(row_id)
+            self._insert_index_rows(row_id, json.loads(attributes), kql_props)
+
+    def search_text(self, text: str, top_k: int = 10) -> pd.DataFrame:
+        """
+        Return the queries best matching a full text search.
+
+        Parameters
+        ----------
+        text : str
+            The search terms - e.g. "DeviceProcessEvents ProcessCommandLine has_any"
+        top_k : int, optional
+            The maximum number of results to return, by default 10
+
+        Returns
+        -------
+        pd.DataFrame
+            DataFrame of matching queries ordered by descending
+            relevance, with the BM25 relevance in the "score" column.
+
+        """
+        terms = {term.replace('"', '""') for term in tokenize_kql(text) if term.strip()}
+        if not terms or top_k < 1:
+            return self._query_df("WHERE 0", []).assign(score=[])
+        match_expr = " OR ".join(f'"{term}"' for term in sorted(terms))
+        sql = (
+            "SELECT KqlQuery.*, -bm25(QueryText) AS score FROM QueryText"
+            " JOIN KqlQuery ON KqlQuery.row_id = QueryText.rowid"
+            " WHERE QueryText MATCH ? ORDER BY score DESC LIMIT ?"
+        )
+        results = self._rows_to_df(self._conn.execute(sql, (match_expr, top_k)))
+        return results
+
+    def get_filter_lists(
+        self, categories: Optional[List[str]] = None
+    ) -> Dict[str, List[str]]:
+        """Return unique lists of values for each category."""
+        filter_lists = {}
+        for attrib, data_type in DataStore._ALL_INDEXES.items():
+            if categories is not None and attrib not in categories:
+                continue
+            table, column, condition, params = self._get_index_table(attrib)
+            values = [
+                data_type(value) if data_type is bool else value
+                for (value,) in self._conn.execute(
+                    f"SELECT DISTINCT {column} FROM {table} WHERE {condition}"
+                    f" ORDER BY {column}",
+                    params,
+                )
+            ]
+            if values:
+                filter_lists[attrib] = values
+        return filter_lists
+
+    def find_queries(
+        self, *, where: Optional[str] = None, case: bool = False, **kwargs
+    ) -> ResultSet:
+        """
+        Return the matching queries as a lazy ResultSet.
+
+        The `where` expression and keyword criteria are the same as
+        `DataStore.find_queries`.
+
+        Parameters
+        ----------
+        where : Optional[str], optional
+            A filter expression, ANDed with any keyword criteria.
+        case : bool, optional
+            Use case-sensitive matching, by default False
+
+        Returns
+        -------
+        ResultSet
+            The matching queries.
+
+        """
+        debug = kwargs.pop("debug", False)
+        sql_where, params = self._get_where(case, kwargs, where)
+        if debug:
+            logging.debug("Query: %s %s", sql_where, params)
+        cursor = self._conn.execute(
+            f"SELECT row_id FROM KqlQuery {sql_where} ORDER BY row_id", params
+        )
+        row_ids = np.fromiter((row_id for (row_id,) in cursor), dtype=ROW_ID_TYPE)
+        return ResultSet(self, row_ids)
+
+    def explain(
+        self, *, where: Optional[str] = None, case: bool = False, **kwargs
+    ) -> str:
+        """
+        Return the SQLite query plan for `find_queries` criteria.
+
+        The parameters are the same as `find_queries`.
+
+        """
+        sql_where, params = self._get_where(case, kwargs, where)
+        cursor = self._conn.execute(
+            f"EXPLAIN QUERY PLAN SELECT row_id FROM KqlQuery {sql_where}"
+            " ORDER BY row_id",
+            params,
+        )
+        return "\n".join(detail for *_, detail in cursor)
+
+    def get_facets(
+        self,
+        categories: Optional[List[str]] = None,
+        case: bool = False,
+        disjunctive: bool = False,
+        **kwargs,
+    ) -> Dict[str, Dict[Any, int]]:
+        """
+        Return the count of matching queries for each indexed value.
+
+        The parameters and return value are the same as
+        `DataStore.get_facets`.
+
+        """
+        facets = {}
+        for attrib, data_type in DataStore._ALL_INDEXES.items():
+            if categories is not None and attrib not in categories:
+                continue
+            table, column, condition, cond_params = self._get_index_table(attrib)
+            indexed = self._conn.execute(
+                f"SELECT 1 FROM {table} WHERE {condition} LIMIT 1", cond_params
+            ).fetchone()
+            if not indexed:
+                continue
+            criteria = kwargs
+            if disjunctive:
+                criteria = {
+                    arg_name: arg_expr
+                    for arg_name, arg_expr in kwargs.items()
+                    if arg_name != attrib
+                }
+            where, params = self._get_where(case, criteria)
+            counts = self._conn.execute(
+                f"SELECT {column}, COUNT(*) AS count FROM {table} WHERE {condition}"
+                f" AND row_id IN (SELECT row_id FROM KqlQuery {where})"
+                f" GROUP BY {column} ORDER BY count DESC, {column}",
+                [*cond_params, *params],
+            )
+            facets[attrib] = {
+                data_type(value) if data_type is bool else value: count
+                for value, count in counts
+            }
+        return facets
+
+    def _get_where(
+        self, case: bool, kwargs: Dict[str, Any], where: Optional[str] = None
+    ) -> Tuple[str, List[Any]]:
+        """Return the WHERE clause and parameters for find_queries criteria."""
+        valid_fields = set(self._FIELDS) | set(DataStore._ALL_INDEXES)
+        for arg_name, arg_expr in kwargs.items():
+            if arg_name not in valid_fields:
+                raise ValueError(
+                    f"Unknown attribute name {arg_name}",
+                    f"Search expression: {arg_expr}.",
+                )
+        exprs = [
+            expr
+            for expr in (
+                parse_filter(where) if where else None,
+                criteria_to_filter(kwargs, DataStore._ALL_INDEXES),
+            )
+            if expr is not None
+        ]
+        if not exprs:
+            return "", []
+        params: List[Any] = []
+        condition = self._filter_to_sql(
+            exprs[0] if len(exprs) == 1 else And(tuple(exprs)), case, params
+        )
+        return f"WHERE {condition}", params
+
+    def _filter_to_sql(self, expr: FilterExpr, case: bool, params: List[Any]) -> str:
+        """Return the SQL condition for a filter expression, adding its params."""
+        if isinstance(expr, Predicate):
+            return self._predicate_to_sql(expr, case, params)
+        if isinstance(expr, Not):
+            return f"NOT {self._filter_to_sql(expr.child, case, params)}"
+        joiner = " AND " if isinstance(expr, And) else " OR "
+        conditions = [
+            self._filter_to_sql(child, case, params) for child in expr.children
+        ]
+        return f"({joiner.join(conditions)})"
+
+    def _predicate_to_sql(
+        self, predicate: Predicate, case: bool, params: List[Any]
+    ) -> str:
+        """
+        Return the SQL condition for a predicate, adding its params.
+
+        The conditions are never NULL, so that NOT of a condition
+        matches the rows that the condition does not match.
+
+        """
+        attrib = predicate.attribute
+        values = predicate.value
+        if not isinstance(values, tuple):
+            values = (values,)
+        if attrib in DataStore._ALL_INDEXES:
+            if predicate.operator in ("has_all", "=="):
+                match_all = True
+            elif predicate.operator in ("has_any", "in"):
+                match_all = False
+            else:
+                raise ValueError(
+                    f"Operator {predicate.operator} is not valid for the indexed",
+                    f"attribute {attrib}. Use {', '.join(INDEX_OPERATORS)}.",
+                )
+            values = tuple(dict.fromkeys(values))
+            if not values:
+                return "1" if match_all else "0"
+            table, column, condition, cond_params = self._get_index_table(attrib)
+            sub_query = (
+                f"SELECT row_id FROM {table} WHERE {condition}"
+                f" AND {column} IN ({', '.join('?' * len(values))})"
+            )
+            if match_all:
+                sub_query += f" GROUP BY row_id HAVING COUNT(*) = {len(values)}"
+            params.extend([*cond_params, *values])
+            return f"row_id IN ({sub_query})"
+        if attrib not in self._FIELDS:
+            raise ValueError(f"Unknown attribute name {attrib}")
+        if predicate.operator in INDEX_OPERATORS:
+            raise ValueError(
+                f"Operator {predicate.operator} is only valid for indexed attributes",
+                f"({', '.join(sorted(DataStore._ALL_INDEXES))}).",
+            )
+        if predicate.operator in ("==", "in"):
+            if not values:
+                return "0"
+            conditions = []
+            for value in values:
+                # strings match case-insensitively, like DataStore
+                if isinstance(value, str) and not case:
+                    conditions.append(f"casefold({attrib}) = ?")
+                    params.append(value.casefold())
+                else:
+                    conditions.append(f"{attrib} = ?")
+                    params.append(value)
+            return f"IFNULL(({' OR '.join(conditions)}), 0)"
+        pattern = DataStore._OPERATOR[predicate.operator].format(expr=predicate.value)
+        params.append(pattern if case else f"(?i){pattern}")
+        return f"{attrib} REGEXP ?"
+
+    def _add_canonical_hash_column(self):
+        """Add the canonical_hash column to databases created without it."""
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(KqlQuery)")}
+        with self._conn:
+            if "canonical_hash" not in columns:
+                self._conn.execute(
+                    "ALTER TABLE KqlQuery ADD COLUMN canonical_hash TEXT"
+                )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS ix_KqlQuery_canonical_hash"
+                " ON KqlQuery (canonical_hash)"
+            )
+
+    def _add_query(self, query: KqlQuery):
+        """Insert or replace a query and its index rows."""
+        values = {
+            name: json.dumps(value) if name in _JSON_FIELDS else value
+            for name, value in query.to_record().items()
+        }
+        row = self._conn.execute(
+            "SELECT row_id FROM KqlQuery WHERE query_id = ?", (query.query_id,)
+        ).fetchone()
+        if row is None:
+            cursor = self._conn.execute(
+                f"INSERT INTO KqlQuery ({', '.join(values)})"
+                f" VALUES ({', '.join('?' * len(values))})",
+                list(values.values()),
+            )
+            row_id = cursor.lastrowid
+        else:
+            row_id = row[0]
+            self._conn.execute(
+                f"UPDATE KqlQuery SET {', '.join(f'{name} = ?' for name in values)}"
+                " WHERE row_id = ?",
+                [*values.values(), row_id],
+            )
+            self._delete_index_rows(row_id)
+            self._conn.execute("DELETE FROM QueryText WHERE rowid = ?", (row_id,))
+        self._insert_index_rows(row_id, query.attributes, query.kql_properties)
+        self._conn.execute(
+            "INSERT INTO QueryText (rowid, query, context) VALUES (?, ?, ?)",
+            (row_id, query.query, query.context),
+        )
+
+    def _insert_index_rows(
+        self,
+        row_id: int,
+        attributes: Optional[Dict[str, Any]],
+        kql_properties: Optional[Dict[str, Any]],
+    ):
+        """Insert the index table rows for a query."""
+        index_attribs = {**(attributes or {}), **(kql_properties or {})}
+        for key, data_type in DataStore._ALL_INDEXES.items():
+            if key not in index_attribs:
+                continue
+            values = set(DataStore._get_index_values(index_attribs[key], data_type))
+            if key in _INDEX_TABLES:
+                table, column = _INDEX_TABLES[key]
+                self._conn.executemany(
+                    f"INSERT INTO {table} ({column}, row_id) VALUES (?, ?)",
+                    [(value, row_id) for value in values],
+                )
+            else:
+                self._conn.executemany(
+                    "INSERT INTO QueryAttribute"
+                    " (attribute_name, attribute_value, row_id) VALUES (?, ?, ?)",
+                    [(key, value, row_id) for value in values],
+                )
+
+    def _delete_index_rows(self, row_id: int):
+        """Delete the index table rows for a query."""
+        for table, _ in (*_INDEX_TABLES.values(), _ATTRIB_TABLE):
+            self._conn.execute(f"DELETE FROM {table} WHERE row_id = ?", (row_id,))
+
+    @staticmethod
+    def _get_index_table(attrib: str) -> Tuple[str, str, str, List[Any]]:
+        """Return the table, value column and row condition for an index key."""
+        if attrib in _INDEX_TABLES:
+            return (*_INDEX_TABLES[attrib], "1", [])
+        return (*_ATTRIB_TABLE, "attribute_name = ?", [attrib])
+
+    def _iter_records(self) -> Iterator[Dict[str, Any]]:
+        """Yield the queries as dicts, in insertion order."""
+        cursor = self._conn.execute(
+            f"SELECT {', '.join(self._FIELDS)} FROM KqlQuery ORDER BY row_id"
+        )
+        for row in cursor:
+            yield self._to_record(row)
+
+    def _to_record(self, row: Iterable[Any]) -> Dict[str, Any]:
+        """Return a KqlQuery record from a KqlQuery table row."""
+        record = dict(zip(self._FIELDS, row))
+        for name in _JSON_FIELDS:
+            record[name] = json.loads(record[name]) if record[name] else {}
+        return record
+
+    def _take_column(self, column: str, row_ids: Sequence[int]) -> List[Any]:
+        """Return the values of `column` for `row_ids`, in row_ids order."""
+        cursor = self._conn.execute(
+            f"SELECT KqlQuery.{column} FROM json_each(?) AS ids"
+            " JOIN KqlQuery ON KqlQuery.row_id = ids.value ORDER BY ids.key",
+            (json.dumps([int(row_id) for row_id in row_ids]),),
+        )
+        values = [value for (value,) in cursor]
+        if column in _JSON_FIELDS:
+            return [json.loads(value) if value else {} for value in values]
+        return values
+
+    def _get_df(
+        self,
+        row_ids: Sequence[int],
+        columns: Optional[List[str]] = None,
+        index: bool = True,
+    ) -> pd.DataFrame:
+        """Return a DataFrame of the queries with `row_ids`, in row_ids order."""
+        cursor = self._conn.execute(
+            "SELECT KqlQuery.* FROM json_each(?) AS ids"
+            " JOIN KqlQuery ON KqlQuery.row_id = ids.value ORDER BY ids.key",
+            (json.dumps([int(row_id) for row_id in row_ids]),),
+        )
+        if columns is not None and "query_id" not in columns:
+            columns = ["query_id", *columns]
+        return self._rows_to_df(cursor, columns, index)
+
+    def _query_df(
+        self,
+        where: str,
+        params: List[Any],
+        columns: Optional[List[str]] = None,
+        index: bool = True,
+    ) -> pd.DataFrame:
+        """Return a DataFrame of the queries matching a WHERE clause."""
+        sql = f"SELECT * FROM KqlQuery {where} ORDER BY row_id"
+        return self._rows_to_df(self._conn.execute(sql, params), columns, index)
+
+    def _rows_to_df(
+        self,
+        cursor: sqlite3.Cursor,
+        columns: Optional[List[str]] = None,
+        index: bool = True,
+    ) -> pd.DataFrame:
+        """Return a DataFrame from a cursor over KqlQuery table rows."""
+        names = [desc[0] for desc in cursor.description]
+        extra = [name for name in names if name not in self._FIELDS + ["row_id"]]
+        records = []
+        for row in cursor:
+            row_dict = dict(zip(names, row))
+            record = self._to_record(row_dict[name] for name in self._FIELDS)
+            record.update({name: row_dict[name] for name in extra})
+            records.append(record)
+        data_df = pd.DataFrame(records, columns=self._FIELDS + extra)
+        if columns is not None:
+            data_df = data_df[columns]
+        return data_df.set_index("query_id") if index else data_df
@@ -0,0 +1,54 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test binary store file format."""
+import numpy as np
+import pytest
+
+from .binary_store import StoreFormatError, open_arrays, write_arrays
+
+__author__ = "Ian Hellen"
+
+
+def test_write_open_arrays(tmp_path):
+    """Test arrays round trip through the file."""
+    arrays = {
+        "ints": np.arange(10, dtype=np.int64),
+        "codes": np.array([3, -1, 2], dtype=np.int32),
+        "empty": np.empty(0, dtype=np.int64),
+        "mask": np.array([True, False, True]),
+        "bytes": np.frombuffer(b"hello", dtype=np.uint8),
+    }
+    file_path = tmp_path.joinpath("arrays.bin")
+    write_arrays(file_path, arrays, {"rows": 10})
+    read_arrays, metadata = open_arrays(file_path)
+    assert metadata == {"rows": 10}
+    assert list(read_arrays) == list(arrays)
+    for name, array in arrays.items():
+        assert read_arrays[name].dtype == array.dtype
+        np.testing.assert_array_equal(read_arrays[name], array)
+    assert not read_arrays["ints"].flags.writeable
+
+
+def test_open_invalid_file(tmp_path):
+    """Test opening a file that is not a store file."""
+    file_path = tmp_path.joinpath("not_a_store.json")
+    file_path.write_text("[]", encoding="utf-8")
+    with pytest.raises(StoreFormatError):
+        open_arrays(file_path)
+    with pytest.raises(TypeError):
+        write_arrays(file_path, {"objects": np.array([{}], dtype=object)}, {})
+
+
+def test_replace_open_file(tmp_path):
+    """Test that writing over an open file does not change the open arrays."""
+    file_path = tmp_path.joinpath("arrays.bin")
+    write_arrays(file_path, {"ints": np.arange(100000, dtype=np.int64)}, {})
+    read_arrays, _ = open_arrays(file_path)
+    write_arrays(file_path, {"ints": np.arange(10, dtype=np.int64)}, {})
+    # the open (memory-mapped) file is the previous version
+    assert int(read_arrays["ints"].sum()) == sum(range(100000))
+    assert len(open_arrays(file_path)[0]["ints"]) == 10
+    assert [path.name for path in tmp_path.iterdir()] == ["arrays.bin"]
@@ -0,0 +1,125 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test columnar storage."""
+import numpy as np
+
+from .columnar import BlobColumn, CategoryColumn, ColumnStore, ListColumn
+
+__author__ = "Ian Hellen"
+
+# pylint: disable=protected-access
+
+
+def test_category_column():
+    """Test dictionary-encoded column."""
+    column = CategoryColumn()
+    column.append(["a", "b", None, "a"])
+    assert column.categories == ["a", "b"]
+    assert list(column.codes) == [0, 1, -1, 0]
+    assert list(column.values()) == ["a", "b", None, "a"]
+    assert column.get_code("c") is None
+    column.set(2, "c")
+    assert column[2] == "c"
+    assert list(column.take(np.array([3, 2]))) == ["a", "c"]
+
+
+def test_blob_column():
+    """Test content-addressed column."""
+    column = BlobColumn()
+    column.append(["text a", "text b", None, "text a"], ["ha", "hb", None, "ha"])
+    assert column.keys == ["ha", "hb"]
+    assert column.num_blobs == 2
+    assert list(column.codes) == [0, 1, -1, 0]
+    assert list(column.values()) == ["text a", "text b", None, "text a"]
+    assert "hb" in column and "hc" not in column
+    assert column.get_blob("hb") == "text b"
+    column.set(2, "text c", "hc")
+    assert column[2] == "text c"
+    assert list(column.take(np.array([3, 2]))) == ["text a", "text c"]
+
+    # unreferenced blobs are not written to buffers
+    column.set(1, None)
+    loaded = BlobColumn.from_buffers(column.to_buffers())
+    assert loaded.keys == ["ha", "hc"]
+    assert list(loaded.values()) == ["text a", None, "text c", "text a"]
+    assert loaded.get_blob("hc") == "text c"
+
+
+def test_column_store_copy():
+    """Test that column store copies share arrays until they are changed."""
+    store = ColumnStore({"name": "category", "tags": "list", "text": "blob"})
+    store.append(
+        [
+            {"name": "a", "tags": ["x"], "text": "t1", "text_hash": "h1"},
+            {"name": "b", "tags": None, "text": "t2", "text_hash": "h2"},
+        ]
+    )
+    copy = store.copy()
+    assert copy["name"].codes.base is store["name"].codes.base
+    copy.set_row(0, {"name": "c", "tags": ["y"], "text": "t3", "text_hash": "h3"})
+    copy.append([{"name": "d", "tags": ["z"], "text": "t1", "text_hash": "h1"}])
+    assert len(store) == 2 and len(copy) == 3
+    assert store.get_row(0) == {"name": "a", "tags": ["x"], "text": "t1"}
+    assert copy.get_row(0) == {"name": "c", "tags": ["y"], "text": "t3"}
+    assert list(store["name"].values()) == ["a", "b"]
+    assert store["name"].categories == ["a", "b"]
+    assert store["text"].keys == ["h1", "h2"]
+    # the original copies its arrays before writing
+    store.set_row(1, {"name": "e"})
+    assert list(copy["name"].values()) == ["c", "b", "d"]
+
+
+def test_list_column():
+    """Test flattened list column with overrides."""
+    column = ListColumn()
+    column.append([["a", "b"], None, [], ["b"]])
+    assert column.values() == [["a", "b"], None, [], ["b"]]
+    column.set(1, ["c"])
+    column.set(0, None)
+    assert column.values() == [None, ["c"], [], ["b"]]
+    codes, offsets, present = column.flattened()
+    assert not column._overrides
+    assert list(offsets) == [0, 0, 1, 1, 2]
+    assert [column.categories[code] for code in codes] == ["c", "b"]
+    assert list(present) == [False, True, True, True]
+    column.append([["a"]])
+    assert column[4] == ["a"]
+
+
+def test_list_column_flatten():
+    """Test flattening the lists of a set of rows."""
+    column = ListColumn()
+    column.append([["a", "b"], None, [], ["b", "c", "a"]])
+    items, positions, present = column.flatten(np.array([3, 0, 1]))
+    assert list(items) == ["b", "c", "a", "a", "b"]
+    assert list(positions) == [0, 0, 0, 1, 1]
+    assert list(present) == [True, True, False]
+    column.set(0, ["d"])
+    column.set(3, None)
+    items, positions, present = column.flatten(np.arange(4))
+    assert list(items) == ["d"]
+    assert list(positions) == [0]
+    assert list(present) == [True, False, True, False]
+    assert not len(column.flatten(np.empty(0, dtype=np.int64))[0])
+
+
+def test_column_store():
+    """Test appending and updating rows."""
+    store = ColumnStore({"name": "category", "index": "int", "items": "list"})
+    store.append([{"name": "x", "index": 1, "items": ["a"]}, {"name": "y"}])
+    assert len(store) == 2
+    assert store.get_row(1) == {"name": "y", "index": 0, "items": None}
+    store.set_row(1, {"index": 5, "items": ["b"]})
+    assert store.get_row(1) == {"name": "y", "index": 5, "items": ["b"]}
+    blob_store = ColumnStore({"text": "blob", "text_hash": "object"})
+    blob_store.append([{"text": "abc", "text_hash": "h1"}, {"text": "abc"}])
+    blob_store.append([{"text": "abc", "text_hash": "h1"}])
+    assert blob_store["text"].keys == ["h1", "abc"]
+    blob_store.set_row(1, {"text": "abc", "text_hash": "h1"})
+    assert list(blob_store["text"].codes) == [0, 0, 0]
+    data_df = store.to_df(columns=["name", "index"])
+    assert list(data_df.columns) == ["name", "index"]
+    assert list(data_df["index"]) == [1, 5]
@@ -9,6 +9,7 @@ import random
 import uuid
 from pathlib import Path
 
+import pandas as pd
 import pytest
 
 from .data_store import DataStore
@@ -252,3 +253,591 @@ def test_datastore_find(get_kqlquery_list):
     assert all_items_len > len(ds.find_queries(tactics=["Compromise"]))
     assert len(ds.find_queries(tactics=["BadTactic"])) == 0
     assert len(ds.find_queries(query_name={"matches": "query.*"})) == all_items_len
+
+
+def test_datastore_find_all_items():
+    """Test that list criteria match queries having ALL items."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(3)]
+    queries[0].attributes["tactics"] = ["Exploitation", "Compromise"]
+    queries[1].attributes["tactics"] = ["Compromise"]
+    queries[2].attributes["tactics"] = ["Exploitation"]
+    ds = DataStore(queries)
+
+    assert len(ds.find_queries(tactics=["Compromise"])) == 2
+    results = ds.find_queries(tactics=["Exploitation", "Compromise"])
+    assert list(results["query_name"]) == ["query_0"]
+    assert len(ds.find_queries(tactics=["Compromise", "BadTactic"])) == 0
+    assert len(ds.find_queries(tactics=[])) == 3
+
+    ds.add_query(KqlQuery(**get_random_query(3)))
+    assert len(ds.find_queries(query_name="query_3")) == 1
+
+
+def test_datastore_find_set_operators():
+    """Test ALL/ANY/NONE set operators on indexed attributes."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(3)]
+    queries[0].attributes["tactics"] = ["Exploitation", "Compromise"]
+    queries[1].attributes["tactics"] = ["Compromise"]
+    queries[2].attributes["tactics"] = ["LateralMovement"]
+    ds = DataStore(queries)
+
+    results = ds.find_queries(tactics={"any": ["Exploitation", "LateralMovement"]})
+    assert list(results["query_name"]) == ["query_0", "query_2"]
+    results = ds.find_queries(tactics={"none": ["Exploitation"]})
+    assert list(results["query_name"]) == ["query_1", "query_2"]
+    results = ds.find_queries(
+        tactics={"any": ["Compromise", "LateralMovement"], "none": ["Exploitation"]}
+    )
+    assert list(results["query_name"]) == ["query_1", "query_2"]
+    assert len(ds.find_queries(tactics="Compromise")) == 2
+    with pytest.raises(ValueError):
+        ds.find_queries(tactics={"some": ["Compromise"]})
+
+
+def test_datastore_find_where():
+    """Test filter expressions, exact match case and query plans."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(4)]
+    tables = [["SigninLogs"], ["SigninLogs", "AuditLogs"], ["AuditLogs"], []]
+    for query, query_tables in zip(queries, tables):
+        query.attributes["tactics"] = ["Compromise"]
+        query.kql_properties = {"tables": query_tables}
+    queries[3].attributes["tactics"] = ["Persistence"]
+    queries[0].query_name = "AAD_query"
+    ds = DataStore(queries)
+
+    def names(results):
+        return list(results["query_name"])
+
+    assert names(ds.find_queries(where='tables has "AuditLogs"')) == [
+        "query_1",
+        "query_2",
+    ]
+    assert names(
+        ds.find_queries(
+            where='tables has "SigninLogs" and not tables has "AuditLogs"'
+            ' or tactics has "Persistence"'
+        )
+    ) == ["AAD_query", "query_3"]
+    assert names(
+        ds.find_queries(
+            where='tables has_any ("AuditLogs", "x") and (query_name != "query_2")'
+        )
+    ) == ["query_1"]
+    assert names(ds.find_queries(where='query_name in ("query_1", "QUERY_2")')) == [
+        "query_1",
+        "query_2",
+    ]
+    assert names(ds.find_queries(where='query_name =~ "aad.*" or tables has "x"')) == [
+        "AAD_query"
+    ]
+    # where expressions are ANDed with keyword criteria
+    assert names(
+        ds.find_queries(where="tables has 'SigninLogs'", query_name="query_1")
+    ) == ["query_1"]
+
+    # exact matches are case-insensitive unless case=True
+    assert len(ds.find_queries(query_name="aad_QUERY")) == 1
+    assert len(ds.find_queries(query_name="aad_QUERY", case=True)) == 0
+    assert len(ds.find_queries(source_path=queries[2].source_path.upper())) == 1
+    assert len(ds.find_queries(source_index=queries[2].source_index)) >= 1
+
+    with pytest.raises(ValueError):
+        ds.find_queries(where='query_name has "x"')
+    with pytest.raises(ValueError):
+        ds.find_queries(where='tables matches "x"')
+    with pytest.raises(ValueError):
+        ds.find_queries(where='not_an_attribute == "x"')
+    with pytest.raises(ValueError):
+        ds.find_queries(where="tables has")
+
+    plan = ds.explain(
+        where='query_name matches "AAD.*" and tables has "AuditLogs"',
+        tactics=["Compromise"],
+    )
+    assert plan.splitlines() == [
+        "AND (est. 1 rows)",
+        '  INDEX tables has_all ("AuditLogs") (est. 2 rows)',
+        '  INDEX tactics has_all ("Compromise") (est. 3 rows)',
+        '  SCAN query_name matches "AAD.*" (est. 1 rows)',
+    ]
+
+
+def test_datastore_add_queries_incremental():
+    """Test adding and replacing queries in batches."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(6)]
+    for query in queries:
+        query.attributes["tactics"] = ["Compromise"]
+    ds = DataStore(queries[:2])
+    ds.add_queries(queries[2:4])
+    ds.add_queries([])
+    ds.add_query(queries[4])
+    assert len(ds.find_queries(tactics=["Compromise"])) == 5
+    assert list(ds.to_df()["query_name"]) == [f"query_{i}" for i in range(5)]
+
+    # replace an existing query - keeps its position
+    replacement = KqlQuery(**get_random_query(1))
+    replacement.query_id = queries[1].query_id
+    replacement.query_name = "replaced"
+    replacement.attributes["tactics"] = ["LateralMovement"]
+    ds.add_queries([replacement, queries[5]])
+    assert len(ds.queries) == 6
+    assert len(ds.find_queries(tactics=["Compromise"])) == 5
+    results = ds.find_queries(tactics=["LateralMovement"])
+    assert list(results.index) == [queries[1].query_id]
+    assert list(results["query_name"]) == ["replaced"]
+    assert ds.find_queries(query_name="query_5").index[0] == queries[5].query_id
+
+    empty_ds = DataStore()
+    empty_ds.add_queries(queries[:2])
+    assert len(empty_ds.find_queries(tactics=["Compromise"])) == 2
+
+
+def test_datastore_rebuild_query_ids():
+    """Test that rebuilt queries replace the queries from the same source."""
+    sources = [
+        (f"https://github.com/a/b/queries_{idx}.md", idx % 2) for idx in range(4)
+    ]
+    ds = DataStore(
+        [
+            KqlQuery(source_path=path, source_index=index, query="SecurityAlert")
+            for path, index in sources
+        ]
+    )
+    query_ids = list(ds.to_df().index)
+    rebuilt = [
+        KqlQuery(source_path=path, source_index=index, query="SecurityEvent")
+        for path, index in sources[2:]
+    ]
+    ds.add_queries(rebuilt)
+    assert len(ds) == 4
+    assert list(ds.to_df().index) == query_ids
+    assert list(ds.to_df()["query"]) == ["SecurityAlert"] * 2 + ["SecurityEvent"] * 2
+
+
+def test_datastore_repeated_source_index():
+    """Test that queries with the same source path and index are all kept."""
+    path = "https://github.com/a/b/README.md"
+    queries = [
+        KqlQuery(
+            source_path=path, source_index=None, query=f"SecurityAlert | take {idx}"
+        )
+        for idx in range(3)
+    ]
+    ds = DataStore(queries)
+    assert len(ds) == 3
+    query_ids = list(ds.to_df().index)
+    assert len(set(query_ids)) == 3
+    # a rebuild of the same source gives the queries the same ids
+    ds.add_queries(
+        [
+            KqlQuery(source_path=path, source_index=None, query=f"SecurityEvent {idx}")
+            for idx in range(3)
+        ]
+    )
+    assert list(ds.to_df().index) == query_ids
+    assert ds.queries[2].query == "SecurityEvent 2"
+    # explicit query_ids are not changed
+    ds.add_queries([KqlQuery(source_path=path, query="x", query_id="q1")] * 2)
+    assert len(ds) == 4
+
+
+def test_datastore_load_query_corpus():
+    """Test that all of the queries in the shipped query data are loaded."""
+    data_path = Path(__file__).parent.parent.joinpath("data/kql_queries.json")
+    records = json.loads(data_path.read_text(encoding="utf-8"))
+    assert len(DataStore(records)) == len(records) == 2906
+    assert len(DataStore(json_path=str(data_path))) == len(records)
+
+
+def test_datastore_write_buffer():
+    """Test single query writes and kql_properties updates."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(4)]
+    ds = DataStore(queries[:2])
+    ds.add_query(queries[2])
+    ds.add_query(queries[3])
+    assert len(ds) == len(ds._columns) == 4
+    assert len(ds.find_queries(query_name={"matches": "query.*"})) == 4
+
+    kql_props = json.loads(json_kql_parse)
+    for query in queries:
+        ds.add_kql_properties(query.query_id, kql_props)
+    assert len(ds.find_queries(tables=["SigninLogs"])) == 4
+    # updating properties replaces the previous index entries
+    ds.add_kql_properties(
+        queries[0].query_id, {**kql_props, "Tables": ["SecurityAlert"]}
+    )
+    assert len(ds.find_queries(tables=["SigninLogs"])) == 3
+    assert len(ds.find_queries(tables=["SecurityAlert"])) == 1
+    assert "SecurityAlert" in ds.get_filter_lists()["tables"]
+    assert len(ds._indexes["tables"]) == 4
+    assert ds.to_df().iloc[0]["kql_properties"]["tables"] == ["SecurityAlert"]
+    results = ds.find_queries(tables=["SecurityAlert"])
+    assert results.to_df().iloc[0]["kql_properties"]["tables"] == ["SecurityAlert"]
+
+
+def test_datastore_index_pairs():
+    """Test that the bulk index build matches the index values of each row."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(6)]
+    kql_props = json.loads(json_kql_parse)
+    queries[0].kql_properties = kql_props
+    queries[1].kql_properties = {**kql_props, "tables": None, "valid_query": False}
+    queries[2].attributes["tables"] = ["AttributeTable"]
+    ds = DataStore(queries)
+    ds.add_kql_properties(queries[3].query_id, {"Tables": ["SecurityAlert"]})
+
+    pairs = ds._get_index_pairs(range(len(ds)))
+    expected = {}
+    for row_id in range(len(ds)):
+        for key, values in ds._get_indexed_attribs(row_id).items():
+            expected.setdefault(key, set()).update((value, row_id) for value in values)
+    assert set(pairs) == set(expected)
+    for key, (values, rows) in pairs.items():
+        assert set(zip(values, rows.tolist())) == expected[key]
+    assert ds.find_queries(tables=["AttributeTable"]).index[0] == queries[2].query_id
+    assert len(ds.find_queries(valid_query=False)) == 1
+
+
+def test_datastore_search_text():
+    """Test full text search of query text and context."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(3)]
+    queries[0].query = "DeviceProcessEvents | where ProcessCommandLine has 'cmd'"
+    queries[1].context = "Hunting with DeviceProcessEvents"
+    ds = DataStore(queries)
+    results = ds.search_text("DeviceProcessEvents ProcessCommandLine")
+    assert list(results["query_name"]) == ["query_0", "query_1"]
+    assert results["score"].is_monotonic_decreasing
+
+    new_query = KqlQuery(**get_random_query(3))
+    new_query.query = "DeviceProcessEvents | take 1"
+    ds.add_query(new_query)
+    assert len(ds.search_text("DeviceProcessEvents")) == 3
+    assert len(ds.search_text("DeviceProcessEvents", top_k=1)) == 1
+
+
+def test_datastore_find_regex():
+    """Test string operators on trigram indexed fields."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(4)]
+    queries[0].query = "SigninLogs | take 1"
+    queries[1].query = "AADSignInLogs | where X == 1"
+    queries[2].query = "SecurityAlert | where DisplayName has 'signin'"
+    ds = DataStore(queries)
+    assert len(ds.find_queries(query={"contains": "signin"})) == 3
+    assert len(ds.find_queries(query={"contains": "signin"}, case=True)) == 1
+    assert len(ds.find_queries(query={"startswith": "AAD"})) == 1
+    assert len(ds.find_queries(query={"endswith": "== 1"})) == 1
+    assert len(ds.find_queries(query={"matches": "(Signin|Security).*"})) == 3
+    assert len(ds.find_queries(query_name={"contains": "query_"})) == 4
+
+    new_query = KqlQuery(**get_random_query(4))
+    new_query.query = "SigninLogs | take 2"
+    ds.add_query(new_query)
+    assert len(ds.find_queries(query={"startswith": "signinlogs"})) == 2
+
+
+def test_datastore_query_cache():
+    """Test caching of find_queries results."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(4)]
+    for query in queries:
+        query.attributes["tactics"] = ["Compromise", "Exploitation"]
+    ds = DataStore(queries)
+
+    results = ds.find_queries(tactics=["Compromise", "Exploitation"])
+    assert len(results) == 4
+    assert ds.cache_info().misses == 1
+    # same criteria in a different order hits the cache
+    assert len(ds.find_queries(tactics=["Exploitation", "Compromise"])) == 4
+    assert len(ds.find_queries(tactics={"all": ["Compromise", "Exploitation"]})) == 4
+    ds.find_queries(query_name={"contains": "QUERY"})
+    ds.find_queries(query_name={"contains": "query"})
+    assert ds.find_queries(query_name={"contains": "QUERY"}, case=True).empty
+    info = ds.cache_info()
+    assert info.hits == 3
+    assert info.misses == 3
+    assert info.currsize == 3
+
+    # changes to the store invalidate the cached results
+    ds.add_kql_properties(queries[0].query_id, {"tactics": ["LateralMovement"]})
+    assert len(ds.find_queries(tactics=["Compromise", "Exploitation"])) == 3
+    assert ds.cache_info().misses == 4
+    ds.add_query(KqlQuery(**get_random_query(5)))
+    assert len(ds.find_queries(query_name={"contains": "query"})) == 5
+
+    ds.clear_cache()
+    assert ds.cache_info().currsize == 0
+
+    # list values on other fields match ANY of the values, in any order
+    names = ["query_1", "query_2"]
+    assert len(ds.find_queries(query_name=names)) == 2
+    assert len(ds.find_queries(query_name=names[::-1])) == 2
+    assert ds.cache_info().hits == 1
+    # only the first operator of a dict expression is evaluated
+    first_contains = {"contains": "query_1", "startswith": "zzz"}
+    first_startswith = {"startswith": "zzz", "contains": "query_1"}
+    assert len(ds.find_queries(query_name=first_contains)) == 1
+    assert ds.find_queries(query_name=first_startswith).empty
+
+
+def test_datastore_columnar():
+    """Test the columnar storage round trips queries."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    kql_props = {
+        key.casefold(): value for key, value in json.loads(json_kql_parse).items()
+    }
+    queries[1].kql_properties = kql_props
+    ds = DataStore(queries)
+    assert ds.queries == queries
+    assert ds._data[queries[1].query_id] == queries[1]
+    assert ds._columns["tables"][1] == kql_props["tables"]
+    assert ds._columns["query_name"].kind == "category"
+
+    out_df = ds.to_df()
+    assert list(out_df.columns) == KqlQuery.field_names()
+    assert list(out_df["query_id"]) == [query.query_id for query in queries]
+    assert out_df.iloc[1]["kql_properties"] == kql_props
+    ids_df = ds.get_query_ids()
+    assert list(ids_df.columns) == ["source_path", "query_name", "query_hash"]
+    assert list(ids_df.index) == [query.query_id for query in queries]
+
+    # exact and regex matches on category columns
+    assert len(ds.find_queries(query_name="query_3")) == 1
+    assert len(ds.find_queries(query_name="not_a_query")) == 0
+    new_query = KqlQuery(**get_random_query(5))
+    new_query.query_name = "new_query_name"
+    ds.add_query(new_query)
+    assert len(ds.find_queries(query_name={"contains": "new_query"})) == 1
+    assert len(ds.find_queries(query_name={"matches": "query_.*"})) == 5
+
+
+def test_datastore_save_open(tmp_path):
+    """Test saving and opening the binary store file."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    kql_props = {
+        key.casefold(): value for key, value in json.loads(json_kql_parse).items()
+    }
+    queries[1].kql_properties = kql_props
+    ds = DataStore(queries)
+    store_path = tmp_path.joinpath("kql_store.bin")
+    ds.save(store_path)
+
+    opened_ds = DataStore.open(store_path)
+    assert len(opened_ds) == 5
+    assert opened_ds._row_id_map is None
+    assert opened_ds.queries == queries
+    assert opened_ds.get_filter_lists() == ds.get_filter_lists()
+    assert len(opened_ds.find_queries(tables=["SigninLogs"])) == 1
+    assert len(opened_ds.find_queries(query_name={"matches": "query_[12]"})) == 2
+    pd.testing.assert_frame_equal(opened_ds.to_df(), ds.to_df())
+
+    # opened stores can be updated
+    new_query = KqlQuery(**get_random_query(5))
+    opened_ds.add_query(new_query)
+    opened_ds.add_kql_properties(queries[0].query_id, kql_props)
+    assert len(opened_ds) == 6
+    assert len(opened_ds.find_queries(tables=["SigninLogs"])) == 2
+    assert opened_ds._data[new_query.query_id] == new_query
+    # ...without changing the file
+    assert len(DataStore.open(store_path)) == 5
+
+
+@pytest.mark.parametrize("file_name", ["queries.json", "queries.ndjson.gz"])
+def test_datastore_json_files(tmp_path, file_name):
+    """Test streaming queries to and from JSON files."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    ds = DataStore(queries)
+    json_path = tmp_path.joinpath(file_name)
+    assert ds.to_json(json_path, ndjson="ndjson" in file_name) is None
+    assert json.loads(ds.to_json()) == ds.queries_dict
+    assert len(ds.to_json(ndjson=True).splitlines()) == 5
+    assert DataStore(json_path=str(json_path)).queries == queries
+
+
+def test_datastore_query_text_dedupe(tmp_path):
+    """Test query text is stored and written once per query_hash."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    # get_random_query queries all have the same query text
+    queries[4].query = "SigninLogs | take 1"
+    ds = DataStore(queries)
+    assert ds._columns["query"].num_blobs == 2
+    assert ds.has_query_hash(queries[0].query_hash)
+    assert not ds.has_query_hash("not_a_hash")
+    assert ds.queries == queries
+    assert len(ds.find_queries(query={"startswith": queries[0].query[:10]})) == 4
+
+    json_path = tmp_path.joinpath("queries.json")
+    ds.to_json(json_path, dedupe=True)
+    records = json.loads(json_path.read_text(encoding="utf-8"))
+    assert ["query" in record for record in records] == [
+        True,
+        False,
+        False,
+        False,
+        True,
+    ]
+    assert DataStore(json_path=str(json_path)).queries == queries
+
+    store_path = tmp_path.joinpath("kql_store.bin")
+    ds.save(store_path)
+    opened_ds = DataStore.open(store_path)
+    assert opened_ds.queries == queries
+    assert opened_ds.has_query_hash(queries[4].query_hash)
+
+
+def test_datastore_parquet(tmp_path):
+    """Test writing and loading Parquet files."""
+    pytest.importorskip("pyarrow")
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    kql_props = {
+        key.casefold(): value for key, value in json.loads(json_kql_parse).items()
+    }
+    queries[2].kql_properties = kql_props
+    ds = DataStore(queries)
+    parquet_path = tmp_path.joinpath("queries.parquet")
+    ds.to_parquet(parquet_path)
+    assert DataStore.from_parquet(parquet_path).queries == queries
+    subset_ds = DataStore.from_parquet(parquet_path, tables=["SigninLogs"])
+    assert subset_ds.queries == [queries[2]]
+
+
+def test_datastore_facets():
+    """Test facet counts for the current criteria."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(20)]
+    ds = DataStore(queries)
+    tables = [["AuditLogs"], ["AuditLogs", "SigninLogs"], ["SigninLogs"]]
+    for idx, query in enumerate(queries):
+        ds.add_kql_properties(
+            query.query_id, {"tables": tables[idx % 3], "operators": ["where"]}
+        )
+    facets = ds.get_facets()
+    assert facets["tables"] == {"AuditLogs": 14, "SigninLogs": 13}
+    assert facets["valid_query"] == {True: 20}
+    assert set(facets) == {
+        "tactics",
+        "techniques",
+        "tables",
+        "operators",
+        "valid_query",
+    }
+
+    facets = ds.get_facets(["tables", "operators"], tables={"none": ["SigninLogs"]})
+    assert facets == {"tables": {"AuditLogs": 7}, "operators": {"where": 7}}
+    for tactic, count in ds.get_facets(["tactics"])["tactics"].items():
+        assert len(ds.find_queries(tactics=tactic)) == count
+
+    # disjunctive facets ignore the criteria on the facet attribute
+    facets = ds.get_facets(
+        ["tables"],
+        disjunctive=True,
+        tables={"any": ["AuditLogs"]},
+        query_name="query_2",
+    )
+    assert facets == {"tables": {"SigninLogs": 1}}
+    facets = ds.get_facets(["tables"], disjunctive=True, tables={"any": ["AuditLogs"]})
+    assert facets["tables"] == {"AuditLogs": 14, "SigninLogs": 13}
+    empty_facets = ds.get_facets(query_name="no_such_query")
+    assert list(empty_facets) == list(ds.get_facets())
+    assert not any(empty_facets.values())
+
+
+def test_datastore_near_duplicates():
+    """Test near-duplicate clusters and lookup."""
+    base_query = "\n".join(
+        [
+            "SigninLogs",
+            "| where TimeGenerated > ago(1d)",
+            '| where ResultType != "0"',
+            "| summarize FailedCount = count() by UserPrincipalName, IPAddress",
+            "| where FailedCount > 10",
+            "| project UserPrincipalName, IPAddress, FailedCount",
+        ]
+    )
+    query_texts = [
+        base_query,
+        "SecurityEvent | where EventID == 4688 | summarize count() by Computer",
+        "// copied query\n" + base_query.replace("\n", " ").lower(),
+        "AuditLogs | where OperationName has 'Add member' | project TargetResources",
+    ]
+    queries = []
+    for idx, query_text in enumerate(query_texts):
+        query = get_random_query(idx)
+        query["query"] = query_text
+        queries.append(KqlQuery(**query))
+    ds = DataStore(queries)
+    query_ids = [query.query_id for query in queries]
+    assert ds.get_duplicate_clusters() == [[query_ids[0], query_ids[2]]]
+    assert ds.find_near_duplicates(query_ids[0]).index.tolist() == [query_ids[2]]
+    assert ds.find_near_duplicates(query_ids[1]).empty
+
+    # the index is updated with new queries
+    new_query = get_random_query(5)
+    new_query["query"] = query_texts[1] + " // comment"
+    ds.add_queries([KqlQuery(**new_query)])
+    assert ds.get_duplicate_clusters() == [
+        [query_ids[0], query_ids[2]],
+        [query_ids[1], new_query["query_id"]],
+    ]
+
+
+def test_datastore_canonical_hash(tmp_path):
+    """Test canonical hashes and exact duplicate clusters."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(5)]
+    queries[1].query = "// copy\n" + queries[0].query.replace(" | ", "\n|  ")
+    queries[2].query = "SigninLogs | take 1"
+    queries[3].query = "SigninLogs\n| take 1"
+    queries[4].query = "SigninLogs | take 2"
+    ds = DataStore(queries)
+    query_ids = [query.query_id for query in queries]
+    assert ds.queries[0].canonical_hash == ds.queries[1].canonical_hash
+    assert ds.get_exact_duplicate_clusters() == [query_ids[:2], query_ids[2:4]]
+    assert len(ds.find_queries(canonical_hash=queries[2].canonical_hash)) == 2
+
+    replacement = KqlQuery(**get_random_query(3))
+    replacement.query_id = query_ids[3]
+    replacement.query = "SigninLogs | take 3"
+    ds.add_query(replacement)
+    assert ds.get_exact_duplicate_clusters() == [query_ids[:2]]
+
+    # stores saved before canonical_hash was added
+    ds._columns.columns.pop("canonical_hash")
+    ds._columns.column_types.pop("canonical_hash")
+    store_path = tmp_path.joinpath("kql_store.bin")
+    ds.save(store_path)
+    opened_ds = DataStore.open(store_path)
+    assert opened_ds.queries[0].canonical_hash is None
+    assert not opened_ds.get_exact_duplicate_clusters()
+
+
+def test_datastore_similar_queries():
+    """Test similar query search on structural features."""
+    queries = [KqlQuery(**get_random_query(i)) for i in range(4)]
+    for query in queries:
+        query.attributes = {}
+    table_ops = [
+        (["SigninLogs"], ["where", "project"]),
+        (["SigninLogs"], ["where", "summarize"]),
+        (["SecurityEvent"], ["extend"]),
+        (["SigninLogs", "AuditLogs"], ["where", "project"]),
+    ]
+    for query, (tables, operators) in zip(queries, table_ops):
+        query.kql_properties = {"tables": tables, "operators": operators}
+    ds = DataStore(queries)
+    query_ids = [query.query_id for query in queries]
+
+    results = ds.similar_queries(query_ids[0])
+    assert list(results.index) == [query_ids[3], query_ids[1]]
+    assert results["score"].is_monotonic_decreasing
+    assert list(ds.similar_queries(query_ids[0], k=1).index) == [query_ids[3]]
+    assert ds.similar_queries(query_ids[2]).empty
+
+    # the feature matrix is updated with new queries and properties
+    ds.add_kql_properties(query_ids[2], {"Tables": ["SigninLogs"]})
+    new_query = KqlQuery(**get_random_query(4))
+    new_query.attributes = {}
+    new_query.kql_properties = {
+        "tables": ["SigninLogs"],
+        "operators": ["where", "project"],
+    }
+    ds.add_query(new_query)
+    results = ds.similar_queries(query_ids[0], metric="jaccard")
+    assert list(results.index)[:2] == [new_query.query_id, query_ids[3]]
+    assert results.loc[new_query.query_id, "score"] == 1.0
+    assert query_ids[2] in results.index
@@ -0,0 +1,148 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test filter expression parsing and planning."""
+import numpy as np
+import pytest
+
+from .filter_expr import (
+    And,
+    FilterSyntaxError,
+    Not,
+    Or,
+    Predicate,
+    QueryPlan,
+    criteria_to_filter,
+    parse_filter,
+)
+from .inverted_index import Bitmap
+
+__author__ = "Ian Hellen"
+
+
+def test_parse_filter():
+    """Test operator precedence, nesting and values."""
+    expr = parse_filter(
+        'tables has_any ("SigninLogs", "AuditLogs") and not operators has "join"'
+        ' or (query_name =~ "AAD.*" AND source_index != 2)'
+    )
+    assert expr == Or(
+        (
+            And(
+                (
+                    Predicate("tables", "has_any", ("SigninLogs", "AuditLogs")),
+                    Not(Predicate("operators", "has_all", ("join",))),
+                )
+            ),
+            And(
+                (
+                    Predicate("query_name", "matches", "AAD.*"),
+                    Not(Predicate("source_index", "==", 2)),
+                )
+            ),
+        )
+    )
+    assert parse_filter("valid_query == false") == Predicate(
+        "valid_query", "==", False
+    )
+    assert parse_filter("tables has ['A', 'B']") == Predicate(
+        "tables", "has_all", ("A", "B")
+    )
+    assert parse_filter('repo_name in "a/b"') == Predicate("repo_name", "in", ("a/b",))
+    assert parse_filter(r'query matches "\w+ \"x\""') == Predicate(
+        "query", "matches", r'\w+ "x"'
+    )
+    assert str(parse_filter('tables has_all ("A", "B")')) == 'tables has_all ("A", "B")'
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "",
+        "tables",
+        'tables has "A" and',
+        'tables has ("A"',
+        'tables like "A"',
+        'query_name matches ("A", "B")',
+        '(tables has "A"',
+        'tables has "A" "B"',
+        "tables has 'A' $",
+    ],
+)
+def test_parse_filter_errors(text):
+    """Test invalid expressions raise FilterSyntaxError."""
+    with pytest.raises(FilterSyntaxError):
+        parse_filter(text)
+
+
+def test_criteria_to_filter():
+    """Test find_queries keyword criteria are converted to expressions."""
+    expr = criteria_to_filter(
+        {
+            "tables": {"any": ["A", "B"], "none": "C"},
+            "operators": ["where"],
+            "query_name": {"contains": "AAD"},
+            "source_path": "/x/y",
+            "repo_name": ["a/b", "c/d"],
+        },
+        indexed={"tables", "operators"},
+    )
+    assert expr == And(
+        (
+            Predicate("tables", "has_any", ("A", "B")),
+            Not(Predicate("tables", "has_any", ("C",))),
+            Predicate("operators", "has_all", ("where",)),
+            Predicate("query_name", "contains", "AAD"),
+            Predicate("source_path", "==", "/x/y"),
+            Predicate("repo_name", "in", ("a/b", "c/d")),
+        )
+    )
+    assert criteria_to_filter({}, indexed=()) is None
+    with pytest.raises(ValueError):
+        criteria_to_filter({"tables": {"some": ["A"]}}, indexed={"tables"})
+
+
+def test_query_plan():
+    """Test predicate ordering, short-circuiting and explain."""
+    rows = {
+        "a": np.array([0, 1, 2, 3, 4, 5]),
+        "b": np.array([1, 2]),
+        "c": np.array([], dtype=int),
+        "scan": np.array([2, 3, 4]),
+    }
+    evaluated = []
+
+    def estimator(predicate):
+        return predicate.attribute != "scan", len(rows[predicate.attribute])
+
+    def evaluator(predicate, within):
+        evaluated.append((predicate.attribute, within.count()))
+        return Bitmap.from_ids(rows[predicate.attribute], 8)
+
+    expr = parse_filter('scan == 1 and a has "x" and not b has "x"')
+    plan = QueryPlan(expr, estimator, 8)
+    assert plan.explain().splitlines() == [
+        "AND (est. 3 rows)",
+        '  INDEX a has_all ("x") (est. 6 rows)',
+        "  NOT (est. 6 rows)",
+        '    INDEX b has_all ("x") (est. 2 rows)',
+        "  SCAN scan == 1 (est. 3 rows)",
+    ]
+    assert list(plan.execute(evaluator).to_ids()) == [3, 4]
+    # the scan is only evaluated for the rows matching the indexed predicates
+    assert evaluated == [("a", 8), ("b", 6), ("scan", 4)]
+
+    evaluated.clear()
+    plan = QueryPlan(parse_filter('scan == 1 and c has "x"'), estimator, 8)
+    assert not plan.execute(evaluator)
+    assert evaluated == [("c", 8)]
+
+    evaluated.clear()
+    plan = QueryPlan(parse_filter('scan == 1 or b has "x" or a has "x"'), estimator, 8)
+    assert list(plan.execute(evaluator).to_ids()) == [0, 1, 2, 3, 4, 5]
+    assert evaluated == [("a", 8), ("b", 2), ("scan", 2)]
+
+    assert QueryPlan(None, estimator, 8).execute(evaluator).count() == 8
+    assert QueryPlan(None, estimator, 8).explain() == "ALL (est. 8 rows)"
@@ -0,0 +1,131 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test inverted index."""
+import numpy as np
+
+from .inverted_index import (
+    Bitmap,
+    InvertedIndex,
+    intersect_postings,
+    union_postings,
+)
+
+__author__ = "Ian Hellen"
+
+
+def test_inverted_index():
+    """Test index creation and lookups."""
+    index = InvertedIndex.from_pairs(["a", "b", "a", "c", "a", "b"], [0, 0, 2, 3, 4, 4])
+    assert sorted(index.keys()) == ["a", "b", "c"]
+    assert len(index) == 6
+    assert index.get("a").tolist() == [0, 2, 4]
+    assert index.get("missing").tolist() == []
+    assert index.intersect(["a", "b"]).tolist() == [0, 4]
+    assert index.intersect(["a", "missing"]).tolist() == []
+    assert index.union(["b", "c"]).tolist() == [0, 3, 4]
+
+    index.add("c", 1)
+    index.add("c", 1)
+    index.add("d", 5)
+    assert index.get("c").tolist() == [1, 3]
+    assert "d" in index
+
+
+def test_inverted_index_from_pairs():
+    """Test building an index from unsorted pairs and arrays."""
+    index = InvertedIndex.from_pairs(
+        np.array(["b", "a", "b", "a", "b"], dtype=object), np.array([4, 3, 1, 3, 4])
+    )
+    assert index.keys() == ["b", "a"]
+    assert index.get("a").tolist() == [3]
+    assert index.get("b").tolist() == [1, 4]
+    features = InvertedIndex.from_pairs(
+        [("op", "where"), ("op", "where"), 7], [2, 0, 1]
+    )
+    assert features.get(("op", "where")).tolist() == [0, 2]
+    assert features.get(7).tolist() == [1]
+    assert not len(InvertedIndex.from_pairs([], []))
+
+
+def test_posting_merges():
+    """Test intersection and union of posting lists."""
+    first = np.array([1, 3, 5, 7, 9])
+    second = np.array([0, 3, 4, 9, 12])
+    third = np.array([3, 9])
+    assert intersect_postings([first, second, third]).tolist() == [3, 9]
+    assert intersect_postings([first, np.array([], dtype=int)]).tolist() == []
+    assert intersect_postings([]).tolist() == []
+    assert union_postings([third, np.array([2, 3])]).tolist() == [2, 3, 9]
+
+
+def test_bitmap():
+    """Test bitmap set algebra."""
+    size = 11
+    first = Bitmap.from_ids(np.array([0, 3, 5, 10]), size)
+    second = Bitmap.from_ids(np.array([3, 4, 10]), size)
+    assert len(first) == 4
+    assert (first & second).to_ids().tolist() == [3, 10]
+    assert (first | second).to_ids().tolist() == [0, 3, 4, 5, 10]
+    assert (first - second).to_ids().tolist() == [0, 5]
+    assert (~first).to_ids().tolist() == [1, 2, 4, 6, 7, 8, 9]
+    assert len(Bitmap.full(size)) == size
+    assert not Bitmap.empty(size)
+    assert Bitmap.from_mask(first.to_mask()) == first
+
+    index = InvertedIndex.from_pairs(["a", "b", "a", "c"], [0, 0, 2, 3])
+    assert index.match_all(["a", "b"], 4).to_ids().tolist() == [0]
+    assert index.match_any(["b", "c"], 4).to_ids().tolist() == [0, 3]
+
+
+def test_inverted_index_update():
+    """Test merging and removing postings."""
+    index = InvertedIndex.from_pairs(["a", "b", "a"], [0, 1, 2])
+    index.update(InvertedIndex.from_pairs(["a", "c", "b"], [3, 3, 0]))
+    assert index.get("a").tolist() == [0, 2, 3]
+    assert index.get("b").tolist() == [0, 1]
+    assert index.get("c").tolist() == [3]
+    index.remove_rows(np.array([3, 0]))
+    assert index.get("a").tolist() == [2]
+    assert "c" not in index
+
+
+def test_inverted_index_write_buffer():
+    """Test buffered writes are visible before and after merging."""
+    index = InvertedIndex.from_pairs(["a", "b", "a"], [0, 1, 2])
+    index.buffer_size = 100
+    index.add("c", 3)
+    index.set_row(0, ["b", "c"])
+    index.set_row(3, ["a"])
+    assert index.get("a").tolist() == [2, 3]
+    assert index.get("b").tolist() == [0, 1]
+    assert "c" in index
+    assert index.get("c").tolist() == [0]
+    assert sorted(index.keys()) == ["a", "b", "c"]
+    assert index.match_all(["a"], 4).to_ids().tolist() == [2, 3]
+    index.merge()
+    assert index.get("a").tolist() == [2, 3]
+    assert index.get("c").tolist() == [0]
+    assert len(index) == 5
+
+    index.buffer_size = 2
+    index.set_row(2, [])
+    index.set_row(1, ["a"])
+    assert not index._buffered
+    assert index.get("a").tolist() == [1, 3]
+
+
+def test_value_counts():
+    """Test value counts of all rows and masked rows."""
+    index = InvertedIndex.from_pairs(["a", "a", "b", "c", "c", "c"], [0, 1, 1, 0, 2, 3])
+    assert index.value_counts() == {"a": 2, "b": 1, "c": 3}
+    mask = np.array([False, True, False, True])
+    assert index.value_counts(mask) == {"a": 1, "b": 1, "c": 1}
+    index.add("b", 3)
+    assert index.value_counts(mask) == {"a": 1, "b": 2, "c": 1}
+    index.remove_rows(np.array([1]))
+    assert index.value_counts(mask) == {"b": 1, "c": 1}
+    restored = InvertedIndex.from_buffers(index.to_buffers())
+    assert restored.value_counts(mask) == {"b": 1, "c": 1}
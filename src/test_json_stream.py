@@ -0,0 +1,50 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test streaming JSON reader and writer."""
+import io
+import json
+
+import pytest
+
+from . import json_stream
+from .json_stream import dump_json_records, read_json_records, write_json_records
+
+__author__ = "Ian Hellen"
+
+_RECORDS = [
+    {"query": 'SecurityAlert | where Title has "[x], {y}"', "index": idx}
+    for idx in range(20)
+]
+
+
+@pytest.mark.parametrize("ndjson", [False, True])
+@pytest.mark.parametrize("chunk_size", [1, 7, 1 << 16])
+def test_read_records(monkeypatch, ndjson, chunk_size):
+    """Test reading records split across chunks."""
+    monkeypatch.setattr(json_stream, "_CHUNK_SIZE", chunk_size)
+    json_text = dump_json_records(_RECORDS, ndjson=ndjson)
+    if not ndjson:
+        assert json.loads(json_text) == _RECORDS
+    assert list(read_json_records(io.StringIO(json_text))) == _RECORDS
+    assert list(read_json_records(io.StringIO(" [ ] "))) == []
+    assert list(read_json_records(io.StringIO(""))) == []
+
+
+@pytest.mark.parametrize("file_name", ["queries.json", "queries.json.gz"])
+@pytest.mark.parametrize("ndjson", [False, True])
+def test_read_write_files(tmp_path, file_name, ndjson):
+    """Test writing and reading plain and gzip files."""
+    file_path = tmp_path.joinpath(file_name)
+    write_json_records(iter(_RECORDS), file_path, ndjson=ndjson)
+    assert (file_path.read_bytes()[:2] == b"\x1f\x8b") == file_name.endswith(".gz")
+    assert list(read_json_records(file_path)) == _RECORDS
+    assert list(read_json_records(str(file_path))) == _RECORDS
+
+
+def test_read_invalid_json():
+    """Test that malformed JSON raises an error."""
+    with pytest.raises(json.JSONDecodeError):
+        list(read_json_records(io.StringIO('[{"query": "x"}, {"query": ]')))
@@ -5,6 +5,7 @@
 # --------------------------------------------------------------------------
 """Test kql extraction integration."""
 
+import sys
 from datetime import datetime, timezone
 from pathlib import Path
 
@@ -22,6 +23,31 @@ __author__ = "Ian Hellen"
 
 _TEST_KQL = Path(__file__).parent.joinpath("test_data")
 
+# stand-in for the KqlExtraction process - the same input and output format
+# the results of "hold" queries are written after the next "release" query
+_FAKE_EXTRACTOR = """
+import base64, json, sys
+
+held = []
+for line in sys.stdin:
+    query_id, kql = line.strip().split(",", 1)
+    kql = base64.b64decode(kql).decode("utf-8")
+    if "syntax error" in kql:
+        output = ["[!] Error: Syntax Error(s)", "  > [0:6] Unexpected token"]
+    elif "exit" in kql:
+        sys.exit(1)
+    else:
+        output = [json.dumps({"Id": query_id, "Tables": [kql.split()[0]]})]
+    if "hold" in kql:
+        held.extend(output)
+        continue
+    if "release" in kql:
+        output.extend(held)
+        held = []
+    print("\\n".join(output))
+    sys.stdout.flush()
+"""
+
 
 @pytest.fixture
 def get_queries_with_kql():
@@ -61,3 +87,110 @@ def test_extract_from_ds_query(get_queries_with_kql):
     assert all(item in ds._indexes for item in ["tactics", "tables", "operators"])
     assert len(ds._indexes["tables"]) >= len(ds.queries)
     assert len(ds._indexes["operators"]) >= len(ds.queries)
+
+
+@pytest.fixture
+def fake_extractor(tmp_path):
+    script = tmp_path.joinpath("fake_extractor.py")
+    script.write_text(_FAKE_EXTRACTOR, encoding="utf-8")
+    return [sys.executable, str(script)]
+
+
+def test_extractor_pool(fake_extractor):
+    """Test parallel extraction with a pool of extractor processes."""
+    queries = [(f"id{idx}", f"Table{idx} | take 1") for idx in range(40)]
+    queries[5] = ("id5", "syntax error |")
+    with extract.ExtractorPool(n_workers=4, command=fake_extractor) as pool:
+        results = list(pool.extract_all(queries))
+        assert 1 < pool.active_workers <= 4
+        # the diagnostic lines of a syntax error are not read as a result
+        assert pool.extract_kql("SecurityAlert | take 1", query_id="q1") == {
+            "Id": "q1",
+            "Tables": ["SecurityAlert"],
+        }
+    assert [query_id for query_id, _ in results] == [
+        query_id for query_id, _ in queries
+    ]
+    assert results[0][1] == {"Id": "id0", "Tables": ["Table0"]}
+    assert results[5][1] == extract._syntax_err_result("id5")
+    assert pool.active_workers == 0
+
+
+def test_extractor_pool_errors(fake_extractor):
+    """Test that failed queries are skipped and the process is restarted."""
+    queries = [("id0", "Table0"), ("id1", "exit"), ("id2", "Table2")]
+    with extract.ExtractorPool(n_workers=1, command=fake_extractor) as pool:
+        assert [query_id for query_id, _ in pool.extract_all(queries)] == [
+            "id0",
+            "id2",
+        ]
+        with pytest.raises(EOFError):
+            pool.extract_kql("exit")
+        assert pool.extract_kql("Table3", query_id="id3")["Tables"] == ["Table3"]
+    with pytest.raises(RuntimeError):
+        pool.extract_kql("Table4")
+
+
+def test_extraction_client_pipelined(fake_extractor):
+    """Test many requests in flight to one extractor process."""
+    with extract.KqlExtractionClient(command=fake_extractor) as client:
+        held = [client.submit(f"Table{idx} hold", query_id="q") for idx in range(3)]
+        # the held queries are answered after a later query is sent
+        assert not any(future.done() for future in held)
+        assert client.in_flight == 3
+        assert client.extract_kql("Table3 release", query_id="q3") == {
+            "Id": "q3",
+            "Tables": ["Table3"],
+        }
+        assert [future.result()["Tables"] for future in held] == [
+            ["Table0"],
+            ["Table1"],
+            ["Table2"],
+        ]
+        # duplicate query_ids are matched to the request that sent them
+        assert all(future.result()["Id"] == "q" for future in held)
+
+        queries = [("id0", "Table0 hold"), ("id1", "Table1")]
+        queries += [("id2", "Table2 hold"), ("id3", "Table3 release")]
+        results = list(client.extract_many(queries))
+        # results are returned in completion order
+        assert [query_id for query_id, _ in results] == ["id1", "id3", "id0", "id2"]
+        assert dict(results)["id2"] == {"Id": "id2", "Tables": ["Table2"]}
+        # syntax errors (which have no Id) are matched by the request order
+        futures = [client.submit(kql) for kql in ("syntax error |", "Table1")]
+        assert futures[0].result()["Valid_query"] is False
+        assert futures[1].result()["Tables"] == ["Table1"]
+
+        # requests pending when the process exits are sent to a new process
+        futures = [client.submit(kql) for kql in ("Table0", "exit", "Table2")]
+        with pytest.raises(EOFError):
+            futures[1].result()
+        assert futures[0].result()["Tables"] == ["Table0"]
+        assert futures[2].result()["Tables"] == ["Table2"]
+    assert client.in_flight == 0
+    with pytest.raises(RuntimeError):
+        client.submit("Table4")
+
+
+def test_extract_kql_timeout(fake_extractor, monkeypatch):
+    """Test that the module extract_kql returns an empty dict on timeout."""
+    with extract.KqlExtractionClient(command=fake_extractor) as client:
+        monkeypatch.setattr(extract, "_client", client)
+        assert extract.extract_kql("Table0", query_id="q0")["Tables"] == ["Table0"]
+        # the result of a held query is not written until a later query
+        assert extract.extract_kql("Table1 hold", query_id="q1", timeout=0.2) == {}
+        assert extract.extract_kql("Table2 release")["Tables"] == ["Table2"]
+        assert extract.extract_kql("exit") == {}
+
+
+def test_extraction_client_failed_starts(tmp_path):
+    """Test that pending requests fail if the process cannot start."""
+    starts = tmp_path.joinpath("starts.txt")
+    # exits without output after the requests have been written
+    script = f"import time; time.sleep(0.2); open({str(starts)!r}, 'a').write('.')"
+    with extract.KqlExtractionClient(command=[sys.executable, "-c", script]) as client:
+        futures = [client.submit(f"Table{idx}") for idx in range(10)]
+        for future in futures:
+            with pytest.raises(EOFError):
+                future.result(timeout=10)
+    assert starts.read_text(encoding="utf-8") == "." * client._MAX_FAILED_STARTS
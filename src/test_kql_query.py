@@ -1,4 +1,8 @@
-from .kql_query import KqlQuery
+import uuid
+
+import pytest
+
+from .kql_query import KqlQuery, get_canonical_hash, get_query_id
 
 
 def test_kql_query():
@@ -14,3 +18,85 @@ def test_kql_query():
     KqlQuery.kql_list_to_json([kql, kql])
 
     KqlQuery.kql_list_to_df([kql, kql])
+
+
+def test_kql_query_from_record():
+    """Test the trusted record constructor and shallow records."""
+    kql = KqlQuery(
+        source_path="https://github.com/a/b/file.kql",
+        query="SecurityAlert | take 1",
+        attributes={"tactics": ["Persistence"]},
+    )
+    assert not hasattr(kql, "__dict__")
+    assert kql.repo_name == "a/b"
+    assert kql.query_name == "file.kql"
+
+    record = kql.to_record()
+    assert record == kql.asdict()
+    assert record["attributes"] is kql.attributes
+    assert KqlQuery.from_record(record) == kql
+
+    # stored derived fields are used as they are
+    trusted = KqlQuery.from_record(
+        {**record, "query_hash": "stored", "repo_name": None}
+    )
+    assert trusted.query_hash == "stored"
+    assert trusted.repo_name is None
+    # missing derived fields are created
+    derived = KqlQuery.from_record(
+        {"source_path": "https://github.com/a/b/file.kql", "query": kql.query}
+    )
+    assert derived.query_hash == kql.query_hash
+    assert derived.repo_name == "a/b"
+    assert derived.query_name == "file.kql"
+    assert derived.attributes == {} and derived.query_id
+    derived.query = "SecurityEvent"
+    assert derived.query_hash != kql.query_hash
+
+    with pytest.raises(TypeError):
+        KqlQuery.from_record({**record, "unknown": 1})
+    with pytest.raises(TypeError):
+        KqlQuery.from_record({"query": "SecurityAlert"})
+
+
+def test_kql_query_id():
+    """Test that query_ids are derived from the source path and index."""
+    path = "https://github.com/a/b/file.md"
+    first = KqlQuery(source_path=path, query="SecurityAlert", source_index=1)
+    changed = KqlQuery(source_path=path, query="SecurityEvent", source_index=1)
+    assert first.query_id == changed.query_id == get_query_id(path, 1)
+    assert first.query_hash != changed.query_hash
+    assert uuid.UUID(first.query_id).version == 5
+    assert KqlQuery(source_path=path, query="SecurityAlert").query_id != first.query_id
+    assert KqlQuery(source_path=path, query="x", query_id="id1").query_id == "id1"
+    assert KqlQuery.from_record({"source_path": path, "query": "x"}).query_id == (
+        get_query_id(path)
+    )
+
+
+def test_kql_query_canonical_hash():
+    """Test canonical hashes of reformatted queries."""
+    path = "https://github.com/a/b/file.md"
+    queries = [
+        KqlQuery(source_path=path, query="SecurityAlert | take 1", source_index=0),
+        KqlQuery(
+            source_path=path, query="SecurityAlert\n|  Take 1 // one", source_index=1
+        ),
+        KqlQuery(source_path=path, query="SecurityAlert | take 2", source_index=2),
+        KqlQuery(source_path=path, query="SecurityAlert | take 1", source_index=3),
+    ]
+    assert all(query.canonical_hash is None for query in queries)
+    KqlQuery.set_canonical_hashes(queries)
+    assert queries[0].canonical_hash == get_canonical_hash("SecurityAlert | take 1")
+    assert queries[0].canonical_hash == queries[1].canonical_hash
+    assert queries[0].canonical_hash == queries[3].canonical_hash
+    assert queries[0].canonical_hash != queries[2].canonical_hash
+    assert queries[0].query_hash != queries[1].query_hash
+
+    # the hash is reset by changes to the query and kept by from_record
+    record = queries[0].to_record()
+    assert KqlQuery.from_record(record).canonical_hash == queries[0].canonical_hash
+    queries[0].query = "SecurityAlert | take 2"
+    assert queries[0].canonical_hash is None
+    KqlQuery.set_canonical_hashes(queries)
+    assert queries[0].canonical_hash == queries[2].canonical_hash
@@ -0,0 +1,99 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test near-duplicate query detection."""
+import numpy as np
+import pytest
+
+from .near_duplicates import NearDuplicateIndex, get_shingles
+
+__author__ = "Ian Hellen"
+
+_QUERY = """
+SigninLogs
+| where TimeGenerated > ago(1d)
+| where ResultType != "0"
+| summarize FailedCount = count() by UserPrincipalName, IPAddress
+| where FailedCount > 10
+| project UserPrincipalName, IPAddress, FailedCount
+"""
+
+_EDITED_QUERY = """// Failed sign-ins by user
+signinlogs | WHERE TimeGenerated > ago(1d) | where ResultType != "0"
+| summarize FailedCount = count() by UserPrincipalName, IPAddress
+| where FailedCount > 10 // threshold
+| project UserPrincipalName, IPAddress, FailedCount
+"""
+
+_CHANGED_QUERY = _QUERY + "| order by FailedCount\n"
+
+_OTHER_QUERY = """
+SecurityEvent
+| where EventID == 4688
+| extend ProcessName = tolower(NewProcessName)
+| summarize count() by Computer, ProcessName
+"""
+
+
+def test_get_shingles():
+    """Test shingles ignore layout, case and comments but not strings."""
+    assert get_shingles(_QUERY) == get_shingles(_EDITED_QUERY)
+    assert get_shingles(_QUERY) != get_shingles(_QUERY.replace('"0"', '"O"'))
+    assert get_shingles("T | take 1", size=5) == {"t | take 1"}
+    assert len(get_shingles("T | where A == 1", size=2)) == 6
+    assert get_shingles("T | where A == 1") != get_shingles("T | where A != 1")
+    assert get_shingles("") == set()
+    assert get_shingles(None) == set()
+
+
+def test_near_duplicate_index():
+    """Test near duplicates are found and distinct queries are not."""
+    index = NearDuplicateIndex()
+    for row_id, query in enumerate(
+        [_QUERY, _OTHER_QUERY, _EDITED_QUERY, _CHANGED_QUERY, ""]
+    ):
+        index.add(row_id, query)
+    assert len(index) == 4
+    assert index.similarity(0, [2])[0] == 1.0
+    assert index.near_duplicates(0).tolist() == [2, 3]
+    assert index.near_duplicates(1).tolist() == []
+    assert index.near_duplicates(4).tolist() == []
+    assert index.clusters() == [[0, 2, 3]]
+
+    # replace and remove rows
+    index.add(3, _OTHER_QUERY)
+    assert index.clusters() == [[0, 2], [1, 3]]
+    index.remove(0)
+    assert index.clusters() == [[1, 3]]
+    assert index.near_duplicates(2).tolist() == []
+    index.add(5, _EDITED_QUERY)
+    assert index.clusters() == [[1, 3], [2, 5]]
+
+
+def test_near_duplicate_clusters_pairs():
+    """Test near duplicates in a bucket are found for all pairs of members."""
+    index = NearDuplicateIndex(threshold=0.75, num_perm=8, bands=2)
+    # the first bands are identical, so all of the rows share a bucket
+    signatures = {
+        "a": [0, 0, 0, 0, 1, 2, 3, 4],
+        "b": [0, 0, 0, 0, 5, 6, 7, 8],
+        "c": [0, 0, 0, 0, 5, 6, 7, 9],
+    }
+    index.signature = lambda query: np.array(signatures[query], dtype=np.uint32)
+    for row_id, query in enumerate(signatures):
+        index.add(row_id, query)
+    # b and c are near duplicates but neither is similar to a
+    assert index.similarity(1, [2])[0] == 0.875
+    assert index.near_duplicates(0).tolist() == []
+    assert index.clusters() == [[1, 2]]
+
+
+def test_near_duplicate_index_params():
+    """Test the index parameters are validated."""
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(num_perm=100, bands=16)
+    index = NearDuplicateIndex(threshold=0.5, num_perm=64, bands=8)
+    assert len(index.signature(_QUERY)) == 64
+    assert index.signature("// comment only") is None
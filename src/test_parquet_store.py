@@ -0,0 +1,125 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test Parquet import and export."""
+import pytest
+
+from .parquet_store import (
+    _get_row_groups,
+    _get_scan_filter,
+    iter_parquet,
+    read_parquet,
+    write_parquet,
+)
+
+__author__ = "Ian Hellen"
+
+pds = pytest.importorskip("pyarrow.dataset")
+
+# pylint: disable=protected-access
+
+_RECORDS = [
+    {
+        "source_path": f"https://github.com/a/b/query_{idx}.kql",
+        "query": f"Table{idx % 2} | take {idx}",
+        "source_index": idx,
+        "query_name": f"Query {idx}",
+        "attributes": {
+            "tactics": ["Persistence"] if idx % 2 else ["Execution", "Discovery"],
+            "description": f"desc {idx}",
+        },
+        "kql_properties": {
+            "tables": [f"Table{idx % 2}"],
+            "operators": ["take"] if idx % 3 else ["take", "where"],
+            "valid_query": True,
+        },
+        "query_id": str(idx),
+    }
+    for idx in range(12)
+]
+
+
+@pytest.fixture(name="parquet_path")
+def fixture_parquet_path(tmp_path):
+    """Return the path of a Parquet file with the test records."""
+    file_path = tmp_path.joinpath("queries.parquet")
+    write_parquet(iter(_RECORDS), file_path, row_group_size=5)
+    return file_path
+
+
+def test_round_trip(parquet_path):
+    """Test that records round trip."""
+    records = list(iter_parquet(parquet_path))
+    assert len(records) == 12
+    for record, expected in zip(records, _RECORDS):
+        for name, value in expected.items():
+            assert record[name] == value
+
+
+def test_projection(parquet_path):
+    """Test reading a subset of columns."""
+    records_df = read_parquet(parquet_path, columns=["query_id", "kql_properties"])
+    assert list(records_df.columns) == ["query_id", "kql_properties"]
+    assert records_df.iloc[0]["kql_properties"] == _RECORDS[0]["kql_properties"]
+    records_df = read_parquet(parquet_path, columns=["query_id"], tactics="Discovery")
+    assert list(records_df["query_id"]) == ["0", "2", "4", "6", "8", "10"]
+    records_df = read_parquet(parquet_path, columns=["tables", "tactics"])
+    assert records_df.iloc[1]["tables"] == ["Table1"]
+    assert records_df.iloc[1]["tactics"] == ["Persistence"]
+
+
+@pytest.mark.parametrize(
+    "criteria, expected",
+    [
+        ({"query_id": "3"}, ["3"]),
+        ({"source_index": 11}, ["11"]),
+        ({"query_name": "QUERY 3"}, ["3"]),
+        ({"query_name": "QUERY 3", "case": True}, []),
+        ({"query_name": "Query 3", "case": True}, ["3"]),
+        ({"query_name": ["QUERY 3", "query 10", "Query 99"]}, ["3", "10"]),
+        ({"query_name": ["QUERY 3", "Query 10"], "case": True}, ["10"]),
+        ({"source_index": [2, 11]}, ["2", "11"]),
+        ({"query_name": []}, []),
+        ({"query_name": {"matches": "query 1.*"}}, ["1", "10", "11"]),
+        ({"query_name": {"matches": "query 1.*"}, "case": True}, []),
+        ({"query": {"endswith": "take 1"}}, ["1"]),
+        ({"tables": ["Table1"], "operators": {"any": ["where"]}}, ["3", "9"]),
+        ({"tactics": {"none": ["Persistence", "Discovery"]}}, []),
+        ({"tactics": {"all": ["Execution", "Discovery"]}, "query_id": "4"}, ["4"]),
+        ({"query_id": "99"}, []),
+    ],
+)
+def test_pushdown(parquet_path, criteria, expected):
+    """Test criteria filtering."""
+    records = iter_parquet(parquet_path, columns=["query_id"], **criteria)
+    assert [record["query_id"] for record in records] == expected
+
+
+def test_case_insensitive_pushdown(tmp_path):
+    """Test row groups are skipped for case-insensitive exact matches."""
+    records = [
+        {**_RECORDS[0], "query_name": f"Query {idx:03d}", "query_id": str(idx)}
+        for idx in range(100)
+    ]
+    file_path = tmp_path.joinpath("queries.parquet")
+    write_parquet(iter(records), file_path, row_group_size=10)
+    dataset = pds.dataset(str(file_path), format="parquet")
+    for criteria, expected in [
+        ({"query_name": "QUERY 042"}, 1),
+        ({"query_name": ["query 042", "QUERY 093"]}, 2),
+        ({"query_name": "Query 1000"}, 0),
+    ]:
+        scan_filter, _, folded_values = _get_scan_filter(criteria, case=False)
+        assert len(_get_row_groups(dataset, scan_filter, folded_values)) == expected
+    records = iter_parquet(file_path, ["query_id"], query_name="qUERY 042")
+    assert [record["query_id"] for record in records] == ["42"]
+
+
+def test_invalid_criteria(parquet_path):
+    """Test unknown fields and operators."""
+    with pytest.raises(ValueError):
+        list(iter_parquet(parquet_path, not_a_field="x"))
+    with pytest.raises(ValueError):
+        list(iter_parquet(parquet_path, tables={"some": ["Table1"]}))
@@ -0,0 +1,100 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test lazy find_queries result sets."""
+import pytest
+
+from .data_store import DataStore
+from .kql_query import KqlQuery
+from .result_set import ResultSet
+from .test_data_store import get_random_query
+
+__author__ = "Ian Hellen"
+
+# pylint: disable=redefined-outer-name
+
+_NAMES = ["delta", "alpha", "echo", "charlie", "bravo", "alpha"]
+
+
+@pytest.fixture
+def data_store():
+    queries = []
+    for idx, name in enumerate(_NAMES):
+        query = KqlQuery(**get_random_query(idx))
+        query.query_name = name
+        query.source_index = idx % 3
+        query.repo_name = f"repo/{name}"
+        query.attributes["tactics"] = ["Compromise"]
+        queries.append(query)
+    queries[4].repo_name = None
+    return DataStore(queries)
+
+
+def test_result_set_paging(data_store):
+    """Test limit, offset and paging of results."""
+    results = data_store.find_queries(tactics=["Compromise"])
+    assert isinstance(results, ResultSet)
+    assert len(results) == results.total == 6
+    assert list(results["query_name"]) == _NAMES
+    assert list(results.limit(2)["query_name"]) == _NAMES[:2]
+    assert list(results.offset(4)["query_name"]) == _NAMES[4:]
+    assert list(results.page(1, 4)["query_name"]) == _NAMES[4:]
+    assert list(results.offset(1).limit(2).limit(5)["query_name"]) == _NAMES[1:3]
+    assert results.offset(10).empty
+    assert len(results.offset(10).to_df()) == 0
+    assert data_store.find_queries(query_name="zulu").empty
+
+
+def test_result_set_order_by(data_store):
+    """Test full and top-k ordering."""
+    results = data_store.find_queries(tactics=["Compromise"])
+    ordered = results.order_by("query_name")
+    assert list(ordered["query_name"]) == sorted(_NAMES)
+    assert list(ordered.limit(3)["query_name"]) == ["alpha", "alpha", "bravo"]
+    assert list(ordered.page(1, 2)["query_name"]) == ["bravo", "charlie"]
+    descending = results.order_by("query_name", ascending=False).limit(2)
+    assert list(descending["query_name"]) == ["echo", "delta"]
+
+    # ties are broken by the next ordering, then by store order
+    by_index = results.order_by("source_index", ascending=False)
+    assert list(by_index["query_name"]) == [
+        "echo",
+        "alpha",
+        "alpha",
+        "bravo",
+        "delta",
+        "charlie",
+    ]
+    two_keys = results.order_by("source_index").order_by("query_name", False)
+    assert list(two_keys["query_name"]) == [
+        "delta",
+        "charlie",
+        "bravo",
+        "alpha",
+        "echo",
+        "alpha",
+    ]
+    # missing values are last
+    assert results.order_by("repo_name").index[-1] == results.index[4]
+    with pytest.raises(ValueError):
+        results.order_by("not_a_column")
+    with pytest.raises(ValueError):
+        list(results.order_by("attributes").index)
+
+
+def test_result_set_select(data_store):
+    """Test column projection."""
+    results = data_store.find_queries(query_name={"startswith": "a"})
+    results_df = results.select("query_name", "source_path").to_df()
+    assert list(results_df.columns) == ["source_path", "query_name"]
+    assert list(results_df.index) == list(results.index)
+    assert results.columns == [
+        name for name in KqlQuery.field_names() if name != "query_id"
+    ]
+    full_df = results.to_df()
+    assert list(full_df.columns) == results.columns
+    assert full_df.index.name == "query_id"
+    with pytest.raises(ValueError):
+        results.select("not_a_column")
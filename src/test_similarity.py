@@ -0,0 +1,54 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test structural similarity feature matrix."""
+import numpy as np
+import pytest
+
+from .similarity import FeatureMatrix
+
+__author__ = "Ian Hellen"
+
+_ROWS = [
+    [("tables", "SigninLogs"), ("operators", "where"), ("operators", "project")],
+    [("tables", "SigninLogs"), ("operators", "where")],
+    [("tables", "AuditLogs"), ("operators", "where"), ("operators", "project")],
+    [("tables", "SecurityEvent")],
+    [],
+]
+
+
+def test_feature_matrix_similar():
+    """Test cosine and Jaccard scoring of rows."""
+    matrix = FeatureMatrix.from_rows(_ROWS)
+    assert len(matrix) == 5
+    assert matrix.num_features == 5
+
+    row_ids, scores = matrix.similar(0)
+    assert list(row_ids) == [1, 2]
+    np.testing.assert_allclose(scores, [2 / np.sqrt(6), 2 / 3])
+    row_ids, scores = matrix.similar(0, metric="jaccard")
+    assert list(row_ids) == [1, 2]
+    np.testing.assert_allclose(scores, [2 / 3, 2 / 4])
+    assert list(matrix.similar(0, top_k=1)[0]) == [1]
+    assert not len(matrix.similar(3)[0])
+    assert not len(matrix.similar(4)[0])
+    with pytest.raises(ValueError):
+        matrix.similar(0, metric="euclidean")
+
+
+def test_feature_matrix_set_row():
+    """Test incremental row updates."""
+    matrix = FeatureMatrix()
+    for row_id, features in enumerate(_ROWS):
+        matrix.set_row(row_id, features)
+    assert list(matrix.similar(0)[0]) == [1, 2]
+    matrix.set_row(1, [("tables", "SecurityEvent")])
+    matrix.set_row(6, _ROWS[0])
+    assert len(matrix) == 7
+    row_ids, scores = matrix.similar(0)
+    assert list(row_ids) == [6, 2]
+    assert scores[0] == pytest.approx(1.0)
+    assert list(matrix.similar(3)[0]) == [1]
@@ -0,0 +1,129 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test SQLite query store."""
+import json
+import random
+
+import pandas as pd
+import pytest
+
+from .data_store import DataStore
+from .kql_query import KqlQuery
+from .sqlite_store import SqliteDataStore
+from .test_data_store import get_random_items, get_random_query, json_kql_parse
+
+__author__ = "Ian Hellen"
+
+# pylint: disable=redefined-outer-name
+
+
+@pytest.fixture(scope="module")
+def stores():
+    """Return a DataStore and SqliteDataStore with the same queries."""
+    random.seed(42)
+    queries = [KqlQuery(**get_random_query(i)) for i in range(40)]
+    kql_props = json.loads(json_kql_parse)
+    data_store = DataStore(queries)
+    sqlite_store = SqliteDataStore(kql_queries=queries)
+    for query in queries:
+        query_props = {**kql_props, "Tables": get_random_items(count=2)}
+        data_store.add_kql_properties(query.query_id, query_props)
+        sqlite_store.add_kql_properties(query.query_id, query_props)
+    return data_store, sqlite_store
+
+
+@pytest.mark.parametrize(
+    "criteria",
+    [
+        {},
+        {"query_name": "query_3"},
+        {"query_name": "QUERY_3"},
+        {"query_name": "QUERY_3", "case": True},
+        {"query_name": ["query_1", "query_2"]},
+        {"source_index": 3},
+        {"query_name": {"matches": "QUERY_1.*"}},
+        {"query_name": {"matches": "QUERY_1.*"}, "case": True},
+        {"source_path": {"endswith": "/2"}},
+        {"tactics": ["Compromise", "Exploitation"]},
+        {"tactics": {"any": ["LateralMovement"], "none": ["Compromise"]}},
+        {"techniques": "T1025", "operators": ["mv-expand"]},
+        {"joins": {"all": ["leftouter"]}, "valid_query": True},
+        {"tables": {"any": ["AADRiskyUsers", "AuditLogs", "DeviceInfo"]}},
+        {"where": 'tactics has "Compromise" and not query_name =~ "query_1.*"'},
+        {"where": 'query_name in ("QUERY_2", "query_4") or tables has "AuditLogs"'},
+        {"where": 'not source_path endswith "/2"', "tactics": "Exploitation"},
+    ],
+)
+def test_find_queries(stores, criteria):
+    """Test find_queries matches DataStore."""
+    data_store, sqlite_store = stores
+    expected = data_store.find_queries(**criteria)
+    results = sqlite_store.find_queries(**criteria)
+    assert list(results.index) == list(expected.index)
+    assert list(results.columns) == list(expected.columns)
+    expected_df = expected.order_by("query_name", ascending=False).limit(5).to_df()
+    pd.testing.assert_frame_equal(
+        results.order_by("query_name", ascending=False).limit(5).to_df(),
+        expected_df,
+        # the column types of empty results are not inferred
+        check_dtype=not expected_df.empty,
+    )
+
+
+def test_sqlite_store_api(stores):
+    """Test the other DataStore methods."""
+    data_store, sqlite_store = stores
+    assert len(sqlite_store) == len(data_store)
+    assert sqlite_store.queries == data_store.queries
+    assert sqlite_store.get_filter_lists() == data_store.get_filter_lists()
+    assert sqlite_store.get_filter_lists(["valid_query"]) == {"valid_query": [True]}
+    pd.testing.assert_frame_equal(sqlite_store.to_df(), data_store.to_df())
+    pd.testing.assert_frame_equal(
+        sqlite_store.get_query_ids(), data_store.get_query_ids()
+    )
+    assert json.loads(sqlite_store.to_json()) == data_store.queries_dict
+    with pytest.raises(ValueError):
+        sqlite_store.find_queries(not_a_field="x")
+    with pytest.raises(ValueError):
+        sqlite_store.find_queries(tables={"some": ["AuditLogs"]})
+    with pytest.raises(ValueError):
+        sqlite_store.find_queries(where='query_name has "x"')
+    plan = sqlite_store.explain(where='tables has "AuditLogs"', query_name="query_1")
+    assert "KqlQuery" in plan
+
+
+def test_sqlite_store_file(tmp_path):
+    """Test persistence, replacing queries and full text search."""
+    raw_queries = [get_random_query(i) for i in range(3)]
+    raw_queries[0]["query"] = "DeviceProcessEvents | where ProcessCommandLine has 'cmd'"
+    raw_queries[1]["context"] = "Hunting with DeviceProcessEvents"
+    queries = [KqlQuery(**query) for query in raw_queries]
+    db_path = tmp_path.joinpath("queries.db")
+    with SqliteDataStore(db_path, kql_queries=queries) as sqlite_store:
+        results = sqlite_store.search_text("DeviceProcessEvents ProcessCommandLine")
+        assert list(results["query_name"]) == ["query_0", "query_1"]
+        assert results["score"].is_monotonic_decreasing
+        assert sqlite_store.search_text("NotATerm").empty
+
+    with SqliteDataStore(db_path) as sqlite_store:
+        assert sqlite_store.queries == queries
+        replaced = KqlQuery(**{**queries[0].asdict(), "query": "AuditLogs"})
+        sqlite_store.add_query(replaced)
+        assert len(sqlite_store) == 3
+        assert sqlite_store.search_text("DeviceProcessEvents")[
+            "query_name"
+        ].tolist() == ["query_1"]
+        assert sqlite_store.queries[0].query == "AuditLogs"
+
+
+@pytest.mark.parametrize("disjunctive", [False, True])
+def test_get_facets(stores, disjunctive):
+    """Test facet counts match DataStore."""
+    data_store, sqlite_store = stores
+    criteria = {"tables": {"any": ["AuditLogs", "DeviceInfo"]}, "query_name": "query_1"}
+    for search in ({}, criteria, {"tactics": ["Compromise"]}):
+        expected = data_store.get_facets(disjunctive=disjunctive, **search)
+        assert sqlite_store.get_facets(disjunctive=disjunctive, **search) == expected
@@ -0,0 +1,81 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test full text index."""
+from .text_index import TextIndex, normalize_kql, tokenize_kql
+
+__author__ = "Ian Hellen"
+
+_QUERIES = [
+    """DeviceProcessEvents
+| where ProcessCommandLine has_any ("cmd.exe", "powershell")
+| mv-expand Tags // expand the tags
+| project-away Tags""",
+    "SigninLogs | where ResultType != 0 | summarize count() by UserPrincipalName",
+    "DeviceProcessEvents | where FileName =~ 'net.exe' | take 10",
+    "SecurityAlert | take 1",
+]
+
+
+def test_tokenize_kql():
+    """Test KQL tokenizer."""
+    terms = tokenize_kql(_QUERIES[0])
+    assert "deviceprocessevents" in terms
+    assert "has_any" in terms
+    assert "mv-expand" in terms
+    assert "project-away" in terms
+    assert "cmd.exe" in terms
+    assert "cmd" in terms and "exe" in terms
+    assert "expand" in terms
+    assert "|" not in terms
+    assert tokenize_kql(None) == []
+    assert "!contains" in tokenize_kql("T | where A !contains 'x'")
+    assert "in~" in tokenize_kql("T | where A in~ ('x')")
+
+
+def test_normalize_kql():
+    """Test canonical KQL normalization."""
+    canonical = (
+        "DeviceProcessEvents"
+        ' | where ProcessCommandLine has_any ("cmd.exe", "powershell")'
+        " | mv-expand Tags | project-away Tags"
+    )
+    assert normalize_kql(_QUERIES[0]) == canonical
+    reformatted = """// header comment
+DeviceProcessEvents|Where   ProcessCommandLine has_any ("cmd.exe", "powershell")
+    | MV-EXPAND Tags
+    |project-away Tags  """
+    assert normalize_kql(reformatted) == canonical
+    # string literals, identifiers and spacing between tokens are kept
+    assert normalize_kql("T | where A == 'x  y'") != normalize_kql(
+        "T | where A == 'X  y'"
+    )
+    assert normalize_kql("T | where a == 1") != normalize_kql("T | where A == 1")
+    assert normalize_kql("T | where Where == 1") == "T | where Where == 1"
+    assert normalize_kql("T | where a-b == 1") != normalize_kql("T | where a - b == 1")
+    assert normalize_kql('T | where A == "x') == 'T | where A == "x'
+    assert normalize_kql(None) == normalize_kql("  // only a comment") == ""
+
+
+def test_text_index_search():
+    """Test BM25 search and updates."""
+    index = TextIndex()
+    for row_id, query in enumerate(_QUERIES):
+        index.add(row_id, query)
+    assert len(index) == len(_QUERIES)
+
+    rows, scores = index.search("DeviceProcessEvents ProcessCommandLine has_any")
+    assert rows.tolist() == [0, 2]
+    assert scores[0] > scores[1] > 0
+    rows, _ = index.search("DeviceProcessEvents", top_k=1)
+    assert len(rows) == 1
+    assert len(index.search("nomatch")[0]) == 0
+
+    index.add(3, "SigninLogs | take 1")
+    rows, _ = index.search("SigninLogs")
+    assert sorted(rows.tolist()) == [1, 3]
+    index.remove(1)
+    assert index.search("SigninLogs")[0].tolist() == [3]
+    assert index.search("SecurityAlert")[0].tolist() == []
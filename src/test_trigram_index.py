@@ -0,0 +1,48 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test trigram index."""
+import pytest
+
+from .trigram_index import TrigramIndex, get_trigrams, required_literals
+
+__author__ = "Ian Hellen"
+
+_VALUES = ["AADSigninLogs", "SecurityAlert", "SigninLogs | take 1", None, "AAD"]
+
+
+@pytest.mark.parametrize(
+    "pattern, expected",
+    [
+        ("^AAD.*", [["aad"]]),
+        (".*Sign[iI]nLogs.*", [["sign", "nlogs"]]),
+        ("abc|defg", [["abc"], ["defg"]]),
+        ("(foo|barbaz)", [["foo"], ["barbaz"]]),
+        (r".*cmd\.exe$", [["cmd.exe"]]),
+        ("a.*b", None),
+        ("(abc|d)", None),
+        ("x(abc|def)yz(ghi)", [["abc", "ghi"], ["def", "ghi"]]),
+        ("[", None),
+    ],
+)
+def test_required_literals(pattern, expected):
+    """Test extraction of required literals."""
+    assert required_literals(pattern) == expected
+
+
+def test_trigram_index():
+    """Test candidate rows from trigram index."""
+    index = TrigramIndex.from_values(_VALUES)
+    assert get_trigrams("ABcd") == {"abc", "bcd"}
+    assert index.candidates(".*signin.*").tolist() == [0, 2]
+    assert index.candidates("^AAD.*").tolist() == [0, 4]
+    assert index.candidates(".*(alert|take).*").tolist() == [1, 2]
+    assert index.candidates(".*xyz.*").tolist() == []
+    assert index.candidates(".*") is None
+
+    index.set_row(1, "SigninLogs")
+    index.set_row(5, "MoreSigninLogs")
+    assert index.candidates(".*signin.*").tolist() == [0, 1, 2, 5]
+    assert index.candidates(".*alert.*").tolist() == []
@@ -0,0 +1,147 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Test copy-on-write store versions."""
+import threading
+
+import pytest
+
+from .data_store import DataStore
+from .kql_query import KqlQuery
+from .test_data_store import get_random_query
+from .versioned_store import VersionedStore
+
+__author__ = "Ian Hellen"
+
+
+def _get_queries(start, count, tactic="Compromise"):
+    queries = [KqlQuery(**get_random_query(idx)) for idx in range(start, start + count)]
+    for query in queries:
+        query.attributes["tactics"] = [tactic]
+    return queries
+
+
+def test_datastore_copy_on_write(tmp_path):
+    """Test that changes to a copy are not seen by the original store."""
+    ds = DataStore(_get_queries(0, 4))
+    ds.search_text("SecurityAlert")
+    assert len(ds.find_queries(query_name={"matches": "query_1"})) == 1
+    ds_copy = ds.copy()
+
+    replacement = KqlQuery(**get_random_query(1))
+    replacement.query_id = ds.queries[1].query_id
+    replacement.query_name = "replaced"
+    replacement.attributes["tactics"] = ["LateralMovement"]
+    ds_copy.add_queries([replacement, *_get_queries(4, 2, "Persistence")])
+    ds_copy.add_kql_properties(ds.queries[0].query_id, {"Tables": ["SigninLogs"]})
+
+    assert len(ds_copy) == 6
+    assert len(ds_copy.find_queries(tactics=["Persistence"])) == 2
+    assert len(ds_copy.find_queries(tables=["SigninLogs"])) == 1
+    assert list(ds_copy.find_queries(tactics=["LateralMovement"])["query_name"]) == [
+        "replaced"
+    ]
+    assert len(ds_copy.search_text("SecurityAlert", top_k=10)) == 6
+    # the original is unchanged
+    assert len(ds) == 4
+    assert len(ds.find_queries(tactics=["Compromise"])) == 4
+    assert not len(ds.find_queries(tactics=["Persistence"]))
+    assert not len(ds.find_queries(tables=["SigninLogs"]))
+    assert len(ds.find_queries(query_name={"matches": "query_1"})) == 1
+    assert list(ds.to_df()["query_name"]) == [f"query_{idx}" for idx in range(4)]
+    assert len(ds.search_text("SecurityAlert", top_k=10)) == 4
+
+    # copies of opened (memory-mapped) stores
+    ds.save(tmp_path / "queries.kqlstore")
+    opened = DataStore.open(tmp_path / "queries.kqlstore")
+    opened_copy = opened.copy()
+    opened_copy.add_queries([replacement])
+    assert opened.to_df()["query_name"].iloc[1] == "query_1"
+    assert opened_copy.to_df()["query_name"].iloc[1] == "replaced"
+
+
+def test_datastore_freeze():
+    """Test that a frozen store cannot be changed."""
+    ds = DataStore(_get_queries(0, 2))
+    assert not ds.read_only
+    assert ds.freeze() is ds
+    assert ds.read_only
+    with pytest.raises(RuntimeError):
+        ds.add_queries(_get_queries(2, 1))
+    with pytest.raises(RuntimeError):
+        ds.add_query(_get_queries(2, 1)[0])
+    with pytest.raises(RuntimeError):
+        ds.add_kql_properties(ds.queries[0].query_id, {"Tables": ["SigninLogs"]})
+    assert len(ds) == 2
+    assert not ds.copy().read_only
+
+
+def test_versioned_store_update():
+    """Test publishing new versions of a store."""
+    store = VersionedStore(DataStore(_get_queries(0, 3)))
+    assert store.version == 0
+    pinned = store.snapshot()
+    assert pinned.read_only
+
+    with store.update() as new_ds:
+        new_ds.add_queries(_get_queries(3, 2))
+        # not published until the update completes
+        assert len(store) == 3
+    assert store.version == 1
+    assert len(store) == len(store.snapshot()) == 5
+    assert len(pinned) == 3
+
+    with pytest.raises(ValueError):
+        with store.update() as new_ds:
+            new_ds.add_queries(_get_queries(5, 2))
+            raise ValueError("failed update")
+    assert store.version == 1
+    assert len(store.snapshot()) == 5
+
+    assert store.publish(DataStore(_get_queries(0, 1))) == 2
+    assert len(store.snapshot()) == 1
+    assert store.snapshot().read_only
+    assert len(VersionedStore().snapshot()) == 0
+
+
+def test_versioned_store_concurrent_readers():
+    """Test that readers see consistent snapshots during updates."""
+    query_ids = [query.query_id for query in _get_queries(0, 15)]
+    queries = _get_queries(0, 10)
+    for query, query_id in zip(queries, query_ids):
+        query.query_id = query_id
+    store = VersionedStore(DataStore(queries))
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            ds = store.snapshot()
+            try:
+                # every query of a version has the same tactic
+                size = len(ds)
+                tactic = ds.queries[0].attributes["tactics"][0]
+                assert len(ds.find_queries(tactics=[tactic])) == size
+                assert len(ds.find_queries(query_name={"matches": "query_.*"})) == size
+                assert len(ds.to_df()) == size
+            except Exception as err:  # pylint: disable=broad-except
+                errors.append(err)
+
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for version in range(1, 6):
+        # replace the tactic of the existing queries and add a query
+        new_queries = _get_queries(0, 10 + version, f"Tactic{version}")
+        for query, query_id in zip(new_queries, query_ids):
+            query.query_id = query_id
+        with store.update() as new_ds:
+            new_ds.add_queries(new_queries)
+    done.set()
+    for thread in readers:
+        thread.join()
+    assert not errors
+    assert store.version == 5
+    assert len(store.snapshot()) == 15
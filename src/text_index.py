@@ -0,0 +1,265 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Full text index with BM25 ranking for KQL queries."""
+import re
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from .inverted_index import ROW_ID_TYPE
+
+__author__ = "Ian Hellen"
+
+
+_KQL_TOKEN = re.compile(
+    r"""
+    (?P<string>@?"(?:[^"\\\n]|\\.)*"|@?'(?:[^'\\\n]|\\.)*')
+    |(?P<comment>//[^\n]*)
+    |(?P<ident>!?[A-Za-z_]\w*(?:-[A-Za-z_]\w*)*~?)
+    |(?P<number>\d+(?:\.\d+)?[A-Za-z]*)
+    |(?P<pipe>\|)
+    |(?P<punct>[^\s\w"'])
+    """,
+    re.VERBOSE,
+)
+_WORD = re.compile(r"\w+")
+# tabular operators - case-folded by normalize_kql when they follow a pipe
+_TABULAR_OPERATORS = frozenset(
+    """
+    as consume count distinct evaluate extend externaldata facet find fork
+    getschema invoke join limit lookup make-series mv-apply mv-expand order
+    parse parse-kv parse-where partition project project-away project-keep
+    project-rename project-reorder range reduce render sample sample-distinct
+    scan search serialize sort summarize take top top-hitters top-nested union
+    where
+    """.split()
+)
+
+
+def iter_kql_tokens(text: Optional[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the (kind, text) of the tokens in a KQL query.
+
+    Kinds are "string", "comment", "ident", "number", "pipe" and
+    "punct" (any other single non-space character). Whitespace is
+    not returned.
+
+    """
+    if not text:
+        return
+    for match in _KQL_TOKEN.finditer(text):
+        yield match.lastgroup, match.group()  # type: ignore
+
+
+def tokenize_kql(text: Optional[str]) -> List[str]:
+    """
+    Return the search terms in a KQL query (or markdown text).
+
+    Parameters
+    ----------
+    text : Optional[str]
+        The text to tokenize.
+
+    Returns
+    -------
+    List[str]
+        List of case-folded terms.
+
+    Notes
+    -----
+    Identifiers and KQL operators are kept intact, including
+    dashed operators (mv-expand, project-away) and string operators
+    such as has_any, !contains or in~. String literals are indexed
+    as the full literal value and as its component words. Words in
+    comments are also indexed. Pipe characters separating query
+    stages are delimiters and are not returned as terms.
+
+    """
+    terms: List[str] = []
+    for kind, token in iter_kql_tokens(text):
+        if kind in ("ident", "number"):
+            terms.append(token.casefold())
+        elif kind == "string":
+            literal = token.lstrip("@")[1:-1].casefold()
+            words = _WORD.findall(literal)
+            if literal and words != [literal]:
+                terms.append(literal)
+            terms.extend(words)
+        elif kind == "comment":
+            terms.extend(word.casefold() for word in _WORD.findall(token))
+    return terms
+
+
+def _iter_spaced_tokens(text: str) -> Iterator[Tuple[str, str, bool]]:
+    """
+    Yield the (kind, text, spaced) of the tokens in a KQL query.
+
+    `spaced` is True if the token follows whitespace. Characters
+    that are not part of a token (e.g. an unclosed quote) are
+    returned with the kind "other".
+
+    """
+    end = 0
+    for match in _KQL_TOKEN.finditer(text):
+        gap = text[end : match.start()]
+        end = match.end()
+        if gap.strip():
+            yield "other", gap.strip(), gap[0].isspace()
+            gap = gap[-1] if gap[-1].isspace() else ""
+        yield match.lastgroup, match.group(), bool(gap)  # type: ignore
+    if text[end:].strip():
+        yield "other", text[end:].strip(), text[end].isspace()
+
+
+def normalize_kql(text: Optional[str]) -> str:
+    """
+    Return the canonical form of a KQL query.
+
+    Parameters
+    ----------
+    text : Optional[str]
+        The query text.
+
+    Returns
+    -------
+    str
+        The query with comments removed, each run of whitespace
+        replaced by a single space and single spaces around pipes.
+
+    Notes
+    -----
+    Queries that differ only in formatting and comments have the
+    same canonical form. The changes are conservative - string
+    literals and identifiers (table, column and function names are
+    case-sensitive) are kept as they are, tokens are only separated
+    where the original query had whitespace (or a comment) between
+    them and only the names of tabular operators following a pipe
+    are case-folded.
+
+    """
+    if not text:
+        return ""
+    parts: List[str] = []
+    spaced = after_pipe = False
+    for kind, token, after_space in _iter_spaced_tokens(text):
+        spaced = spaced or after_space
+        if kind == "comment":
+            spaced = True
+            continue
+        if kind == "pipe":
+            parts.append(" | ")
+            spaced, after_pipe = False, True
+            continue
+        if after_pipe and kind == "ident" and token.casefold() in _TABULAR_OPERATORS:
+            token = token.casefold()
+        if spaced and not after_pipe:
+            parts.append(" ")
+        parts.append(token)
+        spaced = after_pipe = False
+    return "".join(parts).strip()
+
+
+class TextIndex:
+    """
+    Inverted index of terms with BM25 ranked search.
+
+    Parameters
+    ----------
+    k1 : float, optional
+        BM25 term frequency saturation, by default 1.2
+    b : float, optional
+        BM25 document length normalization, by default 0.75
+
+    """
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        """Initialize the index."""
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_terms: Dict[int, Dict[str, int]] = {}
+        self._doc_lengths = np.zeros(0, dtype=np.float64)
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        """Return the number of indexed documents."""
+        return len(self._doc_terms)
+
+    def add(self, row_id: int, text: Optional[str]):
+        """Add (or replace) the document for `row_id`."""
+        self.add_terms(row_id, tokenize_kql(text))
+
+    def add_terms(self, row_id: int, terms: List[str]):
+        """Add (or replace) the document for `row_id` from a list of terms."""
+        if row_id in self._doc_terms:
+            self.remove(row_id)
+        term_counts: Dict[str, int] = {}
+        for term in terms:
+            term_counts[term] = term_counts.get(term, 0) + 1
+        self._doc_terms[row_id] = term_counts
+        for term, count in term_counts.items():
+            self._postings.setdefault(term, {})[row_id] = count
+        if row_id >= len(self._doc_lengths):
+            new_lengths = np.zeros(max(row_id + 1, 2 * len(self._doc_lengths)))
+            new_lengths[: len(self._doc_lengths)] = self._doc_lengths
+            self._doc_lengths = new_lengths
+        self._doc_lengths[row_id] = len(terms)
+        self._total_length += len(terms)
+
+    def remove(self, row_id: int):
+        """Remove the document for `row_id`."""
+        term_counts = self._doc_terms.pop(row_id, None)
+        if term_counts is None:
+            return
+        for term in term_counts:
+            posting = self._postings[term]
+            del posting[row_id]
+            if not posting:
+                del self._postings[term]
+        self._total_length -= int(self._doc_lengths[row_id])
+        self._doc_lengths[row_id] = 0
+
+    def search(self, text: str, top_k: int = 10) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Return the best matching documents for `text`.
+
+        Parameters
+        ----------
+        text : str
+            The search text - this is tokenized in the same way
+            as the indexed documents.
+        top_k : int, optional
+            The maximum number of results to return, by default 10
+
+        Returns
+        -------
+        Tuple[np.ndarray, np.ndarray]
+            The row ids and BM25 scores of the matching documents,
+            ordered by descending score.
+
+        """
+        n_docs = len(self._doc_terms)
+        if not n_docs or top_k < 1:
+            return np.empty(0, dtype=ROW_ID_TYPE), np.empty(0)
+        avg_length = self._total_length / n_docs or 1.0
+        scores = np.zeros(len(self._doc_lengths))
+        for term in set(tokenize_kql(text)):
+            posting = self._postings.get(term)
+            if not posting:
+                continue
+            rows = np.fromiter(posting.keys(), dtype=ROW_ID_TYPE, count=len(posting))
+            freqs = np.fromiter(posting.values(), dtype=np.float64, count=len(posting))
+            idf = np.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            norm = self.k1 * (
+                1 - self.b + self.b * self._doc_lengths[rows] / avg_length
+            )
+            scores[rows] += idf * freqs * (self.k1 + 1) / (freqs + norm)
+
+        matches = np.flatnonzero(scores)
+        if len(matches) > top_k:
+            matches = matches[np.argpartition(-scores[matches], top_k - 1)[:top_k]]
+        matches = matches[np.argsort(-scores[matches], kind="stable")]
+        return matches.astype(ROW_ID_TYPE), scores[matches]
@@ -0,0 +1,167 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Trigram index to pre-filter substring and regular expression searches."""
+import re
+from typing import Iterable, List, Optional, Set
+
+import numpy as np
+
+from .inverted_index import InvertedIndex, intersect_postings, union_postings
+
+try:
+    from re import _parser as sre_parse  # type: ignore
+except ImportError:  # Python < 3.11
+    import sre_parse  # type: ignore  # pylint: disable=deprecated-module
+
+__author__ = "Ian Hellen"
+
+
+_NGRAM = 3
+_MAX_ALTERNATIVES = 16
+
+
+def get_trigrams(text: Optional[str]) -> Set[str]:
+    """Return the set of (lower-cased) trigrams in `text`."""
+    if not isinstance(text, str):
+        return set()
+    text = text.lower()
+    return {text[idx : idx + _NGRAM] for idx in range(len(text) - _NGRAM + 1)}
+
+
+def required_literals(pattern: str) -> Optional[List[List[str]]]:
+    """
+    Return literal strings that any match of `pattern` must contain.
+
+    Parameters
+    ----------
+    pattern : str
+        Regular expression
+
+    Returns
+    -------
+    Optional[List[List[str]]]
+        A list of alternatives, each alternative is a list of literals
+        that must all appear in a matching string. None if no literals
+        of at least three characters are required.
+
+    """
+    try:
+        parsed = sre_parse.parse(pattern)
+    except re.error:
+        return None
+    return _get_required_literals(list(parsed))
+
+
+def _get_required_literals(items) -> Optional[List[List[str]]]:
+    """Return required literals from a parsed regular expression."""
+    if len(items) == 1 and items[0][0] is sre_parse.BRANCH:
+        branches: List[List[str]] = []
+        for branch in items[0][1][1]:
+            branch_literals = _get_required_literals(list(branch))
+            if branch_literals is None:
+                return None
+            branches.extend(branch_literals)
+        return branches
+    if len(items) == 1 and items[0][0] is sre_parse.SUBPATTERN:
+        return _get_required_literals(list(items[0][1][-1]))
+
+    alternatives: List[List[str]] = [[]]
+    current: List[str] = []
+    for op_code, arg in items:
+        if op_code is sre_parse.LITERAL:
+            current.append(chr(arg))
+            continue
+        if op_code is sre_parse.AT:
+            # anchors and boundaries are zero width
+            continue
+        alternatives = [alt + ["".join(current)] for alt in alternatives]
+        current = []
+        if op_code is sre_parse.SUBPATTERN:
+            group_alternatives = _get_required_literals(list(arg[-1]))
+            if (
+                group_alternatives
+                and len(alternatives) * len(group_alternatives) <= _MAX_ALTERNATIVES
+            ):
+                alternatives = [
+                    alt + group_alt
+                    for alt in alternatives
+                    for group_alt in group_alternatives
+                ]
+    alternatives = [alt + ["".join(current)] for alt in alternatives]
+    alternatives = [
+        [literal.lower() for literal in alt if len(literal) >= _NGRAM]
+        for alt in alternatives
+    ]
+    if not all(alternatives):
+        return None
+    return alternatives
+
+
+class TrigramIndex:
+    """
+    Trigram index of the (lower-cased) text values of a column.
+
+    The index returns the candidate rows for a regular expression.
+    Candidate rows contain all of the trigrams of literal text
+    required by the expression - the expression must still be
+    matched against the candidates to remove false positives.
+
+    """
+
+    def __init__(self):
+        """Initialize the index."""
+        self._index = InvertedIndex()
+        # one more than the highest indexed row id
+        self.size = 0
+
+    @classmethod
+    def from_values(cls, values: Iterable[Optional[str]]) -> "TrigramIndex":
+        """Create an index from a sequence of (row-ordered) values."""
+        trigrams: List[str] = []
+        row_ids: List[int] = []
+        size = 0
+        for row_id, value in enumerate(values):
+            size = row_id + 1
+            value_trigrams = get_trigrams(value)
+            trigrams.extend(value_trigrams)
+            row_ids.extend([row_id] * len(value_trigrams))
+        trigram_index = cls()
+        trigram_index._index = InvertedIndex.from_pairs(trigrams, row_ids)
+        trigram_index.size = size
+        return trigram_index
+
+    def set_row(self, row_id: int, value: Optional[str]):
+        """Add or replace the value for `row_id`."""
+        self._index.set_row(row_id, get_trigrams(value))
+        self.size = max(self.size, row_id + 1)
+
+    def candidates(self, pattern: str) -> Optional[np.ndarray]:
+        """
+        Return the rows that could match `pattern`.
+
+        Parameters
+        ----------
+        pattern : str
+            Regular expression.
+
+        Returns
+        -------
+        Optional[np.ndarray]
+            Sorted array of candidate row ids or None if the
+            index cannot narrow down the candidates.
+
+        """
+        alternatives = required_literals(pattern)
+        if alternatives is None:
+            return None
+        return union_postings(
+            intersect_postings(
+                self._index.get(trigram)
+                for literal in literals
+                for trigram in get_trigrams(literal)
+            )
+            for literals in alternatives
+        )
@@ -0,0 +1,116 @@
+# -------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License. See License.txt in the project root for
+# license information.
+# --------------------------------------------------------------------------
+"""Copy-on-write versions of a DataStore for concurrent readers."""
+import threading
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple, Optional
+
+from .data_store import DataStore
+
+__author__ = "Ian Hellen"
+
+
+class StoreVersion(NamedTuple):
+    """A published version of the store."""
+
+    version: int
+    store: DataStore
+
+
+class VersionedStore:
+    """
+    Serve immutable DataStore snapshots while new versions are built.
+
+    Parameters
+    ----------
+    store : Optional[DataStore], optional
+        The initial version of the store, by default an empty store.
+
+    Notes
+    -----
+    Readers call `snapshot` to pin the current version and use it for
+    all of the reads of a request - e.g. a page render. A snapshot is a
+    frozen (read-only) DataStore and is never changed, so the reads see
+    a consistent store even while a new version is being published.
+
+    Writers either `publish` a new store (e.g. a store re-opened from
+    a refreshed file) or change a copy-on-write copy of the current
+    version in an `update` block. The new version replaces the current
+    one with a single reference assignment when it is complete, so the
+    read path takes no locks. Writers are serialized with a lock.
+
+    Examples
+    --------
+    >>>> store = VersionedStore(DataStore.open("queries.kqlstore"))
+    >>>> ds = store.snapshot()  # reader
+    >>>> ds.find_queries(tables=["SigninLogs"])
+    >>>> with store.update() as new_ds:  # writer
+    ....     new_ds.add_queries(queries)
+    >>>> store.publish(DataStore.open("queries.kqlstore"))  # reload
+
+    """
+
+    def __init__(self, store: Optional[DataStore] = None):
+        """Initialize the versioned store."""
+        self._current = StoreVersion(0, (store or DataStore()).freeze())
+        self._write_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of queries in the current version."""
+        return len(self._current.store)
+
+    @property
+    def version(self) -> int:
+        """Return the number of the current version."""
+        return self._current.version
+
+    def snapshot(self) -> DataStore:
+        """Return the current (read-only) version of the store."""
+        return self._current.store
+
+    def publish(self, store: DataStore) -> int:
+        """
+        Replace the current version with `store`.
+
+        Parameters
+        ----------
+        store : DataStore
+            The new version of the store. The store is frozen - it
+            must not be changed after it is published.
+
+        Returns
+        -------
+        int
+            The number of the new version.
+
+        """
+        with self._write_lock:
+            return self._publish(store)
+
+    @contextmanager
+    def update(self) -> Iterator[DataStore]:
+        """
+        Change a copy of the current version and publish it.
+
+        Yields
+        ------
+        DataStore
+            A writable copy of the current version. The copy is
+            published when the block exits without an exception.
+            Changes are discarded if there is an exception.
+
+        """
+        with self._write_lock:
+            store = self._current.store.copy()
+            yield store
+            self._publish(store)
+
+    def _publish(self, store: DataStore) -> int:
+        """Freeze and publish `store` (the caller holds the write lock)."""
+        store.freeze()
+        # a single assignment, so readers see either the old or new version
+        self._current = StoreVersion(self._current.version + 1, store)
+        return self._current.version